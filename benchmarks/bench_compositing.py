@@ -0,0 +1,47 @@
+"""
+Compares the number of item chunks read and wall time of compositing a synthetic stack with
+stackstac.mosaic, which reads every band of every item, against composite_stack, which
+reads a chunk's items one at a time and stops once the chunk is filled.
+
+Each item covers a random 90% of the pixels, so most chunks are filled after a few items.
+
+Run from the repository root with: python -m benchmarks.bench_compositing
+"""
+
+import time
+
+import dask
+import stackstac
+
+from benchmarks.synthetic import synthetic_stack
+from sample.compositing import CompositeMode, composite_stack
+
+
+def _measure(fn):
+    counter = {"reads": 0}
+    start = time.perf_counter()
+    with dask.config.set(scheduler="threads"):
+        fn(counter).compute()
+    return counter["reads"], time.perf_counter() - start
+
+
+def main(n_items: int = 20, size: int = 2048, chunk_size: int = 512):
+    rgb = ["red", "green", "blue"]
+    results = {
+        "stackstac.mosaic": _measure(
+            lambda c: stackstac.mosaic(synthetic_stack(n_items, size, chunk_size, c).sel(band=rgb), reverse=True)
+        ),
+    }
+    for mode in CompositeMode:
+        results[f"composite_stack ({mode})"] = _measure(
+            lambda c: composite_stack(synthetic_stack(n_items, size, chunk_size, c), mode=mode)
+        )
+
+    print(f"{n_items} items, {size}x{size}, {chunk_size}x{chunk_size} chunks")
+    print(f"{'method':>30} {'chunks read':>12} {'time (s)':>9}")
+    for method, (reads, elapsed) in results.items():
+        print(f"{method:>30} {reads:>12} {elapsed:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Compares wall time and peak (numpy) memory of writing a lazy mosaic with rioxarray's
+rio.to_raster, which computes it with the default Dask scheduler, against MosaicWriter,
+which computes and writes it in bounded batches of chunks.
+
+Run from the repository root with: python -m benchmarks.bench_mosaic_write
+"""
+
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from benchmarks.synthetic import synthetic_lazy_mosaic
+from sample.mosaic_writer import MosaicWriter
+
+
+def _measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    writer = MosaicWriter(num_threads=2, memory_limit_bytes=64 * 2**20, chunk_size=1024)
+    print(
+        f"{'shape':>12} {'to_raster (s)':>14} {'to_raster peak (MB)':>20} {'writer (s)':>11} {'writer peak (MB)':>17}"
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in [2048, 4096, 8192]:
+            mosaic = synthetic_lazy_mosaic(size, size)
+            to_raster_time, to_raster_peak = _measure(
+                lambda: (
+                    mosaic.clip(0, 255)
+                    .astype("uint8")
+                    .rio.to_raster(Path(tmp_dir) / "to_raster.tif", tiled=True, compress="deflate")
+                )
+            )
+            writer_time, writer_peak = _measure(lambda: writer.write(mosaic, Path(tmp_dir) / "writer.tif"))
+            print(
+                f"{f'{size}x{size}':>12} {to_raster_time:>14.2f} {to_raster_peak / 2**20:>20.1f}"
+                f" {writer_time:>11.2f} {writer_peak / 2**20:>17.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Compares file size, write time and read latency of the previous output formats (stripped,
+uncompressed GeoTIFFs from rio.to_raster for mosaics, tiled LZW GeoTIFFs for roads) against
+COGs written with sample.raster_io, for a mosaic-like and a road-like raster.
+
+Windowed reads open the file and read a random 256x256 window, like a chip loader. Preview
+reads open the file and read the whole raster decimated to 512 pixels wide, like a viewer
+zoomed out.
+
+Run from the repository root with: python -m benchmarks.bench_raster_io
+"""
+
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import rasterio
+import rasterio.transform
+from rasterio.windows import Window
+
+from sample.raster_io import CogOptions, Compression, cog_writer
+
+SIZE = 4096
+N_WINDOWED_READS = 200
+
+
+def _mosaic_values(rng) -> np.ndarray:
+    # Smooth gradients with pixel noise, roughly like a true-color mosaic
+    y, x = np.mgrid[0:SIZE, 0:SIZE] / SIZE
+    base = 60 + 40 * np.sin(8 * x) * np.cos(6 * y)
+    values = np.stack([base + 10 * band for band in range(3)])
+    values += rng.normal(0, 8, size=values.shape)
+    return np.clip(values, 1, 255).astype(np.uint8)
+
+
+def _road_values(rng) -> np.ndarray:
+    # Sparse horizontal and vertical lines of each road class
+    values = np.zeros((3, SIZE, SIZE), dtype=np.uint8)
+    for band in range(3):
+        values[band, rng.integers(0, SIZE, 40 * (band + 1)), :] = 255
+        values[band, :, rng.integers(0, SIZE, 40 * (band + 1))] = 255
+    return values
+
+
+def _profile():
+    return dict(
+        driver="GTiff",
+        width=SIZE,
+        height=SIZE,
+        count=3,
+        dtype="uint8",
+        nodata=0,
+        crs="EPSG:32618",
+        transform=rasterio.transform.from_origin(500000, 4000000, 10, 10),
+    )
+
+
+def _write_gtiff(path, values, **options):
+    with rasterio.open(path, "w", **_profile(), **options) as dst:
+        dst.write(values)
+
+
+def _write_cog(path, values, cog_options):
+    with cog_writer(path, _profile(), 512, cog_options) as dst:
+        dst.write(values)
+
+
+def _windowed_read_ms(path, rng) -> float:
+    offsets = rng.integers(0, SIZE - 256, size=(N_WINDOWED_READS, 2))
+    start = time.perf_counter()
+    for row, col in offsets:
+        with rasterio.open(path) as ds:
+            ds.read(window=Window(int(col), int(row), 256, 256))
+    return (time.perf_counter() - start) / N_WINDOWED_READS * 1000
+
+
+def _preview_read_ms(path) -> float:
+    start = time.perf_counter()
+    with rasterio.open(path) as ds:
+        ds.read(out_shape=(3, 512, 512))
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    rng = np.random.default_rng(0)
+    formats = {
+        "mosaic": [
+            ("to_raster (stripped)", lambda path, values: _write_gtiff(path, values)),
+            ("COG deflate", lambda path, values: _write_cog(path, values, CogOptions())),
+            ("COG zstd", lambda path, values: _write_cog(path, values, CogOptions(compress=Compression.Zstd))),
+        ],
+        "roads": [
+            (
+                "tiled LZW",
+                lambda path, values: _write_gtiff(
+                    path, values, compress="lzw", tiled=True, blockxsize=512, blockysize=512
+                ),
+            ),
+            ("COG deflate", lambda path, values: _write_cog(path, values, CogOptions())),
+            ("COG zstd", lambda path, values: _write_cog(path, values, CogOptions(compress=Compression.Zstd))),
+        ],
+    }
+    values_by_raster = {"mosaic": _mosaic_values(rng), "roads": _road_values(rng)}
+
+    print(
+        f"{'raster':>7} {'format':>21} {'size (MB)':>10} {'write (s)':>10} {'window read (ms)':>17}"
+        f" {'preview read (ms)':>18}"
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for raster, raster_formats in formats.items():
+            values = values_by_raster[raster]
+            for i, (name, write) in enumerate(raster_formats):
+                path = Path(tmp_dir) / f"{raster}_{i}.tif"
+                start = time.perf_counter()
+                write(path, values)
+                write_time = time.perf_counter() - start
+                print(
+                    f"{raster:>7} {name:>21} {path.stat().st_size / 2**20:>10.1f} {write_time:>10.2f}"
+                    f" {_windowed_read_ms(path, rng):>17.2f} {_preview_read_ms(path):>18.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
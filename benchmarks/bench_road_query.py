@@ -0,0 +1,55 @@
+"""
+Compares bounding box road queries using the STRtree-backed RoadQueryEngine against the
+previous full-scan approach (intersect every edge, then filter by road class).
+
+Run from the repository root with: python -m benchmarks.bench_road_query
+"""
+
+import time
+from pathlib import Path
+
+from shapely.geometry import box
+
+from sample.osm_road_data import OSMRoadData
+
+
+def _full_scan_query(osm_road_data: OSMRoadData, bbox: box) -> dict:
+    edges_gdf = osm_road_data.osm_graph_edges_gdf
+    edges_within_bbox = edges_gdf.intersection(bbox, align=False)
+    roads = {}
+    for code, road_type in enumerate(osm_road_data.road_query_engine.road_classes):
+        geoseries = edges_within_bbox[edges_gdf["road_class"] == code]
+        geoseries = geoseries[~geoseries.is_empty]
+        roads[road_type] = edges_gdf.loc[geoseries.index][["geometry"]]
+    return roads
+
+
+def _best_of(fn, repeats=5) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main(graphml_path: Path = Path("data/osm_networks/13.graphml.gz")):
+    osm_road_data = OSMRoadData(graphml_path)
+    minx, miny, maxx, maxy = osm_road_data.osm_graph_edges_gdf.total_bounds
+    center_x, center_y = (minx + maxx) / 2, (miny + maxy) / 2
+
+    print(f"{len(osm_road_data.road_query_engine)} edges in {graphml_path}")
+    print(f"{'bbox fraction':>14} {'roads':>8} {'full scan (ms)':>15} {'strtree (ms)':>13}")
+    for fraction in [0.01, 0.05, 0.1, 0.25, 0.5, 1.0]:
+        half_width = fraction * (maxx - minx) / 2
+        half_height = fraction * (maxy - miny) / 2
+        bbox = box(center_x - half_width, center_y - half_height, center_x + half_width, center_y + half_height)
+
+        n_roads = sum(len(gdf) for gdf in osm_road_data.get_roads_in_bbox(bbox).values())
+        full_scan_time = _best_of(lambda: _full_scan_query(osm_road_data, bbox))
+        strtree_time = _best_of(lambda: osm_road_data.get_roads_in_bbox(bbox))
+        print(f"{fraction:>14} {n_roads:>8} {1e3 * full_scan_time:>15.2f} {1e3 * strtree_time:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Compares wall time and peak (numpy) memory of road rasterization in
+OSMRoadData.road_image_from_bounding_rasterio_dataset against the previous approach, which
+rasterized each road class into its own array, stacked, rescaled and recast them. The
+windowed columns generate the same image one 512x512 block at a time.
+
+Run from the repository root with: python -m benchmarks.bench_road_rasterize
+"""
+
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import rasterio
+import rasterio.features
+import rasterio.vrt
+import rasterio.warp
+import rasterio.windows
+from shapely.geometry import box
+
+from benchmarks.synthetic import synthetic_dataset
+from sample.osm_road_data import ROAD_CLASS_ALL_TOUCHED, OSMRoadData
+
+
+def _legacy_road_image(osm_road_data: OSMRoadData, input_ds) -> np.ndarray:
+    warped_input_ds = rasterio.vrt.WarpedVRT(input_ds, crs=osm_road_data.osm_graph_edges_gdf.crs)
+    roads = osm_road_data.get_roads_in_bbox(box(*warped_input_ds.bounds))
+
+    road_imgs = []
+    for road_class, roads_gdf in roads.items():
+        road_img = np.zeros((warped_input_ds.height, warped_input_ds.width), dtype=np.uint8)
+        if len(roads_gdf) > 0:
+            road_img = rasterio.features.rasterize(
+                roads_gdf["geometry"],
+                out_shape=road_img.shape,
+                fill=0,
+                all_touched=ROAD_CLASS_ALL_TOUCHED[road_class],
+                dtype=rasterio.uint8,
+                transform=warped_input_ds.transform,
+            )
+        road_imgs.append(road_img)
+    warped_roads_img = np.stack(road_imgs)
+    warped_roads_img *= 255
+    warped_roads_img = warped_roads_img.astype("uint8")
+
+    output_roads_img = np.zeros((3, input_ds.height, input_ds.width), dtype=np.uint8)
+    output_roads_img, _ = rasterio.warp.reproject(
+        warped_roads_img,
+        output_roads_img,
+        src_transform=warped_input_ds.transform,
+        src_crs=warped_input_ds.crs,
+        dst_crs=input_ds.crs,
+        dst_transform=input_ds.transform,
+    )
+    return output_roads_img
+
+
+def _windowed_road_image(osm_road_data: OSMRoadData, input_ds, block_size=512):
+    roads_img = None
+    for row_off in range(0, input_ds.height, block_size):
+        for col_off in range(0, input_ds.width, block_size):
+            window = rasterio.windows.Window(
+                col_off,
+                row_off,
+                min(block_size, input_ds.width - col_off),
+                min(block_size, input_ds.height - row_off),
+            )
+            roads_img = osm_road_data.road_image_for_window(input_ds, window, out=roads_img)
+
+
+def _measure(fn, repeats=3):
+    timings, peaks = [], []
+    for _ in range(repeats):
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return result, min(timings), max(peaks)
+
+
+def main(graphml_path: Path = Path("data/osm_networks/13.graphml.gz")):
+    osm_road_data = OSMRoadData(graphml_path)
+    graph_crs = osm_road_data.osm_graph_edges_gdf.crs
+    graph_bounds = osm_road_data.osm_graph_edges_gdf.total_bounds
+
+    print(
+        f"{'shape':>12} {'legacy (ms)':>12} {'legacy peak (MB)':>17} {'new (ms)':>9} {'new peak (MB)':>14}"
+        f" {'windowed (ms)':>14} {'windowed peak (MB)':>19}"
+    )
+    for size in [1000, 2000, 4000]:
+        input_ds = synthetic_dataset(graph_bounds, graph_crs, "EPSG:4326", size, size)
+        out = np.zeros((3, size, size), dtype=np.uint8)
+
+        legacy_img, legacy_time, legacy_peak = _measure(lambda: _legacy_road_image(osm_road_data, input_ds))
+        new_img, new_time, new_peak = _measure(
+            lambda: osm_road_data.road_image_from_bounding_rasterio_dataset(input_ds, out=out)
+        )
+        assert np.array_equal(legacy_img, new_img)
+        _, windowed_time, windowed_peak = _measure(lambda: _windowed_road_image(osm_road_data, input_ds))
+        print(
+            f"{f'{size}x{size}':>12} {1e3 * legacy_time:>12.1f} {legacy_peak / 2**20:>17.1f}"
+            f" {1e3 * new_time:>9.1f} {new_peak / 2**20:>14.1f}"
+            f" {1e3 * windowed_time:>14.1f} {windowed_peak / 2**20:>19.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
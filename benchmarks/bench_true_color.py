@@ -0,0 +1,56 @@
+"""
+Compares wall time per megapixel and peak (numpy) memory of converting a lazy reflectance
+mosaic to a uint8 RGB image with xarray-spatial's true_color (which builds an RGBA image,
+then drops the alpha band), against stretch_to_uint8.
+
+Run from the repository root with: python -m benchmarks.bench_true_color
+"""
+
+import time
+import tracemalloc
+
+import dask
+import xrspatial.multispectral as ms
+
+from benchmarks.synthetic import synthetic_lazy_mosaic
+from sample.true_color import StretchMode, stretch_to_uint8
+
+
+def _xrspatial_true_color(mosaic):
+    rgb_mosaic = ms.true_color(*mosaic, nodata=0).isel(band=[0, 1, 2]).transpose("band", ...)
+    rgb_mosaic.attrs = mosaic.attrs.copy()
+    return rgb_mosaic
+
+
+def _measure(fn, mosaic):
+    tracemalloc.start()
+    start = time.perf_counter()
+    with dask.config.set(scheduler="threads", num_workers=2):
+        fn(mosaic).compute()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    methods = {
+        "true_color": _xrspatial_true_color,
+        "stretch (gain)": stretch_to_uint8,
+        "stretch (percentile)": lambda mosaic: stretch_to_uint8(mosaic, mode=StretchMode.Percentile),
+    }
+    # Compile true_color's numba kernels before timing it
+    _xrspatial_true_color(synthetic_lazy_mosaic(256, 256, chunk_size=256) / 1000).compute()
+
+    print(f"{'shape':>12} {'method':>22} {'ms/MP':>8} {'peak (MB)':>10}")
+    for size in [2048, 4096]:
+        # Reflectances in [0, 0.255)
+        mosaic = synthetic_lazy_mosaic(size, size) / 1000
+        megapixels = size * size / 1e6
+        for method, fn in methods.items():
+            elapsed, peak = _measure(fn, mosaic)
+            print(f"{f'{size}x{size}':>12} {method:>22} {1e3 * elapsed / megapixels:>8.1f} {peak / 2**20:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
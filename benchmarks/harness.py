@@ -0,0 +1,146 @@
+"""
+A minimal benchmark harness, in the style of asv: benchmarks are registered with the
+`benchmark` decorator, run once per parameter, and their results are saved as JSON keyed
+by the git commit, so runs of different commits can be compared with `compare`.
+
+A benchmark function takes a parameter and a scratch directory, does any setup (which
+isn't measured), and returns the callable to measure. The callable is timed `repeats`
+times, and then run once more under tracemalloc to record its peak (Python and numpy)
+memory. Allocations made by GDAL itself are not traced.
+"""
+
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+
+class Benchmark(NamedTuple):
+    name: str
+    fn: Callable[[Any, Path], Callable[[], Any]]
+    params: Sequence
+    repeats: int
+
+
+class BenchmarkResult(NamedTuple):
+    name: str
+    param: str
+    min_s: float
+    median_s: float
+    peak_bytes: int
+
+
+BENCHMARKS: List[Benchmark] = []
+
+
+def benchmark(name: str, params: Sequence = (None,), repeats: int = 3):
+    """
+    Registers a benchmark function (see the module docstring) under `name`.
+    """
+
+    def _register(fn):
+        BENCHMARKS.append(Benchmark(name, fn, tuple(params), repeats))
+        return fn
+
+    return _register
+
+
+def _measure(fn: Callable[[], Any], repeats: int):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        fn()
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(timings), float(np.median(timings)), peak_bytes
+
+
+def run_benchmarks(
+    work_dir: Path,
+    pattern: Optional[str] = None,
+    repeats: Optional[int] = None,
+    param_filter: Optional[Callable[[Benchmark, Any], bool]] = None,
+) -> List[BenchmarkResult]:
+    """
+    Runs the registered benchmarks whose name contains `pattern` (all of them by default),
+    printing each result as it completes. `repeats` overrides each benchmark's own number
+    of timed runs, and `param_filter` can skip some of a benchmark's parameters.
+    """
+    results = []
+    print(f"{'benchmark':<32} {'param':>12} {'min (s)':>10} {'median (s)':>11} {'peak (MB)':>10}")
+    for bench in BENCHMARKS:
+        if pattern is not None and pattern not in bench.name:
+            continue
+        for param in bench.params:
+            if param_filter is not None and not param_filter(bench, param):
+                continue
+            fn = bench.fn(param, work_dir)
+            min_s, median_s, peak_bytes = _measure(fn, repeats or bench.repeats)
+            result = BenchmarkResult(bench.name, str(param), min_s, median_s, peak_bytes)
+            print(f"{bench.name:<32} {result.param:>12} {min_s:>10.3f} {median_s:>11.3f} {peak_bytes / 2**20:>10.1f}")
+            results.append(result)
+    return results
+
+
+def _git_commit() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout
+        status = subprocess.run(["git", "status", "--porcelain"], capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit.strip(), "dirty": len(status.strip()) > 0}
+
+
+def save_results(results: List[BenchmarkResult], results_dir: Path) -> Path:
+    """
+    Saves results, with the git commit and machine they were measured on, to
+    `{results_dir}/{commit}.json` (or `{commit}-dirty.json` with uncommitted changes).
+    """
+    git = _git_commit()
+    name = (git["commit"] or "unknown")[:12] + ("-dirty" if git["dirty"] else "")
+    output_path = results_dir / f"{name}.json"
+    results_dir.mkdir(parents=True, exist_ok=True)
+    output_path.write_text(
+        json.dumps(
+            {
+                **git,
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "machine": {"platform": platform.platform(), "python": platform.python_version()},
+                "results": [result._asdict() for result in results],
+            },
+            indent=2,
+        )
+    )
+    return output_path
+
+
+def compare(baseline_path: Path, contender_path: Path, threshold: float = 1.1) -> bool:
+    """
+    Prints the change in time and peak memory of every benchmark measured in both result
+    files, marking those slower or larger than `threshold` times the baseline. Returns
+    whether any benchmark regressed.
+    """
+    baseline = {(r["name"], r["param"]): r for r in json.loads(baseline_path.read_text())["results"]}
+    contender = {(r["name"], r["param"]): r for r in json.loads(contender_path.read_text())["results"]}
+
+    regressed = False
+    print(f"{'benchmark':<32} {'param':>12} {'time ratio':>11} {'memory ratio':>13}")
+    for key in sorted(baseline.keys() & contender.keys()):
+        time_ratio = contender[key]["min_s"] / max(baseline[key]["min_s"], 1e-9)
+        memory_ratio = contender[key]["peak_bytes"] / max(baseline[key]["peak_bytes"], 1)
+        is_regression = time_ratio > threshold or memory_ratio > threshold
+        regressed |= is_regression
+        print(f"{key[0]:<32} {key[1]:>12} {time_ratio:>11.2f} {memory_ratio:>13.2f}{'  <-' if is_regression else ''}")
+    return regressed
@@ -0,0 +1,213 @@
+"""
+Offline benchmark suite of the road rasterization and mosaic pipeline. Road benchmarks use
+the bundled data/osm_networks/13.graphml.gz, and synthetic networks of 10x and 100x its
+edges (see scaled_road_network_graphml). Road images are rasterized on synthetic grids in
+several CRSs, and mosaics are composited from a synthetic Dask stack, so nothing is
+downloaded.
+
+Results are saved to benchmarks/results/{commit}.json, to compare between commits:
+
+    python -m benchmarks.suite run [--filter roads.] [--quick]
+    python -m benchmarks.suite compare benchmarks/results/{a}.json benchmarks/results/{b}.json
+"""
+
+import argparse
+import shutil
+import subprocess
+import sys
+import tempfile
+from functools import lru_cache
+from pathlib import Path
+
+import dask
+import numpy as np
+import rasterio.crs
+import rasterio.transform
+from shapely.geometry import box
+
+from benchmarks.harness import benchmark, compare, run_benchmarks, save_results
+from benchmarks.synthetic import (
+    scaled_road_network_graphml,
+    synthetic_cities_geojson,
+    synthetic_dataset,
+    synthetic_lazy_mosaic,
+    synthetic_stack,
+)
+from sample.city_catalog import CityCatalog
+from sample.compositing import CompositeMode, composite_stack
+from sample.mosaic_writer import MosaicWriter
+from sample.osm_road_data import OSMRoadData, coverage_grid
+
+GRAPHML_PATH = Path("data/osm_networks/13.graphml.gz")
+CITIES_GEOJSON_PATH = Path("data/city_ids_and_bounds.geojson")
+SCALES = (1, 10, 100)
+RASTER_CRSS = ("EPSG:32618", "EPSG:32617", "EPSG:3857", "EPSG:4326")
+RASTER_SIZE = 2048
+
+
+@lru_cache(maxsize=None)
+def _scaled_graphml_path(scale: int, work_dir: Path) -> Path:
+    return scaled_road_network_graphml(GRAPHML_PATH, scale, work_dir / "osm_networks")
+
+
+@lru_cache(maxsize=1)
+def _osm_road_data(scale: int, work_dir: Path) -> OSMRoadData:
+    return OSMRoadData(_scaled_graphml_path(scale, work_dir))
+
+
+@lru_cache(maxsize=None)
+def _base_bounds(work_dir: Path):
+    return tuple(_osm_road_data(1, work_dir).osm_graph_edges_gdf.total_bounds)
+
+
+def _central_bounds(bounds, fraction: float):
+    minx, miny, maxx, maxy = bounds
+    center_x, center_y = (minx + maxx) / 2, (miny + maxy) / 2
+    half_width, half_height = fraction * (maxx - minx) / 2, fraction * (maxy - miny) / 2
+    return (center_x - half_width, center_y - half_height, center_x + half_width, center_y + half_height)
+
+
+@benchmark("roads.graphml_parse", repeats=1)
+def graphml_parse(_param, work_dir: Path):
+    cache_dir = work_dir / "graphml_parse_cache"
+
+    def _parse():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        return OSMRoadData(GRAPHML_PATH, cache_dir=cache_dir)
+
+    return _parse
+
+
+@benchmark("roads.load", params=SCALES)
+def roads_load(scale: int, work_dir: Path):
+    graphml_path = _scaled_graphml_path(scale, work_dir)
+    return lambda: OSMRoadData(graphml_path)
+
+
+@benchmark("roads.get_roads_in_bbox", params=SCALES, repeats=5)
+def roads_in_bbox(scale: int, work_dir: Path):
+    # The same bbox (a tenth of the original network's extent) on every scale
+    bbox = box(*_central_bounds(_base_bounds(work_dir), 0.1))
+    osm_road_data = _osm_road_data(scale, work_dir)
+    return lambda: osm_road_data.get_roads_in_bbox(bbox)
+
+
+@benchmark("roads.road_image_crs", params=RASTER_CRSS)
+def road_image_crs(crs: str, work_dir: Path):
+    osm_road_data = _osm_road_data(1, work_dir)
+    bounds = _central_bounds(_base_bounds(work_dir), 0.5)
+    input_ds = synthetic_dataset(bounds, osm_road_data.osm_graph_edges_gdf.crs, crs, RASTER_SIZE, RASTER_SIZE)
+    return lambda: osm_road_data.road_image_from_bounding_rasterio_dataset(input_ds)
+
+
+@benchmark("roads.road_image_crs_direct", params=RASTER_CRSS)
+def road_image_crs_direct(crs: str, work_dir: Path):
+    # Same as roads.road_image_crs, with roads transformed to the grid's CRS (and cached
+    # from the untimed first run on) instead of reprojecting the road raster
+    osm_road_data = _osm_road_data(1, work_dir)
+    bounds = _central_bounds(_base_bounds(work_dir), 0.5)
+    input_ds = synthetic_dataset(bounds, osm_road_data.osm_graph_edges_gdf.crs, crs, RASTER_SIZE, RASTER_SIZE)
+    osm_road_data.road_image_from_bounding_rasterio_dataset(input_ds, direct=True)
+    return lambda: osm_road_data.road_image_from_bounding_rasterio_dataset(input_ds, direct=True)
+
+
+@benchmark("roads.coverage", params=("supersampled", "downsampled"))
+def road_coverage(method: str, work_dir: Path):
+    # 100 m coverage of the whole network, either supersampled 8x (12.5 m) or by
+    # rasterizing a 10 m road image and downsampling it afterwards
+    osm_road_data = _osm_road_data(1, work_dir)
+    edges_gdf = osm_road_data.osm_graph_edges_gdf
+    crs = rasterio.crs.CRS.from_user_input(edges_gdf.crs)
+    transform, width, height = coverage_grid(rasterio.transform.from_bounds(*edges_gdf.total_bounds, 1, 1), 1, 1, 100)
+    if method == "supersampled":
+        return lambda: osm_road_data.road_coverage_for_grid(crs, transform, width, height)
+
+    def _downsampled():
+        fine_img = osm_road_data.road_image_for_grid(
+            crs, transform * rasterio.Affine.scale(1 / 10), width * 10, height * 10, direct=True
+        )
+        return fine_img.reshape(3, height, 10, width, 10).mean(axis=(2, 4)).astype(np.uint8)
+
+    return _downsampled
+
+
+@benchmark("roads.road_image_scale", params=SCALES)
+def road_image_scale(scale: int, work_dir: Path):
+    # The whole (scaled) network on a fixed size grid, so every road is rasterized
+    osm_road_data = _osm_road_data(scale, work_dir)
+    edges_gdf = osm_road_data.osm_graph_edges_gdf
+    input_ds = synthetic_dataset(edges_gdf.total_bounds, edges_gdf.crs, edges_gdf.crs, RASTER_SIZE, RASTER_SIZE)
+    return lambda: osm_road_data.road_image_from_bounding_rasterio_dataset(input_ds)
+
+
+@benchmark("mosaic.composite", params=[str(mode) for mode in CompositeMode])
+def mosaic_composite(mode: str, work_dir: Path):
+    composite_mode = next(m for m in CompositeMode if str(m) == mode)
+
+    def _composite():
+        with dask.config.set(scheduler="threads"):
+            return composite_stack(synthetic_stack(20, RASTER_SIZE, 512), mode=composite_mode).compute()
+
+    return _composite
+
+
+@benchmark("mosaic.write", repeats=2)
+def mosaic_write(_param, work_dir: Path):
+    mosaic = synthetic_lazy_mosaic(4096, 4096)
+    writer = MosaicWriter(num_threads=2, memory_limit_bytes=64 * 2**20)
+    return lambda: writer.write(mosaic, work_dir / "mosaic.tif")
+
+
+@benchmark("cities.load", params=("geopandas", "catalog"))
+def cities_load(method: str, work_dir: Path):
+    # 10k cities, read into a GeoDataFrame as stages used to, or loaded from the catalog's
+    # cache (built in the untimed first run)
+    geojson_path = synthetic_cities_geojson(CITIES_GEOJSON_PATH, 10_000, work_dir / "cities")
+    if method == "geopandas":
+        import geopandas as gpd
+
+        return lambda: gpd.read_file(geojson_path)
+    return lambda: CityCatalog.from_geojson(geojson_path)
+
+
+@benchmark(
+    "startup.import",
+    params=("sample.cli", "sample.chip_exporter", "sample.osm_road_generator", "sample.sentinel_cities_downloader"),
+    repeats=5,
+)
+def startup_import(module: str, work_dir: Path):
+    # A fresh interpreter importing a stage's entry point, as a spawned worker or a small
+    # CLI invocation would. sample.cli should stay close to the bare interpreter's startup.
+    return lambda: subprocess.run([sys.executable, "-c", f"import {module}"], check=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the road and mosaic pipeline.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run benchmarks and save their results")
+    run_parser.add_argument("--filter", default=None, help="Only run benchmarks whose name contains this")
+    run_parser.add_argument("--quick", action="store_true", help="One timed run each, without the 100x network")
+    run_parser.add_argument("--results-dir", type=Path, default=Path("benchmarks/results"))
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two saved results")
+    compare_parser.add_argument("baseline", type=Path)
+    compare_parser.add_argument("contender", type=Path)
+    compare_parser.add_argument("--threshold", type=float, default=1.1)
+
+    args = parser.parse_args()
+    if args.command == "compare":
+        sys.exit(1 if compare(args.baseline, args.contender, args.threshold) else 0)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        results = run_benchmarks(
+            Path(work_dir),
+            pattern=args.filter,
+            repeats=1 if args.quick else None,
+            param_filter=(lambda bench, param: param != 100) if args.quick else None,
+        )
+    print(f"Saved results to {save_results(results, args.results_dir)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Helpers to create synthetic inputs for benchmarks, so they can run without downloading imagery.
+"""
+
+import json
+import math
+import threading
+from pathlib import Path
+from typing import Optional, Sequence
+
+import dask.array as da
+import numpy as np
+import rasterio
+import rasterio.io
+import rasterio.transform
+import rasterio.warp
+import rioxarray  # noqa: F401
+import shapely
+import xarray as xr
+
+from sample.osm_road_data import SIMPLE_TYPE_TO_OSM_HIGHWAY_TYPE_MAPPING
+from sample.road_network_cache import (
+    RoadNetwork,
+    load_road_network,
+    road_network_cache_path,
+    write_road_network,
+)
+from sample.utils import file_sha256, json_sha256
+
+
+def synthetic_dataset(
+    bounds: Sequence[float],
+    bounds_crs,
+    dst_crs,
+    width: int,
+    height: int,
+    count: int = 3,
+) -> rasterio.io.DatasetReader:
+    """
+    Returns an in-memory uint8 dataset of the given size in `dst_crs`, covering `bounds`
+    (given in `bounds_crs`). The returned dataset keeps its MemoryFile alive.
+    """
+    dst_bounds = rasterio.warp.transform_bounds(bounds_crs, dst_crs, *bounds)
+    transform = rasterio.transform.from_bounds(*dst_bounds, width, height)
+
+    memfile = rasterio.io.MemoryFile()
+    with memfile.open(
+        driver="GTiff",
+        width=width,
+        height=height,
+        count=count,
+        dtype="uint8",
+        crs=dst_crs,
+        transform=transform,
+    ) as dst:
+        dst.write(np.zeros((count, height, width), dtype=np.uint8))
+    ds = memfile.open()
+    ds._benchmark_memfile = memfile
+    return ds
+
+
+def synthetic_lazy_mosaic(width: int, height: int, count: int = 3, chunk_size: int = 1024) -> xr.DataArray:
+    """
+    Returns a lazy float64 (band, y, x) mosaic in EPSG:32618 with values in [0, 255), computed
+    chunk by chunk like a stackstac mosaic.
+    """
+    data = da.random.RandomState(0).uniform(0, 255, size=(count, height, width), chunks=(1, chunk_size, chunk_size))
+    mosaic = xr.DataArray(data, dims=("band", "y", "x"))
+    transform = rasterio.transform.from_origin(500000, 4000000, 10, 10)
+    return mosaic.rio.write_crs("EPSG:32618").rio.write_transform(transform)
+
+
+def synthetic_stack(n_items: int, size: int, chunk_size: int, counter: Optional[dict] = None) -> xr.DataArray:
+    """
+    Returns a lazy (time, band, y, x) stack of `n_items` items with red, green, blue and scl
+    bands, like a stackstac stack. Each item covers a random 90% of the pixels (the same for
+    all its bands), and reading a chunk increments `counter["reads"]`, if given.
+    """
+    lock = threading.Lock()
+
+    def _read_chunk(block_info=None):
+        location = block_info[None]["array-location"]
+        shape = tuple(stop - start for start, stop in location)
+        if counter is not None:
+            with lock:
+                counter["reads"] += 1
+        # All bands of an item share the same cloud mask
+        (t, _), (band, _), (y, _), (x, _) = location
+        clear = np.random.default_rng((t, y, x)).uniform(size=shape) < 0.9
+        if band == 3:
+            return np.where(clear, 4.0, 9.0)
+        values = np.random.default_rng((t, band, y, x)).uniform(1, 255, size=shape)
+        return np.where(clear, values, np.nan)
+
+    data = da.map_blocks(
+        _read_chunk,
+        chunks=((1,) * n_items, (1,) * 4, *[(chunk_size,) * (size // chunk_size)] * 2),
+        dtype=np.float64,
+    )
+    return xr.DataArray(data, dims=("time", "band", "y", "x"), coords={"band": ["red", "green", "blue", "scl"]})
+
+
+def scaled_road_network_graphml(osm_graphml_path: Path, scale: int, output_dir: Path) -> Path:
+    """
+    Returns a stand-in graphml path for a road network with `scale` times the edges of the
+    one in `osm_graphml_path`, made of copies of it tiled side by side. Only its road
+    network cache holds the roads (the file itself is a placeholder the cache is keyed
+    on), so OSMRoadData loads it like any other cached graphml, without parsing a huge
+    graphml file.
+    """
+    if scale == 1:
+        return osm_graphml_path
+
+    road_network = load_road_network(osm_graphml_path, SIMPLE_TYPE_TO_OSM_HIGHWAY_TYPE_MAPPING)
+    minx, miny, maxx, maxy = shapely.total_bounds(road_network.geometries)
+    n_cols = math.ceil(math.sqrt(scale))
+    geometries = np.concatenate(
+        [
+            shapely.transform(
+                road_network.geometries,
+                lambda coords, i=i: coords + [(i % n_cols) * (maxx - minx), (i // n_cols) * (maxy - miny)],
+            )
+            for i in range(scale)
+        ]
+    )
+    scaled_road_network = RoadNetwork(geometries, np.tile(road_network.road_class_codes, scale), road_network.crs)
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    scaled_graphml_path = output_dir / f"{osm_graphml_path.name.split('.')[0]}_x{scale}.graphml.gz"
+    scaled_graphml_path.write_text(f"{scale} tiled copies of {osm_graphml_path.name}")
+    stat = scaled_graphml_path.stat()
+    write_road_network(
+        scaled_road_network,
+        road_network_cache_path(scaled_graphml_path),
+        metadata={
+            "source": {
+                "name": scaled_graphml_path.name,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": file_sha256(scaled_graphml_path),
+            },
+            "mapping_sha256": json_sha256(SIMPLE_TYPE_TO_OSM_HIGHWAY_TYPE_MAPPING),
+        },
+    )
+    return scaled_graphml_path
+
+
+def synthetic_cities_geojson(cities_geojson_path: Path, n_cities: int, output_dir: Path) -> Path:
+    """
+    Writes a cities GeoJSON of `n_cities` copies of the (simplified) cities in
+    `cities_geojson_path`, centered on a grid of 1 degree cells, with unique IDs and names.
+    """
+    features = json.loads(cities_geojson_path.read_text())["features"]
+    templates = shapely.simplify(shapely.from_geojson([json.dumps(feature["geometry"]) for feature in features]), 0.002)
+    templates = [
+        shapely.transform(template, lambda coords, c=shapely.centroid(template): coords - [c.x, c.y])
+        for template in templates
+    ]
+
+    n_cols = math.ceil(math.sqrt(n_cities))
+    synthetic_features = []
+    for i in range(n_cities):
+        template = templates[i % len(templates)]
+        geometry = shapely.transform(template, lambda coords: coords + [i % n_cols - 180 + 0.5, i // n_cols - 80 + 0.5])
+        properties = {
+            "asset_identifier": i,
+            "asset_name": f"{features[i % len(features)]['properties']['asset_name']} {i}",
+        }
+        synthetic_features.append(
+            {"type": "Feature", "properties": properties, "geometry": json.loads(shapely.to_geojson(geometry))}
+        )
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    output_path = output_dir / f"cities_x{n_cities}.geojson"
+    output_path.write_text(json.dumps({"type": "FeatureCollection", "features": synthetic_features}))
+    return output_path
@@ -0,0 +1,344 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+from tqdm import tqdm
+
+from sample.utils import atomic_write_path, get_simple_logger, raster_grid_fingerprint
+
+CHIP_STORE_VERSION = 1
+
+# One row per chip: where it was cut from, and where it is stored
+CHIP_INDEX_DTYPE = np.dtype(
+    [
+        ("city_id", np.int64),
+        ("year", np.int16),
+        ("season", "U6"),
+        ("row", np.int32),
+        ("col", np.int32),
+        ("shard", np.int32),
+        ("offset", np.int32),
+    ]
+)
+
+
+class MosaicPair(NamedTuple):
+    """
+    An RGB mosaic and the road raster on its grid, to be cut into chips.
+    """
+
+    city_id: int
+    year: int
+    season: str
+    visual_tif_path: Path
+    road_tif_path: Path
+
+
+def _file_stamp(path: Path, root_path: Path) -> Dict:
+    stat = path.stat()
+    return {"path": path.relative_to(root_path).as_posix(), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _shard_paths(city_path: Path, shard: int) -> Tuple[Path, Path]:
+    return city_path / f"{shard:05d}.images.npy", city_path / f"{shard:05d}.roads.npy"
+
+
+class _ShardWriter:
+    """
+    Collects chips in memory and saves them as .npy shards of up to `shard_size` chips.
+    """
+
+    def __init__(self, city_path: Path, shard_size: int):
+        self.city_path = city_path
+        self.shard_size = shard_size
+        self.shard = 0
+        self.images = []
+        self.roads = []
+        self.index = []
+
+    def add(self, pair: MosaicPair, row: int, col: int, image: np.ndarray, roads: np.ndarray):
+        self.index.append((pair.city_id, pair.year, pair.season, row, col, self.shard, len(self.images)))
+        # Copied, so the strips the chips were cut from aren't kept alive
+        self.images.append(image.copy())
+        self.roads.append(roads.copy())
+        if len(self.images) == self.shard_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.images) == 0:
+            return
+        images_path, roads_path = _shard_paths(self.city_path, self.shard)
+        np.save(images_path, np.stack(self.images))
+        np.save(roads_path, np.stack(self.roads))
+        self.shard += 1
+        self.images = []
+        self.roads = []
+
+
+class ChipExporter:
+    """
+    Cuts aligned, fixed-size chips out of the RGB mosaics in `root_s2_img_path` and their
+    road rasters in `root_osm_img_path`, and stores them as a chip store in `output_path`
+    that ChipDataset can read with random access.
+
+    Chips are `chip_size` x `chip_size` pixels, cut every `stride` pixels (`chip_size` by
+    default, i.e. without overlap), and read one strip of chip rows at a time with windowed
+    reads. Chips with more than `max_nodata_fraction` of their RGB pixels as nodata (0 in
+    all bands) are skipped.
+
+    Each city is exported on its own, to `{output_path}/{city_id}`, as pairs of image and
+    road .npy shards of up to `shard_size` chips (with shape (n, 3, chip_size, chip_size)),
+    plus an index of its chips. So a worker holds at most one shard and one strip of chips
+    in memory. Cities are written to a temporary folder that is moved into place once
+    complete. Cities whose export settings and input rasters (paths, sizes and mtimes, as
+    recorded in their settings.json) are unchanged are skipped unless `force` is set, so new
+    mosaics or regenerated road rasters cause a city to be exported again.
+    Once all cities are exported, their indices are merged into the store's index.
+
+    Road rasters are looked up at the mosaic's own relative path (as generated in per-grid
+    mode) and then at `{city_id}.tif`, and are only used if they are on the mosaic's grid.
+    """
+
+    def __init__(
+        self,
+        root_s2_img_path: Path = Path("data/sentinel2_images"),
+        root_osm_img_path: Path = Path("data/osm_images"),
+        output_path: Path = Path("data/chips"),
+        chip_size: int = 256,
+        stride: Optional[int] = None,
+        shard_size: int = 256,
+        max_nodata_fraction: float = 0.5,
+        pool_size: int = os.cpu_count() // 2,
+    ):
+        self.logger = get_simple_logger(self.__class__.__name__)
+        self.root_s2_img_path = root_s2_img_path
+        self.root_osm_img_path = root_osm_img_path
+        self.output_path = output_path
+        self.chip_size = chip_size
+        self.stride = stride or chip_size
+        self.shard_size = shard_size
+        self.max_nodata_fraction = max_nodata_fraction
+        self.pool_size = pool_size
+
+    def _settings(self) -> Dict:
+        return {
+            "version": CHIP_STORE_VERSION,
+            "chip_size": self.chip_size,
+            "stride": self.stride,
+            "shard_size": self.shard_size,
+            "max_nodata_fraction": self.max_nodata_fraction,
+        }
+
+    def _city_inputs(self, pairs: List[MosaicPair]) -> List[Dict]:
+        return [
+            {
+                "visual": _file_stamp(pair.visual_tif_path, self.root_s2_img_path),
+                "road": _file_stamp(pair.road_tif_path, self.root_osm_img_path),
+            }
+            for pair in pairs
+        ]
+
+    def get_city_ids(self) -> List[int]:
+        return sorted(int(path.name) for path in self.root_s2_img_path.iterdir() if path.name.isdigit())
+
+    def _get_road_tif_path(self, visual_tif_path: Path, city_id: int) -> Optional[Path]:
+        relative_path = visual_tif_path.relative_to(self.root_s2_img_path)
+        with rasterio.open(visual_tif_path) as visual_ds:
+            grid_fingerprint = raster_grid_fingerprint(visual_ds)
+
+        for road_tif_path in (self.root_osm_img_path / relative_path, self.root_osm_img_path / f"{city_id}.tif"):
+            if not road_tif_path.exists():
+                continue
+            with rasterio.open(road_tif_path) as road_ds:
+                if raster_grid_fingerprint(road_ds) == grid_fingerprint:
+                    return road_tif_path
+        return None
+
+    def get_city_mosaic_pairs(self, city_id: int) -> List[MosaicPair]:
+        pairs = []
+        for visual_tif_path in sorted((self.root_s2_img_path / str(city_id)).glob("*/*.tif")):
+            road_tif_path = self._get_road_tif_path(visual_tif_path, city_id)
+            if road_tif_path is None:
+                self.logger.warning(f"Failed to find a road raster on the grid of {visual_tif_path}")
+                continue
+            year = int(visual_tif_path.parent.name)
+            pairs.append(MosaicPair(city_id, year, visual_tif_path.stem, visual_tif_path, road_tif_path))
+        return pairs
+
+    def _iter_chips(self, pair: MosaicPair) -> Iterator[Tuple[int, int, np.ndarray, np.ndarray]]:
+        with rasterio.open(pair.visual_tif_path) as visual_ds, rasterio.open(pair.road_tif_path) as road_ds:
+            for row in range(0, visual_ds.height - self.chip_size + 1, self.stride):
+                strip_window = Window(0, row, visual_ds.width, self.chip_size)
+                image_strip = visual_ds.read(window=strip_window)
+                road_strip = road_ds.read(window=strip_window)
+
+                for col in range(0, visual_ds.width - self.chip_size + 1, self.stride):
+                    image = image_strip[:, :, col : col + self.chip_size]
+                    nodata_fraction = 1 - np.count_nonzero(image.any(axis=0)) / self.chip_size**2
+                    if nodata_fraction > self.max_nodata_fraction:
+                        continue
+                    yield row, col, image, road_strip[:, :, col : col + self.chip_size]
+
+    def _write_city(self, pairs: List[MosaicPair], city_path: Path):
+        shard_writer = _ShardWriter(city_path, self.shard_size)
+        for pair in pairs:
+            for row, col, image, roads in self._iter_chips(pair):
+                shard_writer.add(pair, row, col, image, roads)
+        shard_writer.flush()
+
+        np.save(city_path / "index.npy", np.array(shard_writer.index, dtype=CHIP_INDEX_DTYPE))
+        settings = {**self._settings(), "inputs": self._city_inputs(pairs)}
+        (city_path / "settings.json").write_text(json.dumps(settings, indent=2))
+
+    def _is_exported(self, city_path: Path, inputs: Optional[List[Dict]] = None) -> bool:
+        """
+        Whether a city was exported with the current settings and, if given, from `inputs`.
+        """
+        settings_path = city_path / "settings.json"
+        if not settings_path.exists():
+            return False
+        settings = json.loads(settings_path.read_text())
+        exported_inputs = settings.pop("inputs", None)
+        return settings == self._settings() and (inputs is None or exported_inputs == inputs)
+
+    def export_city(self, city_id: int, force: bool = False) -> Optional[int]:
+        """
+        Exports the chips of one city, returning the city ID if it failed.
+        """
+        city_path = self.output_path / str(city_id)
+        try:
+            pairs = self.get_city_mosaic_pairs(city_id)
+        except rasterio.errors.RasterioIOError as e:
+            self.logger.error(f"Failed to open the rasters of city {city_id}: {e}")
+            return city_id
+        if not force and self._is_exported(city_path, self._city_inputs(pairs)):
+            return None
+
+        self.output_path.mkdir(parents=True, exist_ok=True)
+        tmp_path = Path(tempfile.mkdtemp(prefix=f".{city_id}.", dir=self.output_path))
+        try:
+            self._write_city(pairs, tmp_path)
+            if city_path.exists():
+                shutil.rmtree(city_path)
+            os.replace(tmp_path, city_path)
+        except Exception as e:
+            self.logger.exception(f"Failed to export chips of city {city_id}: {e}")
+            return city_id
+        finally:
+            if tmp_path.exists():
+                shutil.rmtree(tmp_path)
+        return None
+
+    def _export_city_helper(self, args) -> Optional[int]:
+        return self.export_city(*args)
+
+    def write_index(self, city_ids: List[int]):
+        """
+        Merges the indices of the exported cities into the store's index. Shards are
+        numbered across the store, in the order of `city_ids`.
+        """
+        shards = []
+        indices = []
+        for city_id in city_ids:
+            city_path = self.output_path / str(city_id)
+            if not self._is_exported(city_path):
+                continue
+            index = np.load(city_path / "index.npy")
+            n_shards = int(index["shard"].max()) + 1 if len(index) > 0 else 0
+            index["shard"] += len(shards)
+            shards.extend(
+                [path.as_posix() for path in _shard_paths(Path(str(city_id)), shard)] for shard in range(n_shards)
+            )
+            indices.append(index)
+
+        index = np.concatenate(indices) if indices else np.zeros(0, dtype=CHIP_INDEX_DTYPE)
+        with atomic_write_path(self.output_path / "index.npy") as tmp_path:
+            with open(tmp_path, "wb") as f:
+                np.save(f, index)
+        with atomic_write_path(self.output_path / "metadata.json") as tmp_path:
+            tmp_path.write_text(json.dumps({**self._settings(), "n_chips": len(index), "shards": shards}, indent=2))
+
+    def export_all(self, city_ids: Optional[List[int]] = None, parallel: bool = True, force: bool = False):
+        """
+        Exports the chips of all cities in `root_s2_img_path` (or only `city_ids`), in
+        parallel across a pool of `pool_size` workers, and writes the store's index.
+        """
+        if city_ids is None:
+            city_ids = self.get_city_ids()
+
+        args = [(city_id, force) for city_id in city_ids]
+        if parallel and len(args) > 1:
+            with Pool(min(self.pool_size, len(args))) as p:
+                r = list(
+                    tqdm(p.imap_unordered(self._export_city_helper, args), total=len(args), desc="Exporting chips")
+                )
+        else:
+            r = [self._export_city_helper(arg) for arg in tqdm(args, desc="Exporting chips")]
+
+        self.write_index(city_ids)
+        self.logger.info(f"Cities with errors: {[city_id for city_id in r if city_id is not None]}")
+
+
+class ChipDataset:
+    """
+    Random access to the chips of a store written by ChipExporter. Each item is an
+    (image, roads) pair of (3, chip_size, chip_size) uint8 arrays, read from memory-mapped
+    shards, so only the pages of the requested chips are read from disk. `index` holds the
+    city, year, season and pixel offset (row, col) of every chip.
+    """
+
+    def __init__(self, store_path: Path):
+        self.store_path = store_path
+        self.metadata = json.loads((store_path / "metadata.json").read_text())
+        self.index = np.load(store_path / "index.npy")
+        self.shards = {}
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def _get_shard(self, shard: int) -> Tuple[np.ndarray, np.ndarray]:
+        # Opened lazily, so the dataset stays cheap to pickle into data loader workers
+        if shard not in self.shards:
+            self.shards[shard] = tuple(
+                np.load(self.store_path / path, mmap_mode="r") for path in self.metadata["shards"][shard]
+            )
+        return self.shards[shard]
+
+    def __getitem__(self, i: int) -> Tuple[np.ndarray, np.ndarray]:
+        entry = self.index[i]
+        images, roads = self._get_shard(int(entry["shard"]))
+        return np.asarray(images[entry["offset"]]), np.asarray(roads[entry["offset"]])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["shards"] = {}
+        return state
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export aligned RGB and road chips from Sentinel-2 mosaics and road rasters."
+    )
+    parser.add_argument("--output", type=Path, default=Path("data/chips"))
+    parser.add_argument("--chip-size", type=int, default=256)
+    parser.add_argument("--stride", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() // 2)
+    parser.add_argument("--force", action="store_true", help="Re-export cities that were already exported")
+    args = parser.parse_args()
+
+    chip_exporter = ChipExporter(
+        output_path=args.output, chip_size=args.chip_size, stride=args.stride, pool_size=args.workers
+    )
+    chip_exporter.export_all(force=args.force)
+
+
+if __name__ == "__main__":
+    main()
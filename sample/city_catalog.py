@@ -0,0 +1,244 @@
+import fnmatch
+import json
+import sys
+from pathlib import Path
+from typing import Iterable, Iterator, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import shapely
+from pyproj import CRS, Transformer
+
+from sample.utils import atomic_write_path, file_sha256, get_simple_logger
+
+CITY_CATALOG_CACHE_VERSION = 1
+DEFAULT_CACHE_DIR_NAME = ".city_catalog_cache"
+
+logger = get_simple_logger(__name__)
+
+
+class City(NamedTuple):
+    """
+    What pool tasks need to know about a city: its ID, name and bounds (in the catalog's CRS).
+    """
+
+    city_id: int
+    name: str
+    bounds: Tuple[float, float, float, float]
+
+
+class CityCatalog:
+    """
+    Columnar catalog of cities: ID, name, bounds and WKB geometry arrays, loaded once from
+    the cities GeoJSON (see `from_geojson`) and shared by every stage, rather than each
+    stage reading the GeoJSON into its own GeoDataFrame.
+
+    Geometries are only decoded from WKB when they're needed for exact intersection tests,
+    and the STRtree over city bounds is built on the first spatial selection. Pool tasks
+    should be given `City` tuples (see `__iter__`) rather than the catalog itself, which
+    is what its owners' `__getstate__` methods drop.
+    """
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        names: np.ndarray,
+        bounds: np.ndarray,
+        geometries_wkb: np.ndarray,
+        crs: CRS,
+    ):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.names = np.asarray(names, dtype=str)
+        self.bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)
+        self.geometries_wkb = np.asarray(geometries_wkb, dtype=object)
+        self.crs = crs
+        assert len(self.ids) == len(self.names) == len(self.bounds) == len(self.geometries_wkb)
+
+        self._positions_by_id = {city_id: position for position, city_id in enumerate(self.ids.tolist())}
+        self._tree = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self) -> Iterator[City]:
+        for city_id, name, bounds in zip(self.ids.tolist(), self.names.tolist(), self.bounds.tolist()):
+            yield City(city_id, name, tuple(bounds))
+
+    def __contains__(self, city_id: int) -> bool:
+        return city_id in self._positions_by_id
+
+    def city(self, city_id: int) -> City:
+        position = self._positions_by_id[city_id]
+        return City(int(self.ids[position]), str(self.names[position]), tuple(self.bounds[position].tolist()))
+
+    def geometries(self, positions: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Decodes the geometries of the cities at `positions` (default: all cities).
+        """
+        geometries_wkb = self.geometries_wkb if positions is None else self.geometries_wkb[positions]
+        return shapely.from_wkb(geometries_wkb)
+
+    def city_bounds(self, city_id: int, crs=None) -> Tuple[float, float, float, float]:
+        """
+        Bounds of a city, in the catalog's CRS or transformed to `crs`.
+        """
+        bounds = tuple(self.bounds[self._positions_by_id[city_id]].tolist())
+        if crs is None or CRS.from_user_input(crs) == self.crs:
+            return bounds
+        transformer = Transformer.from_crs(self.crs, crs, always_xy=True)
+        return tuple(float(v) for v in transformer.transform_bounds(*bounds, densify_pts=21))
+
+    def take(self, positions: np.ndarray) -> "CityCatalog":
+        return CityCatalog(
+            self.ids[positions],
+            self.names[positions],
+            self.bounds[positions],
+            self.geometries_wkb[positions],
+            self.crs,
+        )
+
+    def select(
+        self,
+        ids: Optional[Iterable[int]] = None,
+        name_pattern: Optional[str] = None,
+        bbox: Optional[Sequence[float]] = None,
+    ) -> "CityCatalog":
+        """
+        The cities matching all of the given criteria, in catalog order: IDs in `ids`, names
+        matching the case-insensitive glob `name_pattern` (e.g. "san *"), and geometries
+        intersecting `bbox` (minx, miny, maxx, maxy, in the catalog's CRS).
+        """
+        selected = np.ones(len(self), dtype=bool)
+        if ids is not None:
+            selected &= np.isin(self.ids, np.fromiter(ids, dtype=np.int64))
+        if name_pattern is not None:
+            pattern = name_pattern.lower()
+            selected &= np.array([fnmatch.fnmatchcase(name.lower(), pattern) for name in self.names.tolist()], bool)
+        if bbox is not None:
+            selected &= np.isin(np.arange(len(self)), self._positions_intersecting(bbox))
+        return self.take(np.flatnonzero(selected))
+
+    def _positions_intersecting(self, bbox: Sequence[float]) -> np.ndarray:
+        if self._tree is None:
+            self._tree = shapely.STRtree(shapely.box(*self.bounds.T))
+        query_box = shapely.box(*bbox)
+        # The tree only holds bounds, so only the candidates' geometries are decoded
+        candidates = np.sort(self._tree.query(query_box))
+        return candidates[shapely.intersects(self.geometries(candidates), query_box)]
+
+    @classmethod
+    def from_geojson(
+        cls,
+        cities_geojson_path: Path,
+        id_property: str = "asset_identifier",
+        name_property: str = "asset_name",
+        cache_dir: Optional[Path] = None,
+    ) -> "CityCatalog":
+        """
+        Loads the catalog of a cities GeoJSON from its cache, (re)building the cache first
+        if it is missing or stale (checked by the GeoJSON's size, mtime and SHA-256, as for
+        road network caches).
+        """
+        if not cities_geojson_path.exists():
+            raise FileNotFoundError(cities_geojson_path)
+        cache_path = city_catalog_cache_path(cities_geojson_path, cache_dir)
+        source = {"name": cities_geojson_path.name, "id_property": id_property, "name_property": name_property}
+        catalog = _read_cache(cities_geojson_path, cache_path, source)
+        if catalog is None:
+            catalog = _parse_geojson(cities_geojson_path, id_property, name_property)
+            _write_cache(catalog, cities_geojson_path, cache_path, source)
+        return catalog
+
+
+def city_catalog_cache_path(cities_geojson_path: Path, cache_dir: Optional[Path] = None) -> Path:
+    """
+    Location of the cached catalog of a cities GeoJSON. By default, caches live next to the
+    GeoJSON, in a `.city_catalog_cache` folder.
+    """
+    if cache_dir is None:
+        cache_dir = cities_geojson_path.parent / DEFAULT_CACHE_DIR_NAME
+    return cache_dir / f"{cities_geojson_path.name}.npz"
+
+
+def _parse_geojson(cities_geojson_path: Path, id_property: str, name_property: str) -> CityCatalog:
+    logger.info(f"Building city catalog of {cities_geojson_path}...")
+    feature_collection = json.loads(cities_geojson_path.read_text())
+    features = feature_collection["features"]
+    # GeoJSON is lon/lat, unless the file has a (pre-RFC 7946) named CRS
+    crs_name = feature_collection.get("crs", {}).get("properties", {}).get("name", "EPSG:4326")
+
+    geometries = shapely.from_geojson([json.dumps(feature["geometry"]) for feature in features])
+    return CityCatalog(
+        [feature["properties"][id_property] for feature in features],
+        [str(feature["properties"].get(name_property, "")) for feature in features],
+        shapely.bounds(geometries),
+        shapely.to_wkb(geometries),
+        CRS.from_user_input(crs_name),
+    )
+
+
+def _write_cache(
+    catalog: CityCatalog, cities_geojson_path: Path, cache_path: Path, source: dict, sha256: Optional[str] = None
+):
+    # WKB is stored as one byte buffer with offsets, so the cache loads without pickle
+    wkb_lengths = np.fromiter((len(wkb) for wkb in catalog.geometries_wkb), dtype=np.int64, count=len(catalog))
+    stat = cities_geojson_path.stat()
+    metadata = {
+        "version": CITY_CATALOG_CACHE_VERSION,
+        "source": {**source, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns},
+        "sha256": file_sha256(cities_geojson_path) if sha256 is None else sha256,
+        "crs": catalog.crs.to_wkt(),
+    }
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    with atomic_write_path(cache_path) as tmp_path, open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            ids=catalog.ids,
+            names=catalog.names,
+            bounds=catalog.bounds,
+            wkb=np.frombuffer(b"".join(catalog.geometries_wkb), dtype=np.uint8),
+            wkb_offsets=np.concatenate([[0], np.cumsum(wkb_lengths)]),
+            metadata=np.array(json.dumps(metadata)),
+        )
+
+
+def _read_cache(cities_geojson_path: Path, cache_path: Path, source: dict) -> Optional[CityCatalog]:
+    if not cache_path.exists():
+        return None
+    with np.load(cache_path, allow_pickle=False) as cache:
+        metadata = json.loads(str(cache["metadata"]))
+        stat = cities_geojson_path.stat()
+        cached_source = metadata["source"]
+        if (
+            metadata["version"] != CITY_CATALOG_CACHE_VERSION
+            or {key: cached_source[key] for key in source} != source
+            or cached_source["size"] != stat.st_size
+        ):
+            return None
+        # The file was touched, only rebuild if its contents actually changed
+        touched = cached_source["mtime_ns"] != stat.st_mtime_ns
+        if touched and metadata["sha256"] != file_sha256(cities_geojson_path):
+            return None
+
+        wkb, wkb_offsets = cache["wkb"].tobytes(), cache["wkb_offsets"]
+        geometries_wkb = np.array(
+            [wkb[start:end] for start, end in zip(wkb_offsets[:-1].tolist(), wkb_offsets[1:].tolist())], dtype=object
+        )
+        catalog = CityCatalog(
+            cache["ids"], cache["names"], cache["bounds"], geometries_wkb, CRS.from_wkt(metadata["crs"])
+        )
+
+    if touched:
+        # Record the new mtime, so later loads don't hash the file again
+        _write_cache(catalog, cities_geojson_path, cache_path, source, sha256=metadata["sha256"])
+    return catalog
+
+
+def main(cities_geojson_paths: Sequence[str]):
+    for cities_geojson_path in cities_geojson_paths:
+        catalog = CityCatalog.from_geojson(Path(cities_geojson_path))
+        logger.info(f"{cities_geojson_path}: {len(catalog)} cities")
+
+
+if __name__ == "__main__":
+    # e.g. python -m sample.city_catalog data/city_ids_and_bounds.geojson
+    main(sys.argv[1:])
@@ -0,0 +1,280 @@
+"""
+Command line entry point of the pipeline, with a subcommand per stage:
+
+    python -m sample.cli download --cities 13 --years 2020 2021 --seasons summer fall
+    python -m sample.cli roads --direct --workers 8
+    python -m sample.cli preview
+    python -m sample.cli export --chip-size 512
+    python -m sample.cli all
+
+Only this module's standard library imports are paid at startup: each stage imports its
+own modules (and their heavy dependencies, e.g. stackstac and dask for downloads,
+geopandas and rasterio for roads, matplotlib for previews) when it runs. Workers started
+with the "spawn" or "forkserver" start method import the parent's main module and
+whatever their tasks unpickle, so they also only import what their stage needs.
+"""
+
+import argparse
+import multiprocessing
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Dict, List, Optional
+
+SEASON_NAMES = ("spring", "summer", "fall", "winter")
+
+
+def _pool_kwargs(args: argparse.Namespace) -> Dict:
+    # Stages keep their own default pool size unless --workers is given
+    return {} if args.workers is None else {"pool_size": args.workers}
+
+
+def _has_city_selection(args: argparse.Namespace) -> bool:
+    return args.cities is not None or args.city_names is not None or args.bbox is not None
+
+
+def load_city_catalog(args: argparse.Namespace):
+    """
+    The catalog of the selected cities, loaded once and shared by every stage of the run.
+    """
+    from sample.city_catalog import CityCatalog
+
+    city_catalog = CityCatalog.from_geojson(args.cities_geojson)
+    if _has_city_selection(args):
+        city_catalog = city_catalog.select(ids=args.cities, name_pattern=args.city_names, bbox=args.bbox)
+    return city_catalog
+
+
+def run_download(args: argparse.Namespace, city_catalog):
+    from sample.sentinel_cities_downloader import SentinelCitiesDownloader
+    from sample.sentinel_downloader import Season
+
+    seasons_by_name = {str(season): season for season in Season}
+    s2_cities_downloader = SentinelCitiesDownloader(
+        s2_mosaics_output_path=args.s2_dir,
+        city_catalog=city_catalog,
+        years=args.years,
+        seasons=[seasons_by_name[name] for name in args.seasons],
+        max_cloudcover=args.max_cloudcover,
+        stac_cache_path=args.stac_cache,
+        tile_cache_dir=args.tile_cache,
+        **_pool_kwargs(args),
+    )
+    s2_cities_downloader.download_all(parallel=True, stack_per_city=args.stack_per_city, queue_path=args.queue)
+
+
+def run_roads(args: argparse.Namespace, city_catalog):
+    from sample.osm_road_generator import OSMRoadGenerator
+
+    osm_road_generator = OSMRoadGenerator(
+        root_s2_img_path=args.s2_dir,
+        root_osm_output_path=args.osm_dir,
+        city_catalog=city_catalog,
+        windowed=args.windowed,
+        per_grid=args.per_grid,
+        direct=args.direct,
+        regional_store_path=args.regional_store,
+        coverage_resolution=args.coverage_resolution,
+    )
+    if args.queue is not None:
+        osm_road_generator.generate_roads_queued(args.queue, num_workers=args.workers, force=args.force)
+    else:
+        osm_road_generator.generate_roads_parallel(num_workers=args.workers, force=args.force)
+
+
+def run_preview(args: argparse.Namespace, city_catalog):
+    from sample.preview import PreviewGenerator
+
+    preview_generator = PreviewGenerator(
+        root_s2_img_path=args.s2_dir,
+        root_osm_img_path=args.osm_dir,
+        plot_output_path=args.plots_dir,
+        max_size=args.max_size,
+        **_pool_kwargs(args),
+    )
+    preview_generator.generate_previews((city.city_id, city.name) for city in city_catalog)
+
+
+def run_export(args: argparse.Namespace, city_catalog):
+    from sample.chip_exporter import ChipExporter
+
+    chip_exporter = ChipExporter(
+        root_s2_img_path=args.s2_dir,
+        root_osm_img_path=args.osm_dir,
+        output_path=args.chips_dir,
+        chip_size=args.chip_size,
+        stride=args.stride,
+        **_pool_kwargs(args),
+    )
+    # Without a selection, every city with downloaded mosaics is exported
+    city_ids = city_catalog.ids.tolist() if _has_city_selection(args) else None
+    chip_exporter.export_all(city_ids=city_ids, force=args.force)
+
+
+def run_all(args: argparse.Namespace, city_catalog):
+    from sample.utils import get_simple_logger
+
+    logger = get_simple_logger("main")
+    logger.info("Downloading Sentinel-2 mosaic for each city...")
+    run_download(args, city_catalog)
+    logger.info("Generating OpenStreetMap road network rasters for each city...")
+    run_roads(args, city_catalog)
+    logger.info("Visualizing RGB and roads side-by-side for each city...")
+    run_preview(args, city_catalog)
+
+
+def _common_options() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--cities-geojson", type=Path, default=Path("data/city_ids_and_bounds.geojson"))
+    parser.add_argument(
+        "--cities", type=int, nargs="+", default=None, help="Only process these city IDs (default: all cities)"
+    )
+    parser.add_argument(
+        "--city-names", default=None, help="Only process cities whose name matches this glob, e.g. 'san *'"
+    )
+    parser.add_argument(
+        "--bbox",
+        type=float,
+        nargs=4,
+        default=None,
+        metavar=("MINX", "MINY", "MAXX", "MAXY"),
+        help="Only process cities intersecting this bounding box (in the cities GeoJSON's CRS)",
+    )
+    parser.add_argument("--s2-dir", type=Path, default=Path("data/sentinel2_images"))
+    parser.add_argument("--osm-dir", type=Path, default=Path("data/osm_images"))
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: each stage's own)")
+    parser.add_argument(
+        "--start-method",
+        choices=multiprocessing.get_all_start_methods(),
+        default=None,
+        help="Start method of worker processes (default: the platform's)",
+    )
+    parser.add_argument(
+        "--profile-report",
+        type=Path,
+        default=None,
+        help="Write a JSON report of per-stage timings, bytes read/written and peak RSS here",
+    )
+    return parser
+
+
+def _download_options() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--years", type=int, nargs="+", default=[2021])
+    parser.add_argument("--seasons", choices=SEASON_NAMES, nargs="+", default=["spring", "summer", "fall"])
+    parser.add_argument("--max-cloudcover", type=int, default=10)
+    parser.add_argument(
+        "--stack-per-city", action="store_true", help="Search and stack each city once over all its seasons"
+    )
+    parser.add_argument(
+        "--stac-cache",
+        type=Path,
+        default=None,
+        help="Cache STAC search results in this SQLite file, e.g. data/stac_cache.sqlite (default: no cache)",
+    )
+    parser.add_argument(
+        "--tile-cache",
+        type=Path,
+        default=None,
+        help="Read COG tiles through a local caching proxy keeping them in this folder, e.g. data/tile_cache "
+        "(default: read them directly)",
+    )
+    return parser
+
+
+def _roads_options() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--windowed", action="store_true", help="Generate and write road rasters block by block")
+    parser.add_argument(
+        "--per-grid", action="store_true", help="Generate a road raster for every distinct grid of a city's RGB tifs"
+    )
+    parser.add_argument(
+        "--direct",
+        action="store_true",
+        help="Rasterize roads directly in each scene's CRS, without reprojecting a raster",
+    )
+    parser.add_argument(
+        "--regional-store",
+        type=Path,
+        default=None,
+        help="Regional road store to serve cities without their own graphml file from",
+    )
+    parser.add_argument(
+        "--coverage-resolution",
+        type=float,
+        default=None,
+        help="Generate per-class road coverage fractions on a grid of this resolution instead of binary road masks",
+    )
+    parser.add_argument("--force", action="store_true", help="Regenerate road rasters that are up to date")
+    return parser
+
+
+def _preview_options() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--plots-dir", type=Path, default=Path("plots"))
+    parser.add_argument("--max-size", type=int, default=1024, help="Longest side of each preview image, in pixels")
+    return parser
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Download Sentinel-2 mosaics, generate OSM road rasters, and preview and export them."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    common = _common_options()
+
+    download_parser = subparsers.add_parser(
+        "download", parents=[common, _download_options()], help="Download Sentinel-2 mosaics of each city"
+    )
+    download_parser.add_argument(
+        "--queue", type=Path, default=None, help="Run through a persistent SQLite job queue at this path"
+    )
+    download_parser.set_defaults(handler=run_download)
+
+    roads_parser = subparsers.add_parser(
+        "roads", parents=[common, _roads_options()], help="Generate OSM road rasters on the grids of the mosaics"
+    )
+    roads_parser.add_argument(
+        "--queue", type=Path, default=None, help="Run through a persistent SQLite job queue at this path"
+    )
+    roads_parser.set_defaults(handler=run_roads)
+
+    preview_parser = subparsers.add_parser(
+        "preview", parents=[common, _preview_options()], help="Plot each city's mosaic and roads side-by-side"
+    )
+    preview_parser.set_defaults(handler=run_preview)
+
+    export_parser = subparsers.add_parser(
+        "export", parents=[common], help="Export aligned RGB and road chips for training"
+    )
+    export_parser.add_argument("--chips-dir", type=Path, default=Path("data/chips"))
+    export_parser.add_argument("--chip-size", type=int, default=256)
+    export_parser.add_argument("--stride", type=int, default=None)
+    export_parser.add_argument("--force", action="store_true", help="Re-export cities that were already exported")
+    export_parser.set_defaults(handler=run_export)
+
+    all_parser = subparsers.add_parser(
+        "all",
+        parents=[common, _download_options(), _roads_options(), _preview_options()],
+        help="Run the download, roads and preview stages in order",
+    )
+    all_parser.set_defaults(handler=run_all, queue=None)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None):
+    args = build_parser().parse_args(argv)
+    if args.start_method is not None:
+        multiprocessing.set_start_method(args.start_method, force=True)
+    if args.profile_report is not None:
+        from sample import instrumentation
+
+        run_context = instrumentation.profile_run(args.profile_report)
+    else:
+        run_context = nullcontext()
+
+    with run_context:
+        args.handler(args, load_city_catalog(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import warnings
+from enum import Enum, auto
+from typing import Sequence
+
+import dask.array as da
+import numpy as np
+import xarray as xr
+
+from sample import instrumentation
+
+# Sentinel-2 scene classification (SCL) classes that are clear enough to composite:
+# dark area pixels, vegetation, not vegetated, water, unclassified and snow/ice. Nodata,
+# saturated/defective, cloud shadow, cloud (medium/high probability) and thin cirrus
+# pixels are excluded.
+SCL_CLEAR_CLASSES = (2, 4, 5, 6, 7, 11)
+
+
+class CompositeMode(Enum):
+    First = auto()
+    BestPixel = auto()
+    Median = auto()
+
+    def __str__(self):
+        return self.name.lower()
+
+
+def composite_stack(
+    stack: xr.DataArray,
+    mode: CompositeMode = CompositeMode.First,
+    bands: Sequence[str] = ("red", "green", "blue"),
+    scl_band: str = "scl",
+) -> xr.DataArray:
+    """
+    Composites a (time, band, y, x) stack of items, as returned by stackstac.stack with NaN
+    as nodata, into a lazy (band, y, x) mosaic of `bands`. Items should be ordered from most
+    to least preferred (e.g. by ascending cloud cover).
+
+    * First: the first non-NaN value of each band, like stackstac.mosaic(reverse=True).
+    * BestPixel: the first pixel whose `scl_band` class is in SCL_CLEAR_CLASSES.
+    * Median: the per-pixel median of all non-NaN (and, if `scl_band` is stacked, clear)
+      values.
+
+    Each spatial chunk of the mosaic is composited on its own, reading its items one at a
+    time (except for Median, which needs all of them). The First and BestPixel modes stop
+    reading items once every pixel of the chunk is filled, and BestPixel reads an item's
+    bands only if its SCL band has clear pixels that are still unfilled. So items that are
+    not needed for a chunk are never fetched or computed.
+    """
+    band_names = list(stack["band"].values)
+    band_indices = [band_names.index(band) for band in bands]
+    scl_index = band_names.index(scl_band) if scl_band in band_names else None
+    if mode == CompositeMode.BestPixel and scl_index is None:
+        raise ValueError(f"Best-pixel compositing requires the {scl_band} band to be stacked")
+
+    stack_data = stack.data if isinstance(stack.data, da.Array) else da.from_array(stack.data)
+    dtype = np.result_type(stack_data.dtype, np.float32)
+
+    def _composite_block(block_info=None):
+        _, (y_start, y_stop), (x_start, x_stop) = block_info[None]["array-location"]
+        chunk = stack_data[:, :, y_start:y_stop, x_start:x_stop]
+
+        with instrumentation.span("composite_chunk"):
+            if mode == CompositeMode.Median:
+                return _median_chunk(chunk, band_indices, scl_index).astype(dtype, copy=False)
+            return _first_chunk(chunk, band_indices, scl_index if mode == CompositeMode.BestPixel else None, dtype)
+
+    mosaic_data = da.map_blocks(
+        _composite_block,
+        chunks=((len(bands),),) + stack_data.chunks[2:],
+        dtype=dtype,
+    )
+
+    scalar_coords = {name: coord for name, coord in stack.coords.items() if coord.dims == ()}
+    return xr.DataArray(
+        mosaic_data,
+        dims=("band", "y", "x"),
+        coords={**scalar_coords, "band": list(bands), "y": stack["y"], "x": stack["x"]},
+        attrs=stack.attrs.copy(),
+        name=stack.name,
+    )
+
+
+def _compute(array: da.Array) -> np.ndarray:
+    # Composites run inside a Dask task, so read items synchronously within it
+    with instrumentation.span("cog_read"):
+        values = array.compute(scheduler="synchronous")
+    instrumentation.count("bytes_read", values.nbytes)
+    return values
+
+
+def _first_chunk(chunk: da.Array, band_indices: Sequence[int], scl_index, dtype) -> np.ndarray:
+    n_items, _, height, width = chunk.shape
+    out = np.full((len(band_indices), height, width), np.nan, dtype=dtype)
+    unfilled = np.ones((len(band_indices), height, width), dtype=bool)
+
+    for t in range(n_items):
+        candidates = unfilled
+        if scl_index is not None:
+            clear = np.isin(_compute(chunk[t, scl_index]), SCL_CLEAR_CLASSES)
+            candidates = unfilled & clear
+            if not candidates.any():
+                continue
+
+        values = _compute(chunk[t, band_indices])
+        if scl_index is not None:
+            # Best-pixel mosaics take all bands of a pixel from the same item
+            candidates = candidates & ~np.isnan(values).any(axis=0)
+        else:
+            candidates = candidates & ~np.isnan(values)
+        out[candidates] = values[candidates]
+        unfilled &= ~candidates
+        if not unfilled.any():
+            break
+
+    return out
+
+
+def _median_chunk(chunk: da.Array, band_indices: Sequence[int], scl_index) -> np.ndarray:
+    values = _compute(chunk[:, band_indices])
+    if scl_index is not None:
+        clear = np.isin(_compute(chunk[:, scl_index]), SCL_CLEAR_CLASSES)
+        values = np.where(clear[:, np.newaxis], values, np.nan)
+    with warnings.catch_warnings():
+        # Pixels without any values are left as NaN
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        return np.nanmedian(values, axis=0)
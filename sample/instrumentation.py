@@ -0,0 +1,197 @@
+"""
+Lightweight, process-wide timing and counting of pipeline stages.
+
+Stages are timed with `span` and quantities (e.g. bytes written) added up with `count`.
+Both do nothing until instrumentation is enabled with `enable` (or `profile_run`), so they
+can stay in hot code paths: a disabled span is a shared no-op context manager.
+
+Each process records into its own recorder, which `flush` writes to `{run_dir}/{pid}.json`.
+Pool workers pick up the run directory from the SAMPLE_INSTRUMENTATION_DIR environment
+variable (whether forked or spawned), and flush at the end of each task, since pool
+workers may be terminated without running any exit handlers. `write_report` merges the
+files of all processes into a single report with per-stage latency percentiles, counters
+and peak RSS.
+"""
+
+import json
+import os
+import resource
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+from sample.utils import atomic_write_path
+
+RUN_DIR_ENV_VAR = "SAMPLE_INSTRUMENTATION_DIR"
+
+_NULL_SPAN = nullcontext()
+
+
+class _Recorder:
+    """
+    Span durations and counters recorded in one process, safe to update from several
+    threads (e.g. Dask's).
+    """
+
+    def __init__(self, run_dir: Path):
+        self.run_dir = run_dir
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.durations: Dict[str, List[float]] = {}
+        self.counters: Dict[str, float] = {}
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.durations.setdefault(name, []).append(elapsed)
+
+    def count(self, name: str, value: float):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def flush(self):
+        with self.lock:
+            record = {
+                "pid": self.pid,
+                "durations": {name: list(durations) for name, durations in self.durations.items()},
+                "counters": dict(self.counters),
+                # ru_maxrss is reported in kilobytes on Linux
+                "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            }
+        with atomic_write_path(self.run_dir / f"{self.pid}.json") as tmp_path:
+            tmp_path.write_text(json.dumps(record))
+
+
+_recorder: Optional[_Recorder] = None
+
+
+def _get_recorder() -> Optional[_Recorder]:
+    global _recorder
+    if _recorder is not None and _recorder.pid != os.getpid():
+        # A forked child starts with a copy of its parent's recorder, so it starts over
+        _recorder = _Recorder(_recorder.run_dir)
+    return _recorder
+
+
+def enable(run_dir: Path):
+    """
+    Starts recording spans and counters of this process and its (future) child processes
+    into `run_dir`.
+    """
+    global _recorder
+    run_dir.mkdir(parents=True, exist_ok=True)
+    os.environ[RUN_DIR_ENV_VAR] = str(run_dir)
+    _recorder = _Recorder(run_dir)
+
+
+def disable():
+    global _recorder
+    os.environ.pop(RUN_DIR_ENV_VAR, None)
+    _recorder = None
+
+
+def is_enabled() -> bool:
+    return _recorder is not None
+
+
+def span(name: str):
+    """
+    Context manager timing the stage `name`, if instrumentation is enabled.
+    """
+    if _recorder is None:
+        return _NULL_SPAN
+    return _get_recorder().span(name)
+
+
+def count(name: str, value: float = 1):
+    """
+    Adds `value` to the counter `name`, if instrumentation is enabled.
+    """
+    if _recorder is not None:
+        _get_recorder().count(name, value)
+
+
+def flush():
+    """
+    Writes this process's spans and counters so far to the run directory, if instrumentation
+    is enabled. Pool tasks should call this once they're done.
+    """
+    if _recorder is not None:
+        _get_recorder().flush()
+
+
+def _percentiles(durations: List[float]) -> Dict[str, float]:
+    p50, p90, p99 = np.percentile(durations, [50, 90, 99])
+    return {
+        "count": len(durations),
+        "total_s": float(np.sum(durations)),
+        "mean_s": float(np.mean(durations)),
+        "p50_s": float(p50),
+        "p90_s": float(p90),
+        "p99_s": float(p99),
+        "max_s": float(np.max(durations)),
+    }
+
+
+def write_report(run_dir: Path, report_path: Optional[Path] = None) -> Dict:
+    """
+    Merges the records of all processes in `run_dir` into a report, which is also written
+    to `report_path` as JSON if given. Stage latencies are aggregated over all processes,
+    counters are summed, and peak RSS is reported both overall and per process.
+    """
+    durations: Dict[str, List[float]] = {}
+    counters: Dict[str, float] = {}
+    peak_rss_bytes = {}
+    for record_path in sorted(run_dir.glob("*.json")):
+        record = json.loads(record_path.read_text())
+        for name, record_durations in record["durations"].items():
+            durations.setdefault(name, []).extend(record_durations)
+        for name, value in record["counters"].items():
+            counters[name] = counters.get(name, 0) + value
+        peak_rss_bytes[str(record["pid"])] = record["peak_rss_bytes"]
+
+    report = {
+        "stages": {name: _percentiles(stage_durations) for name, stage_durations in sorted(durations.items())},
+        "counters": dict(sorted(counters.items())),
+        "peak_rss_bytes": max(peak_rss_bytes.values(), default=0),
+        "peak_rss_bytes_by_process": peak_rss_bytes,
+    }
+    if report_path is not None:
+        report_path.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_write_path(report_path) as tmp_path:
+            tmp_path.write_text(json.dumps(report, indent=2))
+    return report
+
+
+@contextmanager
+def profile_run(report_path: Path) -> Iterator[None]:
+    """
+    Enables instrumentation for the duration of the context, and writes the run's report to
+    `report_path` when it exits.
+    """
+    run_dir = Path(tempfile.mkdtemp(prefix="sample_instrumentation_"))
+    enable(run_dir)
+    try:
+        with span("run"):
+            yield
+    finally:
+        flush()
+        disable()
+        write_report(run_dir, report_path)
+        shutil.rmtree(run_dir)
+
+
+# Pick up the run of a parent process, e.g. in spawned pool workers
+if os.environ.get(RUN_DIR_ENV_VAR):
+    enable(Path(os.environ[RUN_DIR_ENV_VAR]))
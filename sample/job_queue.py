@@ -0,0 +1,246 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from enum import Enum, auto
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from sample.utils import get_simple_logger
+
+
+class JobState(Enum):
+    Pending = auto()
+    Running = auto()
+    Done = auto()
+    Failed = auto()
+
+    def __str__(self):
+        return self.name.lower()
+
+
+class Job(NamedTuple):
+    """
+    A claimed job: its unique `key`, JSON `payload`, and how many times it has been claimed
+    (including this time).
+    """
+
+    job_id: int
+    key: str
+    payload: Dict
+    attempts: int
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    key TEXT UNIQUE NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_expires REAL,
+    error TEXT,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id);
+"""
+
+
+class JobQueue:
+    """
+    Persistent work queue backed by a SQLite file, which any number of worker processes can
+    pull jobs from, on one host or on several hosts sharing the file over a filesystem with
+    working locks. Each job has a unique key (e.g. "{city_id}/{year}/{season}"), so adding
+    the same jobs again from another run or host doesn't duplicate them.
+
+    A claimed job is leased to its worker for `lease_seconds`, and the lease is renewed
+    periodically while the job runs (see `work`). If the worker dies, its lease expires and
+    the job is handed to another worker, so an interrupted run resumes where it left off.
+    Jobs that raise are retried until they have been claimed `max_attempts` times, and are
+    then marked failed with the last error.
+
+    Every operation opens its own short-lived connection, so a queue can be shared by
+    threads and by forked or spawned processes. The database uses SQLite's default rollback
+    journal, as WAL mode doesn't work over network filesystems. Lease expiry relies on the
+    clocks of all hosts roughly agreeing.
+    """
+
+    def __init__(self, db_path: Path, lease_seconds: float = 600, max_attempts: int = 3):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.logger = get_simple_logger(self.__class__.__name__)
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=60)
+        try:
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Connection in an immediate transaction (holding the database's write lock), which is
+        committed on exit, or rolled back on error.
+        """
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def add(self, jobs: Iterable[Tuple[str, Dict]], retry_failed: bool = False, redo_done: bool = False) -> int:
+        """
+        Adds (key, payload) jobs as pending. Jobs whose key is already queued keep their
+        state, so jobs that another run or host already finished aren't redone, except
+        failed jobs if `retry_failed` is set, and done jobs if `redo_done` is set, which are
+        reset to pending. Returns the number of jobs that are now pending because of this call.
+        """
+        reset_states = [str(JobState.Failed)] if retry_failed else []
+        if redo_done:
+            reset_states.append(str(JobState.Done))
+        now = time.time()
+        num_pending = 0
+        with self._transaction() as conn:
+            for key, payload in jobs:
+                cursor = conn.execute(
+                    f"""
+                    INSERT INTO jobs (key, payload, state, updated) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (key) DO UPDATE SET
+                        payload = excluded.payload, state = excluded.state, attempts = 0,
+                        worker = NULL, lease_expires = NULL, error = NULL, updated = excluded.updated
+                    WHERE jobs.state IN ({", ".join("?" * len(reset_states))})
+                    """,
+                    (key, json.dumps(payload), str(JobState.Pending), now, *reset_states),
+                )
+                num_pending += cursor.rowcount
+        return num_pending
+
+    def claim(self, worker_id: Optional[str] = None) -> Optional[Job]:
+        """
+        Leases the oldest pending job (or job whose lease has expired) to `worker_id`, or
+        returns None if there's nothing left to do.
+        """
+        worker_id = worker_id or default_worker_id()
+        now = time.time()
+        with self._transaction() as conn:
+            # Jobs whose workers died on their last attempt are given up on
+            conn.execute(
+                "UPDATE jobs SET state = ?, error = ?, updated = ? WHERE state = ? AND lease_expires < ? AND attempts >= ?",
+                (str(JobState.Failed), "Lease expired", now, str(JobState.Running), now, self.max_attempts),
+            )
+            row = conn.execute(
+                "SELECT id, key, payload, attempts FROM jobs WHERE state = ? OR (state = ? AND lease_expires < ?) "
+                "ORDER BY id LIMIT 1",
+                (str(JobState.Pending), str(JobState.Running), now),
+            ).fetchone()
+            if row is None:
+                return None
+            job_id, key, payload, attempts = row
+            conn.execute(
+                "UPDATE jobs SET state = ?, attempts = ?, worker = ?, lease_expires = ?, updated = ? WHERE id = ?",
+                (str(JobState.Running), attempts + 1, worker_id, now + self.lease_seconds, now, job_id),
+            )
+        return Job(job_id, key, json.loads(payload), attempts + 1)
+
+    def renew(self, job: Job, worker_id: Optional[str] = None) -> bool:
+        """
+        Extends the lease on a running job. Returns False if the job is no longer leased to
+        `worker_id` (e.g. its lease expired and another worker claimed it).
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires = ?, updated = ? WHERE id = ? AND worker = ? AND state = ?",
+                (now + self.lease_seconds, now, job.job_id, worker_id or default_worker_id(), str(JobState.Running)),
+            )
+        return cursor.rowcount > 0
+
+    def complete(self, job: Job, worker_id: Optional[str] = None):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = ?, lease_expires = NULL, error = NULL, updated = ? "
+                "WHERE id = ? AND worker = ? AND state = ?",
+                (str(JobState.Done), time.time(), job.job_id, worker_id or default_worker_id(), str(JobState.Running)),
+            )
+
+    def fail(self, job: Job, error: str, worker_id: Optional[str] = None):
+        """
+        Records a failed attempt at a job, which is retried unless it has been attempted
+        `max_attempts` times.
+        """
+        state = JobState.Failed if job.attempts >= self.max_attempts else JobState.Pending
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = ?, lease_expires = NULL, error = ?, updated = ? "
+                "WHERE id = ? AND worker = ? AND state = ?",
+                (str(state), error, time.time(), job.job_id, worker_id or default_worker_id(), str(JobState.Running)),
+            )
+
+    def counts(self) -> Dict[str, int]:
+        """
+        Number of jobs in each state.
+        """
+        with self._transaction() as conn:
+            rows = conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        return {str(state): 0 for state in JobState} | dict(rows)
+
+    def keys(self, state: JobState) -> List[str]:
+        with self._transaction() as conn:
+            rows = conn.execute("SELECT key FROM jobs WHERE state = ? ORDER BY id", (str(state),)).fetchall()
+        return [key for (key,) in rows]
+
+    def failures(self) -> Dict[str, str]:
+        """
+        The last error of every failed job, keyed by job key.
+        """
+        with self._transaction() as conn:
+            rows = conn.execute("SELECT key, error FROM jobs WHERE state = ? ORDER BY id", (str(JobState.Failed),))
+            return dict(rows.fetchall())
+
+    def work(self, handler: Callable[[Job], None], worker_id: Optional[str] = None) -> int:
+        """
+        Claims and runs jobs with `handler` until the queue has no more jobs to hand out,
+        renewing each job's lease in the background while it runs. A job is done once
+        `handler` returns, and failed (to be retried) if it raises. Returns the number of
+        jobs completed.
+        """
+        worker_id = worker_id or default_worker_id()
+        num_completed = 0
+        while (job := self.claim(worker_id)) is not None:
+            stop_renewing = threading.Event()
+            renewer = threading.Thread(target=self._renew_until, args=(job, worker_id, stop_renewing), daemon=True)
+            renewer.start()
+            try:
+                handler(job)
+            except Exception as e:
+                self.logger.error(f"Job {job.key} failed (attempt {job.attempts}): {e}")
+                self.fail(job, f"{type(e).__name__}: {e}", worker_id)
+            else:
+                self.complete(job, worker_id)
+                num_completed += 1
+            finally:
+                stop_renewing.set()
+                renewer.join()
+        return num_completed
+
+    def _renew_until(self, job: Job, worker_id: str, stop: threading.Event):
+        while not stop.wait(self.lease_seconds / 3):
+            if not self.renew(job, worker_id):
+                self.logger.warning(f"Lost the lease on job {job.key}")
+                return
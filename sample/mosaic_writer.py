@@ -0,0 +1,117 @@
+from multiprocessing.pool import ThreadPool
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+import dask
+import dask.array as da
+import numpy as np
+import rioxarray  # noqa: F401
+import xarray as xr
+from rasterio.windows import Window
+
+from sample import instrumentation
+from sample.raster_io import CogOptions, cog_writer
+from sample.utils import get_simple_logger
+
+
+class MosaicWriter:
+    """
+    Writes a lazy (Dask-backed) mosaic to a Cloud-Optimized GeoTIFF, chunk by chunk (see
+    sample.raster_io.cog_writer for the COG settings in `cog_options`).
+
+    The mosaic is rechunked spatially to `chunk_size` x `chunk_size` pixels (with all bands
+    in each chunk), and chunks are computed in batches with a threaded Dask scheduler of
+    `num_threads` threads, regardless of whatever scheduler is otherwise active. Each batch
+    is written out before the next is computed, so only one batch of chunks is held in
+    memory at a time. Batches are sized so their chunks (in the mosaic's own dtype) fit in
+    `memory_limit_bytes`, though each batch has at least one chunk per thread.
+
+    Pixels are written as `dtype` (uint8 by default), with NaN written as `nodata` and other
+    values clipped to the range of the dtype.
+    """
+
+    def __init__(
+        self,
+        num_threads: int = 2,
+        memory_limit_bytes: Optional[int] = 512 * 2**20,
+        chunk_size: int = 1024,
+        dtype: str = "uint8",
+        nodata: int = 0,
+        block_size: int = 512,
+        cog_options: Optional[CogOptions] = None,
+    ):
+        if chunk_size % block_size != 0:
+            raise ValueError(f"chunk_size ({chunk_size}) must be a multiple of block_size ({block_size})")
+
+        self.logger = get_simple_logger(self.__class__.__name__)
+        self.num_threads = num_threads
+        self.memory_limit_bytes = memory_limit_bytes
+        self.chunk_size = chunk_size
+        self.dtype = np.dtype(dtype)
+        self.nodata = nodata
+        self.block_size = block_size
+        self.cog_options = cog_options or CogOptions(num_threads=num_threads)
+
+    def _batch_size(self, mosaic_data: da.Array) -> int:
+        chunk_nbytes = mosaic_data.shape[0] * self.chunk_size**2 * mosaic_data.dtype.itemsize
+        if self.memory_limit_bytes is None:
+            return max(self.num_threads, 1) * 4
+        return max(self.memory_limit_bytes // chunk_nbytes, self.num_threads, 1)
+
+    def _chunk_windows(self, mosaic_data: da.Array) -> Iterator[Tuple[Tuple[int, int], Window]]:
+        row_offsets = np.cumsum((0,) + mosaic_data.chunks[1])
+        col_offsets = np.cumsum((0,) + mosaic_data.chunks[2])
+        for i, height in enumerate(mosaic_data.chunks[1]):
+            for j, width in enumerate(mosaic_data.chunks[2]):
+                yield (i, j), Window(int(col_offsets[j]), int(row_offsets[i]), width, height)
+
+    def _to_dtype(self, block: np.ndarray) -> np.ndarray:
+        if block.dtype == self.dtype:
+            return block
+        if np.issubdtype(self.dtype, np.integer):
+            dtype_info = np.iinfo(self.dtype)
+            if np.issubdtype(block.dtype, np.floating):
+                block = np.where(np.isnan(block), self.nodata, block)
+            block = np.clip(block, dtype_info.min, dtype_info.max)
+        return block.astype(self.dtype)
+
+    def write(self, mosaic: xr.DataArray, output_path: Path):
+        """
+        Computes and writes `mosaic` (with dims band, y, x and a CRS and transform readable by
+        rioxarray) to `output_path`. The file is written to a temporary path and renamed once
+        complete, with its overviews.
+        """
+        if mosaic.dims != ("band", "y", "x"):
+            raise ValueError(f"Expected mosaic dims ('band', 'y', 'x'), got {mosaic.dims}")
+
+        mosaic_data = mosaic.data if isinstance(mosaic.data, da.Array) else da.from_array(mosaic.data)
+        mosaic_data = mosaic_data.rechunk((-1, self.chunk_size, self.chunk_size))
+        batch_size = self._batch_size(mosaic_data)
+        # Convert to the output dtype in the Dask graph, so it runs on the scheduler threads
+        mosaic_data = mosaic_data.map_blocks(self._to_dtype, dtype=self.dtype)
+        count, height, width = mosaic_data.shape
+
+        profile = dict(
+            width=width,
+            height=height,
+            count=count,
+            dtype=self.dtype,
+            nodata=self.nodata,
+            crs=mosaic.rio.crs,
+            transform=mosaic.rio.transform(),
+        )
+
+        windows = list(self._chunk_windows(mosaic_data))
+        self.logger.debug(f"Writing {len(windows)} chunks to {output_path} in batches of {batch_size}")
+
+        with (
+            instrumentation.span("mosaic_write"),
+            ThreadPool(self.num_threads) as pool,
+            dask.config.set(scheduler="threads", pool=pool),
+        ):
+            with cog_writer(output_path, profile, self.block_size, self.cog_options) as dst:
+                for batch_start in range(0, len(windows), batch_size):
+                    batch = windows[batch_start : batch_start + batch_size]
+                    blocks = dask.compute(*[mosaic_data.blocks[0, i, j] for (i, j), _ in batch])
+                    for (_, window), block in zip(batch, blocks):
+                        dst.write(block, window=window)
@@ -1,115 +1,473 @@
 from pathlib import Path
-from typing import Dict, Iterable
+from typing import Dict, List, Optional, Tuple
 
 import rasterio.features
 import rasterio.transform
+import geopandas as gpd
 import numpy as np
-import osmnx as ox
+import pyproj
 import rasterio
-import rasterio.vrt
-import numpy as np
+import rasterio.crs
+import rasterio.windows
+import rasterio.warp
+import shapely
 from shapely.geometry import box
 
-from sample.utils import get_simple_logger
+from sample import instrumentation
+from sample.raster_io import CogOptions, cog_writer
+from sample.regional_road_store import RegionalRoadStore
+from sample.road_network_cache import RoadNetwork, load_road_network
+from sample.road_query_engine import RoadQueryEngine
+from sample.utils import get_simple_logger, json_sha256
+
+SIMPLE_TYPE_TO_OSM_HIGHWAY_TYPE_MAPPING = {
+    "primary": ["motorway", "motorway_link", "trunk", "trunk_link"],
+    "secondary": ["primary", "primary_link", "secondary", "secondary_link"],
+    "local": [
+        "tertiary",
+        "tertiary_link",
+        "unclassified",
+        "residential",
+        "living_street",
+    ],
+}
+
+# NOTE: all_touched=True for local roads, as they tend to be more disconnected.
+# Burning in all touching pixels helps make them more continuous in the rasterized image.
+ROAD_CLASS_ALL_TOUCHED = {"primary": False, "secondary": False, "local": True}
+
+# Road coverage is rasterized on a grid this many times finer than the target grid, in
+# strips of at most COVERAGE_STRIP_PIXELS fine pixels
+COVERAGE_SUPERSAMPLE = 8
+COVERAGE_STRIP_PIXELS = 2**22
+
+
+def coverage_grid(
+    transform: rasterio.Affine, width: int, height: int, resolution: float
+) -> Tuple[rasterio.Affine, int, int]:
+    """
+    The grid with square `resolution` pixels (in CRS units) covering the given grid, with
+    the same origin.
+    """
+    left, bottom, right, top = rasterio.transform.array_bounds(height, width, transform)
+    coverage_width = max(int(np.ceil((right - left) / resolution)), 1)
+    coverage_height = max(int(np.ceil((top - bottom) / resolution)), 1)
+    return (
+        rasterio.transform.from_origin(left, top, resolution, resolution),
+        coverage_width,
+        coverage_height,
+    )
+
+
+def _linestring_shapes(geometries: np.ndarray) -> List[Dict]:
+    """
+    GeoJSON-like mappings for an array of LineStrings, built from a single flat coordinate
+    array. This is much faster than rasterio going through each geometry's __geo_interface__.
+    """
+    if len(geometries) == 0:
+        return []
+    _geometry_type, coords, (offsets,) = shapely.to_ragged_array(geometries)
+    coords = coords.tolist()
+    offsets = offsets.tolist()
+    return [
+        {"type": "LineString", "coordinates": coords[start:end]}
+        for start, end in zip(offsets[:-1], offsets[1:])
+    ]
 
 
 class OSMRoadData:
     """
     Class to rasterize OSM road data that has already been saved in graphml format.
+    The graphml is converted once into a compact cached form holding only edge geometries
+    and road classes (see sample.road_network_cache), which is what gets loaded here.
 
     Note that this class assumes alignment between the data in the provided OSM graphml
     and the imagery for which OSM roads will be rasterized.
+
+    Roads can also be served from a regional road store instead of a per-city graphml
+    (see from_regional_store), or given directly as a `road_network`.
     """
 
-    def __init__(self, osm_graphml_path: Path):
-        self.simple_type_to_osm_highway_type_mapping = {
-            "primary": ["motorway", "motorway_link", "trunk", "trunk_link"],
-            "secondary": ["primary", "primary_link", "secondary", "secondary_link"],
-            "local": [
-                "tertiary",
-                "tertiary_link",
-                "unclassified",
-                "residential",
-                "living_street",
-            ],
-        }
+    def __init__(
+        self,
+        osm_graphml_path: Optional[Path] = None,
+        cache_dir: Optional[Path] = None,
+        road_network: Optional[RoadNetwork] = None,
+    ):
+        self.simple_type_to_osm_highway_type_mapping = (
+            SIMPLE_TYPE_TO_OSM_HIGHWAY_TYPE_MAPPING
+        )
 
         self.logger = get_simple_logger(self.__class__.__name__)
         self.osm_graphml_path = osm_graphml_path
-        assert self.osm_graphml_path.exists()
-        self.logger.info(f"Loading OSM graph from {self.osm_graphml_path}...")
-        self.osm_nx_graph = ox.load_graphml(self.osm_graphml_path)
-        self.logger.info("Done.")
+        if road_network is None:
+            if self.osm_graphml_path is None:
+                raise ValueError("Either osm_graphml_path or road_network must be given")
+            if not self.osm_graphml_path.exists():
+                raise FileNotFoundError(self.osm_graphml_path)
+            self.logger.info(f"Loading OSM roads for {self.osm_graphml_path}...")
+            with instrumentation.span("graphml_load"):
+                road_network = load_road_network(
+                    self.osm_graphml_path,
+                    self.simple_type_to_osm_highway_type_mapping,
+                    cache_dir=cache_dir,
+                )
+            self.logger.info("Done.")
 
-        self.osm_graph_nodes_gdf, self.osm_graph_edges_gdf = ox.graph_to_gdfs(
-            self.osm_nx_graph
+        self.osm_graph_edges_gdf = gpd.GeoDataFrame(
+            {"road_class": road_network.road_class_codes},
+            geometry=road_network.geometries,
+            crs=road_network.crs,
         )
 
-    def get_roads_in_bbox(self, bbox: box) -> Dict:
-        gdf_edges_within_bbox = self.osm_graph_edges_gdf.intersection(bbox, align=False)
+        # Index the edges once, so bounding box queries don't have to visit every edge
+        self.road_query_engine = RoadQueryEngine(
+            road_network.geometries, road_network.road_class_codes
+        )
 
-        primary_geoseries = gdf_edges_within_bbox[
-            self.osm_graph_edges_gdf["highway"].isin(
-                self.simple_type_to_osm_highway_type_mapping["primary"]
-            )
-        ]
-        primary_geoseries = primary_geoseries[~primary_geoseries.is_empty]
-        primary_gdf = self.osm_graph_edges_gdf.loc[primary_geoseries.index][
-            ["geometry"]
-        ]
-
-        secondary_geoseries = gdf_edges_within_bbox[
-            self.osm_graph_edges_gdf["highway"].isin(
-                self.simple_type_to_osm_highway_type_mapping["secondary"]
-            )
-        ]
-        secondary_geoseries = secondary_geoseries[~secondary_geoseries.is_empty]
-        secondary_gdf = self.osm_graph_edges_gdf.loc[secondary_geoseries.index][
-            ["geometry"]
-        ]
-
-        local_geoseries = gdf_edges_within_bbox[
-            self.osm_graph_edges_gdf["highway"].isin(
-                self.simple_type_to_osm_highway_type_mapping["local"]
+        # Rasterization buffer in the OSM graph's CRS, reused across calls
+        self._warped_roads_img = None
+
+        # Road geometries transformed to other CRSs for direct rasterization, keyed by the
+        # CRS's WKT. Roads are transformed the first time a scene in that CRS selects them.
+        self._transformed_geometries: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    @classmethod
+    def from_regional_store(
+        cls,
+        store_path: Path,
+        bounds: Tuple[float, float, float, float],
+        bounds_crs="EPSG:4326",
+    ) -> "OSMRoadData":
+        """
+        Loads the roads within `bounds` (in `bounds_crs`) from a regional road store (see
+        sample.regional_road_store), so a city's roads can be served from one regional
+        extract rather than a per-city graphml. Only the store's partitions that reach into
+        `bounds` are loaded.
+        """
+        store = RegionalRoadStore(store_path)
+        if store.mapping_sha256 != json_sha256(SIMPLE_TYPE_TO_OSM_HIGHWAY_TYPE_MAPPING):
+            raise ValueError(
+                f"{store_path} was built with a different highway type mapping, rebuild it"
             )
-        ]
-        local_geoseries = local_geoseries[~local_geoseries.is_empty]
-        local_gdf = self.osm_graph_edges_gdf.loc[local_geoseries.index][["geometry"]]
+        with instrumentation.span("regional_load"):
+            road_network = store.load(bounds, bounds_crs)
+        return cls(road_network=road_network)
+
+    def get_roads_in_bbox(self, bbox: box, clip: bool = False) -> Dict:
+        """
+        Returns the OSM roads intersecting `bbox`, as a GeoDataFrame of geometries per
+        simplified road type. Roads are returned whole, unless `clip` is set, in which
+        case their geometries are clipped to `bbox`.
+        """
+        road_positions = self.road_query_engine.query_indices(bbox)
+
+        roads_in_bbox = {}
+        for road_type, positions in road_positions.items():
+            road_type_gdf = self.osm_graph_edges_gdf.iloc[positions][["geometry"]]
+            if clip:
+                road_type_gdf = road_type_gdf.set_geometry(
+                    self.road_query_engine.clip(positions, bbox), crs=road_type_gdf.crs
+                )
+            roads_in_bbox[road_type] = road_type_gdf
 
-        return {
-            "primary": primary_gdf,
-            "secondary": secondary_gdf,
-            "local": local_gdf,
-        }
+        return roads_in_bbox
 
     @staticmethod
-    def _rasterize_shapes(
-        shapes: Iterable,
-        raster_ds: rasterio.DatasetReader,
-        all_touched=False,
-        dtype=rasterio.uint8,
+    def _get_buffer(
+        buffer: Optional[np.ndarray], shape: Tuple[int, ...], dtype=np.uint8
+    ) -> np.ndarray:
+        """
+        Returns `buffer` if it already has the requested shape and dtype, otherwise a newly
+        allocated array. Either way, the returned array is zeroed.
+        """
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            return np.zeros(shape, dtype=dtype)
+        buffer.fill(0)
+        return buffer
+
+    def _rasterize_road_classes(
+        self,
+        road_positions: Dict[str, np.ndarray],
+        transform: rasterio.Affine,
+        out: np.ndarray,
+        geometries: Optional[np.ndarray] = None,
     ) -> np.ndarray:
         """
-        Rasterize a set of geometries into a single image.
+        Rasterize the roads at `road_positions` (see RoadQueryEngine.query_indices) into
+        the zeroed (n road classes, h, w) uint8 array `out`, burning road pixels as 255
+        directly into each road class's channel. Road geometries are taken from
+        `geometries` if given (e.g. transformed to another CRS), and otherwise from the
+        road query engine.
 
-        NOTE: shapes (iterable of (geometry, value) pairs or geometries)
         See https://rasterio.readthedocs.io/en/latest/api/rasterio.features.html#rasterio.features.rasterize
         """
-        out_shape = (raster_ds.height, raster_ds.width)
-        out_img = np.zeros(out_shape, dtype=dtype)
-        if len(shapes) > 0:
-            out_img = rasterio.features.rasterize(
-                shapes,
-                out_shape=out_shape,
-                fill=0,
-                all_touched=all_touched,
-                dtype=dtype,
-                transform=raster_ds.transform,
+        if geometries is None:
+            geometries = self.road_query_engine.geometries
+        road_classes = self.road_query_engine.road_classes
+        road_shapes = _linestring_shapes(
+            geometries[
+                np.concatenate([road_positions[road_class] for road_class in road_classes])
+            ]
+        )
+
+        start = 0
+        for channel, road_class in enumerate(road_classes):
+            end = start + len(road_positions[road_class])
+            if end > start:
+                rasterio.features.rasterize(
+                    road_shapes[start:end],
+                    out=out[channel],
+                    default_value=255,
+                    all_touched=ROAD_CLASS_ALL_TOUCHED[road_class],
+                    transform=transform,
+                )
+            start = end
+        return out
+
+    def _warped_grid(
+        self,
+        crs: rasterio.crs.CRS,
+        transform: rasterio.Affine,
+        width: int,
+        height: int,
+    ) -> Tuple[rasterio.Affine, int, int]:
+        """
+        The grid in the OSM graph's CRS equivalent to the given grid, as suggested by GDAL
+        (i.e. the same grid a WarpedVRT of a dataset on the given grid would use).
+        """
+        left, bottom, right, top = rasterio.transform.array_bounds(
+            height, width, transform
+        )
+        return rasterio.warp.calculate_default_transform(
+            crs,
+            self.osm_graph_edges_gdf.crs,
+            width,
+            height,
+            left=left,
+            bottom=bottom,
+            right=right,
+            top=top,
+        )
+
+    def _warped_subgrid(
+        self,
+        warped_grid: Tuple[rasterio.Affine, int, int],
+        crs: rasterio.crs.CRS,
+        transform: rasterio.Affine,
+        width: int,
+        height: int,
+    ) -> Tuple[rasterio.Affine, int, int]:
+        """
+        The part of `warped_grid` (see _warped_grid) that covers the given grid, padded by a
+        pixel on each side. Rasterizing on a subgrid of the full scene's warped grid keeps
+        windowed road images consistent with rasterizing the full scene at once.
+        """
+        warped_transform, warped_width, warped_height = warped_grid
+        bounds = rasterio.warp.transform_bounds(
+            crs,
+            self.osm_graph_edges_gdf.crs,
+            *rasterio.transform.array_bounds(height, width, transform),
+            densify_pts=21,
+        )
+        window = rasterio.windows.from_bounds(*bounds, transform=warped_transform)
+        col_off = max(int(np.floor(window.col_off)) - 1, 0)
+        row_off = max(int(np.floor(window.row_off)) - 1, 0)
+        col_end = min(int(np.ceil(window.col_off + window.width)) + 1, warped_width)
+        row_end = min(int(np.ceil(window.row_off + window.height)) + 1, warped_height)
+        subgrid_window = rasterio.windows.Window(
+            col_off, row_off, max(col_end - col_off, 1), max(row_end - row_off, 1)
+        )
+        return (
+            rasterio.windows.transform(subgrid_window, warped_transform),
+            int(subgrid_window.width),
+            int(subgrid_window.height),
+        )
+
+    def _geometries_in_crs(
+        self, positions: np.ndarray, crs: rasterio.crs.CRS
+    ) -> np.ndarray:
+        """
+        All road geometries, indexed like the road query engine's, of which at least those
+        at `positions` are transformed to `crs`. Transformed geometries are cached per CRS,
+        so each road is transformed at most once for every CRS it is rasterized in, and
+        nothing is transformed for the OSM graph's own CRS.
+        """
+        graph_crs = self.osm_graph_edges_gdf.crs
+        if rasterio.crs.CRS.from_user_input(graph_crs) == crs:
+            return self.road_query_engine.geometries
+
+        key = crs.to_wkt()
+        if key not in self._transformed_geometries:
+            self._transformed_geometries[key] = (
+                np.empty(len(self.road_query_engine), dtype=object),
+                np.zeros(len(self.road_query_engine), dtype=bool),
             )
-        return out_img
+        geometries, is_transformed = self._transformed_geometries[key]
+
+        missing_positions = positions[~is_transformed[positions]]
+        if len(missing_positions) > 0:
+            transformer = pyproj.Transformer.from_crs(graph_crs, key, always_xy=True)
+            with instrumentation.span("geometry_transform"):
+                geometries[missing_positions] = shapely.transform(
+                    self.road_query_engine.geometries[missing_positions],
+                    lambda coords: np.column_stack(
+                        transformer.transform(coords[:, 0], coords[:, 1])
+                    ),
+                )
+            is_transformed[missing_positions] = True
+        return geometries
+
+    def _direct_road_image(
+        self,
+        crs: rasterio.crs.CRS,
+        transform: rasterio.Affine,
+        width: int,
+        height: int,
+        out: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """
+        Creates a (3, height, width) road raster image for the given grid by transforming
+        the roads within it to `crs`, and rasterizing them on the grid itself. See
+        road_image_for_grid.
+        """
+        graph_bbox = box(
+            *rasterio.warp.transform_bounds(
+                crs,
+                self.osm_graph_edges_gdf.crs,
+                *rasterio.transform.array_bounds(height, width, transform),
+                densify_pts=21,
+            )
+        )
+        with instrumentation.span("bbox_query"):
+            road_positions = self.road_query_engine.query_indices(graph_bbox)
+
+        geometries = self._geometries_in_crs(
+            np.concatenate(list(road_positions.values())), crs
+        )
+
+        output_roads_img = self._get_buffer(out, (3, height, width))
+        with instrumentation.span("rasterize"):
+            return self._rasterize_road_classes(
+                road_positions, transform, output_roads_img, geometries=geometries
+            )
+
+    def road_coverage_for_grid(
+        self,
+        crs: rasterio.crs.CRS,
+        transform: rasterio.Affine,
+        width: int,
+        height: int,
+        out: Optional[np.ndarray] = None,
+        supersample: int = COVERAGE_SUPERSAMPLE,
+    ) -> np.ndarray:
+        """
+        Creates a (3, height, width) uint8 road coverage raster for the given grid, where
+        each pixel is the fraction (scaled to 0-255) of its area covered by each road class.
+
+        Roads are transformed to `crs` and rasterized directly (see road_image_for_grid) on
+        a grid `supersample` times finer, which is then summed block by block. The fine grid
+        is rasterized a strip of rows at a time, so memory use scales with the target grid
+        rather than the fine grid, and only roads within each strip are rasterized.
+        """
+        output_coverage_img = self._get_buffer(out, (3, height, width))
+        strip_height = max(COVERAGE_STRIP_PIXELS // (width * supersample**2), 1)
+        strip_img = None
+        for row_off in range(0, height, strip_height):
+            rows = min(strip_height, height - row_off)
+            strip_transform = (
+                transform
+                * rasterio.Affine.translation(0, row_off)
+                * rasterio.Affine.scale(1 / supersample)
+            )
+            strip_img = self._direct_road_image(
+                crs, strip_transform, width * supersample, rows * supersample, strip_img
+            )
+            with instrumentation.span("coverage_reduce"):
+                # Road subpixels are 255, so the mean of each block is its coverage. Rows
+                # are summed first, which adds up whole contiguous rows at a time.
+                block_sums = (
+                    strip_img.reshape(3, rows, supersample, width * supersample)
+                    .sum(axis=2, dtype=np.uint32)
+                    .reshape(3, rows, width, supersample)
+                    .sum(axis=3)
+                )
+                output_coverage_img[:, row_off : row_off + rows] = (
+                    block_sums + supersample**2 // 2
+                ) // supersample**2
+        return output_coverage_img
+
+    def road_image_for_grid(
+        self,
+        crs: rasterio.crs.CRS,
+        transform: rasterio.Affine,
+        width: int,
+        height: int,
+        out: Optional[np.ndarray] = None,
+        warped_grid: Optional[Tuple[rasterio.Affine, int, int]] = None,
+        direct: bool = False,
+    ) -> np.ndarray:
+        """
+        Creates a (3, height, width) road raster image for the grid defined by `crs`,
+        `transform`, `width` and `height`. Roads are rasterized on the equivalent grid in
+        the OSM graph's CRS, and then reprojected onto the requested grid. If the requested
+        grid is part of a larger scene, passing that scene's `warped_grid` rasterizes on the
+        covering part of it instead. See road_image_from_bounding_rasterio_dataset.
+
+        If `direct` is set, the roads within the grid are transformed to `crs` instead
+        (see _geometries_in_crs) and rasterized on the requested grid itself, skipping the
+        resampling of a whole intermediate raster. `warped_grid` is then ignored.
+        """
+        if direct:
+            return self._direct_road_image(crs, transform, width, height, out=out)
+
+        if warped_grid is None:
+            warped_grid = self._warped_grid(crs, transform, width, height)
+        else:
+            warped_grid = self._warped_subgrid(
+                warped_grid, crs, transform, width, height
+            )
+        warped_transform, warped_width, warped_height = warped_grid
+        warped_bbox = box(
+            *rasterio.transform.array_bounds(
+                warped_height, warped_width, warped_transform
+            )
+        )
+
+        # Find intersecting OSM roads within the bounds of the provided grid
+        with instrumentation.span("bbox_query"):
+            road_positions = self.road_query_engine.query_indices(warped_bbox)
+
+        # Rasterize the roads
+        self._warped_roads_img = self._get_buffer(
+            self._warped_roads_img, (3, warped_height, warped_width)
+        )
+        with instrumentation.span("rasterize"):
+            warped_roads_img = self._rasterize_road_classes(
+                road_positions, warped_transform, out=self._warped_roads_img
+            )
+
+        # reproject to the requested grid's crs
+        output_roads_img = self._get_buffer(out, (3, height, width))
+        with instrumentation.span("reproject"):
+            output_roads_img, _dst_transform = rasterio.warp.reproject(
+                warped_roads_img,
+                output_roads_img,
+                src_transform=warped_transform,
+                src_crs=self.osm_graph_edges_gdf.crs,
+                dst_crs=crs,
+                dst_transform=transform,
+            )
+        assert _dst_transform == transform
+        assert output_roads_img.dtype == np.uint8
+
+        return output_roads_img
 
     def road_image_from_bounding_rasterio_dataset(
-        self, input_ds: rasterio.DatasetReader
+        self,
+        input_ds: rasterio.DatasetReader,
+        out: Optional[np.ndarray] = None,
+        direct: bool = False,
     ) -> np.ndarray:
         """
         Creates a road raster image corresponding to the geographic extent of
@@ -121,55 +479,136 @@ class OSMRoadData:
         locations of primary roads, second channel is secondary roads, and third channel
         is local roads. Binary road (no road) values are scaled to 255 (0) for downstream
         visualization and input to ML models.
+
+        A (3, h, w) uint8 `out` array can be provided to write the output into. The
+        intermediate raster in the OSM graph's CRS is kept between calls and reused
+        whenever it has the same shape.
+
+        If `direct` is set, roads are transformed to the dataset's CRS and rasterized on its
+        own grid instead of being rasterized in the OSM graph's CRS and reprojected. This
+        skips a full-raster nearest-neighbour resample, which also keeps thin roads intact.
         """
-        warped_input_ds = rasterio.vrt.WarpedVRT(
-            input_ds, crs=self.osm_graph_edges_gdf.crs
+        return self.road_image_for_grid(
+            input_ds.crs,
+            input_ds.transform,
+            input_ds.width,
+            input_ds.height,
+            out=out,
+            direct=direct,
         )
-        warped_input_ds_bbox = box(*warped_input_ds.bounds)
 
-        # Find intersecting OSM roads within the bounds of the provided dataset
-        intersecting_road_dict = self.get_roads_in_bbox(warped_input_ds_bbox)
+    def road_image_for_window(
+        self,
+        input_ds: rasterio.DatasetReader,
+        window: rasterio.windows.Window,
+        out: Optional[np.ndarray] = None,
+        direct: bool = False,
+        warped_grid: Optional[Tuple[rasterio.Affine, int, int]] = None,
+    ) -> np.ndarray:
+        """
+        Same as road_image_from_bounding_rasterio_dataset, but only for a window of the
+        input dataset, so memory use is bounded by the window size rather than the
+        dataset size. Only roads within the window's extent are queried and rasterized.
 
-        primary_geoseries = intersecting_road_dict["primary"]["geometry"]
-        secondary_geoseries = intersecting_road_dict["secondary"]["geometry"]
-        local_geoseries = intersecting_road_dict["local"]["geometry"]
+        Windows are rasterized on the covering part of the full dataset's warped grid, so
+        mosaicking all windows reproduces the full image, up to GDAL's approximate warp
+        transformer occasionally picking a neighbouring pixel along road edges. In `direct`
+        mode, windows are rasterized on the dataset's own grid, so they always mosaic
+        exactly into the full image.
 
-        # Rasterize the roads
-        primary_road_img = self._rasterize_shapes(primary_geoseries, warped_input_ds)
-        secondary_road_img = self._rasterize_shapes(
-            secondary_geoseries, warped_input_ds
-        )
-        # NOTE: all_touched=True for local roads, as they tend to be more disconnected.
-        # Burning in all touching pixels helps make them more continuous in the rasterized image.
-        local_road_img = self._rasterize_shapes(
-            local_geoseries, warped_input_ds, all_touched=True
+        The dataset's `warped_grid` (see _warped_grid) only depends on the full grid, so
+        callers rasterizing many windows should compute it once and pass it in.
+        """
+        if direct:
+            warped_grid = None
+        elif warped_grid is None:
+            warped_grid = self._warped_grid(
+                input_ds.crs, input_ds.transform, input_ds.width, input_ds.height
+            )
+        return self.road_image_for_grid(
+            input_ds.crs,
+            input_ds.window_transform(window),
+            int(window.width),
+            int(window.height),
+            out=out,
+            warped_grid=warped_grid,
+            direct=direct,
         )
 
-        warped_roads_img = np.stack(
-            (primary_road_img, secondary_road_img, local_road_img)
-        )
+    def write_road_image(
+        self,
+        input_ds: rasterio.DatasetReader,
+        output_path: Path,
+        windowed: bool = False,
+        block_size: int = 512,
+        cog_options: CogOptions = CogOptions(),
+        direct: bool = False,
+        coverage_resolution: Optional[float] = None,
+    ):
+        """
+        Writes the road image for the input dataset (see
+        road_image_from_bounding_rasterio_dataset) as a Cloud-Optimized GeoTIFF on the same
+        grid, with `block_size` x `block_size` tiles and overviews (see
+        sample.raster_io.cog_writer). If `windowed` is set, the image is generated and
+        written one block at a time, so memory use is bounded by the block size rather than
+        the size of the dataset. `direct` selects direct rasterization in the dataset's CRS
+        (see road_image_from_bounding_rasterio_dataset).
 
-        warped_roads_img *= 255
-        warped_roads_img = warped_roads_img.astype("uint8")
-        assert warped_roads_img.shape == (
-            3,
-            warped_input_ds.height,
-            warped_input_ds.width,
-        )
+        If `coverage_resolution` is given, a road coverage raster (see
+        road_coverage_for_grid) is written instead, on a grid of that resolution (in the
+        dataset's CRS units) covering the dataset.
+        """
+        kwargs = input_ds.meta.copy()
+        kwargs["dtype"] = rasterio.uint8
+        kwargs["count"] = 3  # (c, h, w)
+        if coverage_resolution is not None:
+            kwargs["transform"], kwargs["width"], kwargs["height"] = coverage_grid(
+                input_ds.transform, input_ds.width, input_ds.height, coverage_resolution
+            )
 
-        # reproject to the src dataset's crs
-        output_roads_img = np.zeros(
-            (3, input_ds.height, input_ds.width), dtype=warped_roads_img.dtype
-        )
-        output_roads_img, _dst_transform = rasterio.warp.reproject(
-            warped_roads_img,
-            output_roads_img,
-            src_transform=warped_input_ds.transform,
-            src_crs=warped_input_ds.crs,
-            dst_crs=input_ds.crs,
-            dst_transform=input_ds.transform,
-        )
-        assert _dst_transform == input_ds.transform
-        assert output_roads_img.dtype == np.uint8
+        with instrumentation.span("road_write"), cog_writer(
+            output_path, kwargs, block_size, cog_options
+        ) as dst:
+            if coverage_resolution is not None:
+                coverage_img = None
+                windows = (
+                    [window for _, window in dst.block_windows(1)]
+                    if windowed
+                    else [rasterio.windows.Window(0, 0, dst.width, dst.height)]
+                )
+                for window in windows:
+                    coverage_img = self.road_coverage_for_grid(
+                        dst.crs,
+                        dst.window_transform(window),
+                        int(window.width),
+                        int(window.height),
+                        out=coverage_img,
+                    )
+                    dst.write(coverage_img, window=window)
+            elif windowed:
+                roads_img = None
+                warped_grid = None
+                if not direct:
+                    warped_grid = self._warped_grid(
+                        input_ds.crs, input_ds.transform, input_ds.width, input_ds.height
+                    )
+                for _, window in dst.block_windows(1):
+                    roads_img = self.road_image_for_window(
+                        input_ds,
+                        window,
+                        out=roads_img,
+                        direct=direct,
+                        warped_grid=warped_grid,
+                    )
+                    dst.write(roads_img, window=window)
+            else:
+                roads_img = self.road_image_from_bounding_rasterio_dataset(
+                    input_ds, direct=direct
+                )
+                dst.write(roads_img)
 
-        return output_roads_img
+    def estimated_nbytes(self) -> int:
+        """
+        Rough estimate of the memory held by the loaded roads, used for memory budgets.
+        """
+        return self.road_query_engine.estimated_nbytes()
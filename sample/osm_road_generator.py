@@ -1,13 +1,30 @@
-from multiprocessing import Pool
+import argparse
+from contextlib import nullcontext
 from pathlib import Path
-import os
+from typing import Dict, List, Optional, Tuple
 
 import rasterio
+import rasterio.warp
 from tqdm import tqdm
-import geopandas as gpd
 
-from sample.osm_road_data import OSMRoadData
-from sample.utils import get_simple_logger
+from sample import instrumentation
+from sample.city_catalog import CityCatalog
+from sample.job_queue import JobQueue, JobState
+from sample.osm_road_data import (
+    COVERAGE_SUPERSAMPLE,
+    ROAD_CLASS_ALL_TOUCHED,
+    SIMPLE_TYPE_TO_OSM_HIGHWAY_TYPE_MAPPING,
+)
+from sample.output_manifest import OutputManifest
+from sample.regional_road_store import RegionalRoadStore
+from sample.road_worker_pool import (
+    RoadRasterTask,
+    RoadWorkerPool,
+    execute_road_task,
+    load_osm_road_data,
+    road_task_to_payload,
+)
+from sample.utils import get_simple_logger, json_sha256, raster_grid_fingerprint
 
 
 class OSMRoadGenerator:
@@ -15,6 +32,27 @@ class OSMRoadGenerator:
     Class to generate a set of OpenStreetMap raster images, given a set of cities and
     previously-generated Sentinel-2 images. Generation can be run in either serial or
     parallel.
+
+    Outputs are Cloud-Optimized GeoTIFFs with `block_size` x `block_size` internal blocks
+    and overviews (see sample.raster_io). In windowed mode, road images are generated and
+    written one block at a time, so memory use is bounded by the block size rather than
+    the size of the scene. In direct mode, roads are transformed to each scene's CRS and
+    rasterized on its own grid, rather than rasterized in the OSM graph's CRS and
+    reprojected (see OSMRoadData.road_image_from_bounding_rasterio_dataset). With a
+    `coverage_resolution`, fractional road coverage rasters of that resolution are
+    generated instead of binary road masks (see OSMRoadData.road_coverage_for_grid).
+
+    By default, a single road raster ({city_id}.tif) is generated per city, on the grid of
+    the city's first RGB tif. In per-grid mode, a road raster is generated for every distinct
+    grid (CRS, transform and shape) among the city's RGB tifs, mirroring their paths.
+
+    Cities without a graphml file in `data/osm_networks` can be served from a regional
+    road store (see sample.regional_road_store) given as `regional_store_path`, which
+    loads the roads within each city's bounds.
+
+    A manifest in the output folder records the inputs of every output (graphml hash, grid
+    fingerprint, road class settings), so outputs that are already up to date are skipped.
+    Outputs are written atomically, so interrupted runs never leave truncated rasters.
     """
 
     def __init__(
@@ -22,17 +60,37 @@ class OSMRoadGenerator:
         cities_geojson_path: Path = Path("data/city_ids_and_bounds.geojson"),
         root_s2_img_path: Path = Path("data/sentinel2_images"),
         root_osm_output_path: Path = Path("data/osm_images"),
+        city_ids: Optional[List[int]] = None,
+        city_catalog: Optional[CityCatalog] = None,
+        windowed: bool = False,
+        block_size: int = 512,
+        per_grid: bool = False,
+        direct: bool = False,
+        regional_store_path: Optional[Path] = None,
+        coverage_resolution: Optional[float] = None,
     ):
         self.logger = get_simple_logger(self.__class__.__name__)
 
         self.root_s2_img_path = root_s2_img_path
         self.root_osm_output_path = root_osm_output_path
+        self.windowed = windowed
+        self.block_size = block_size
+        self.per_grid = per_grid
+        self.direct = direct
+        self.regional_store_path = regional_store_path
+        self.coverage_resolution = coverage_resolution
+        self.manifest = OutputManifest(self.root_osm_output_path)
 
         if not self.root_osm_output_path.exists():
             self.root_osm_output_path.mkdir(exist_ok=True)
 
-        # initialize cities GeoDataFrame
-        self.cities_gdf = gpd.read_file(cities_geojson_path)
+        # initialize city catalog (unless one is shared with other stages), keeping only
+        # `city_ids` if given
+        if city_catalog is None:
+            city_catalog = CityCatalog.from_geojson(cities_geojson_path)
+        self.city_catalog = (
+            city_catalog if city_ids is None else city_catalog.select(ids=city_ids)
+        )
 
         # initialize OSM graphml artifact
         self.cities_osm_folder = Path("data/osm_networks")
@@ -40,10 +98,35 @@ class OSMRoadGenerator:
     def _get_city_osm_graphml(self, city_id: int) -> Path:
         city_graphml_file = self.cities_osm_folder / f"{city_id}.graphml.gz"
         if not city_graphml_file.exists():
+            if self.regional_store_path is not None:
+                return self.regional_store_path
             self.logger.error(f"Failed to find OSM graphml file: {city_graphml_file}")
             raise FileNotFoundError(city_graphml_file)
         return city_graphml_file
 
+    def _get_city_road_bounds(
+        self, city_id: int, city_graphml_file: Path, visual_tif_path: Path
+    ) -> Optional[Tuple[float, float, float, float]]:
+        """
+        Bounds (in EPSG:4326) of the roads to load from the regional road store for a road
+        raster on the grid of `visual_tif_path`, or None if the city has its own graphml
+        file. This is the union of the city's bounds and the RGB tif's bounds, so roads are
+        loaded up to the edges of the raster even where it extends beyond the city.
+        """
+        if city_graphml_file != self.regional_store_path:
+            return None
+        city_bounds = self.city_catalog.city_bounds(city_id, "EPSG:4326")
+        with rasterio.open(visual_tif_path) as visual_ds:
+            tif_bounds = rasterio.warp.transform_bounds(
+                visual_ds.crs, "EPSG:4326", *visual_ds.bounds
+            )
+        return (
+            float(min(city_bounds[0], tif_bounds[0])),
+            float(min(city_bounds[1], tif_bounds[1])),
+            float(max(city_bounds[2], tif_bounds[2])),
+            float(max(city_bounds[3], tif_bounds[3])),
+        )
+
     def _get_city_visual_tif_path(self, city_id: int) -> Path:
         city_tif_filename = None
         city_root_img_path = self.root_s2_img_path / str(city_id)
@@ -57,51 +140,381 @@ class OSMRoadGenerator:
 
         return city_tif_filename
 
-    def _generate_roads_helper(self, city_id: int):
-        city_graphml_file = self._get_city_osm_graphml(city_id)
-        osm_road_data = OSMRoadData(city_graphml_file)
+    def _get_city_grid_road_tasks(
+        self,
+        city_id: int,
+        city_graphml_file: Path,
+    ) -> List[RoadRasterTask]:
+        """
+        One task per distinct grid among the city's RGB tifs. Road rasters are written to
+        the same relative path as their RGB tif (e.g. {city_id}/{year}/{season}.tif), and
+        rasters for tifs sharing a grid are hard-linked to the one that gets generated.
+        """
+        city_root_img_path = self.root_s2_img_path / str(city_id)
+        city_root_output_path = self.root_osm_output_path / str(city_id)
 
-        tif_filename = self._get_city_visual_tif_path(city_id)
+        tif_filenames_by_grid = {}
+        for tif_filename in sorted(city_root_img_path.rglob("*.tif")):
+            try:
+                with rasterio.open(tif_filename) as visual_ds:
+                    grid_fingerprint = raster_grid_fingerprint(visual_ds)
+            except rasterio.errors.RasterioIOError:
+                self.logger.error(f"Failed to open RGB image {tif_filename}")
+                continue
+            tif_filenames_by_grid.setdefault(grid_fingerprint, []).append(tif_filename)
 
-        if tif_filename is None:
-            return city_id
+        if len(tif_filenames_by_grid) == 0:
+            self.logger.error(f"Failed to find any RGB images for city {city_id}")
 
+        return [
+            RoadRasterTask(
+                city_id,
+                city_graphml_file,
+                tif_filenames[0],
+                city_root_output_path / tif_filenames[0].relative_to(city_root_img_path),
+                tuple(
+                    city_root_output_path / tif_filename.relative_to(city_root_img_path)
+                    for tif_filename in tif_filenames[1:]
+                ),
+                self._get_city_road_bounds(
+                    city_id, city_graphml_file, tif_filenames[0]
+                ),
+            )
+            for tif_filenames in tif_filenames_by_grid.values()
+        ]
+
+    def _get_city_road_tasks(self, city_id: int) -> List[RoadRasterTask]:
         try:
-            visual_ds = rasterio.open(tif_filename)
+            city_graphml_file = self._get_city_osm_graphml(city_id)
+        except FileNotFoundError:
+            return []
+
+        if self.per_grid:
+            return self._get_city_grid_road_tasks(city_id, city_graphml_file)
+
+        tif_filename = self._get_city_visual_tif_path(city_id)
+        if tif_filename is None:
+            return []
+        try:
+            bounds = self._get_city_road_bounds(city_id, city_graphml_file, tif_filename)
         except rasterio.errors.RasterioIOError:
+            self.logger.error(f"Failed to open RGB image {tif_filename}")
+            return []
+
+        return [
+            RoadRasterTask(
+                city_id,
+                city_graphml_file,
+                tif_filename,
+                self.root_osm_output_path / f"{city_id}.tif",
+                bounds=bounds,
+            )
+        ]
+
+    def _get_road_task_inputs(self, task: RoadRasterTask) -> Dict:
+        """
+        Everything a task's road raster depends on, as recorded in the output manifest.
+        """
+        with rasterio.open(task.visual_tif_path) as visual_ds:
+            grid_fingerprint = raster_grid_fingerprint(visual_ds)
+        if task.bounds is None:
+            roads_input = {
+                "osm_graphml_sha256": self.manifest.file_sha256(task.osm_graphml_path)
+            }
+        else:
+            roads_input = {
+                "regional_store_sha256": RegionalRoadStore(
+                    task.osm_graphml_path
+                ).fingerprint(),
+                "bounds": list(task.bounds),
+            }
+        return {
+            **roads_input,
+            "grid_fingerprint": grid_fingerprint,
+            "highway_type_mapping_sha256": json_sha256(
+                SIMPLE_TYPE_TO_OSM_HIGHWAY_TYPE_MAPPING
+            ),
+            "all_touched": ROAD_CLASS_ALL_TOUCHED,
+            "windowed": self.windowed,
+            "block_size": self.block_size,
+            "format": "cog",
+            "direct": self.direct,
+            "coverage": None
+            if self.coverage_resolution is None
+            else {
+                "resolution": self.coverage_resolution,
+                "supersample": COVERAGE_SUPERSAMPLE,
+            },
+        }
+
+    def _filter_up_to_date_tasks(
+        self, tasks: List[RoadRasterTask], force: bool = False
+    ) -> Tuple[List[RoadRasterTask], Dict[Path, Dict]]:
+        """
+        Drops tasks whose outputs are all up to date in the manifest, unless `force` is set.
+        Also returns the inputs of the remaining tasks, keyed by output path, for recording
+        in the manifest once they complete.
+        """
+        remaining_tasks = []
+        inputs_by_output_path = {}
+        for task in tasks:
+            try:
+                with instrumentation.span("manifest_check"):
+                    inputs = self._get_road_task_inputs(task)
+            except rasterio.errors.RasterioIOError:
+                # Let the task itself fail and report it
+                remaining_tasks.append(task)
+                continue
+
+            output_paths = (task.output_path,) + task.link_paths
+            if not force and all(
+                self.manifest.is_up_to_date(output_path, inputs)
+                for output_path in output_paths
+            ):
+                self.logger.info(f"Skipping up-to-date {task.output_path}")
+                continue
+
+            remaining_tasks.append(task)
+            inputs_by_output_path[task.output_path] = inputs
+        return remaining_tasks, inputs_by_output_path
+
+    def _record_completed_task(
+        self, task: RoadRasterTask, inputs_by_output_path: Dict[Path, Dict]
+    ):
+        inputs = inputs_by_output_path.get(task.output_path)
+        if inputs is None:
+            return
+        for output_path in (task.output_path,) + task.link_paths:
+            self.manifest.record(output_path, inputs)
+
+    def _generate_roads_helper(self, city_id: int, force: bool = False):
+        tasks = self._get_city_road_tasks(city_id)
+        if len(tasks) == 0:
             return city_id
 
-        roads_img = osm_road_data.road_image_from_bounding_rasterio_dataset(visual_ds)
-
-        # output
-        kwargs = visual_ds.meta.copy()
-        kwargs["dtype"] = rasterio.uint8
-        kwargs["compress"] = "lzw"
-        kwargs["count"] = roads_img.shape[0]  # (c, h, w)
-
-        roads_output_filename = self.root_osm_output_path / f"{city_id}.tif"
-
-        with rasterio.open(roads_output_filename, "w", **kwargs) as dst:
-            dst.write(roads_img)
-
-    def generate_roads_parallel(self):
-        with Pool(os.cpu_count() // 2) as p:
-            r = list(
-                tqdm(
-                    p.imap_unordered(
-                        self._generate_roads_helper,
-                        self.cities_gdf["asset_identifier"],
-                    ),
-                    total=len(self.cities_gdf),
-                    desc="Processing images",
+        tasks, inputs_by_output_path = self._filter_up_to_date_tasks(tasks, force=force)
+        if len(tasks) == 0:
+            return None
+
+        # Per-grid tasks served from a regional road store each have their own
+        # bounds, so roads are loaded once per (graphml path, bounds), not per city
+        tasks_by_roads = {}
+        for task in tasks:
+            roads_key = (task.osm_graphml_path, task.bounds)
+            tasks_by_roads.setdefault(roads_key, []).append(task)
+
+        try:
+            for (osm_graphml_path, bounds), roads_tasks in tasks_by_roads.items():
+                osm_road_data = load_osm_road_data(osm_graphml_path, bounds)
+                for task in roads_tasks:
+                    try:
+                        with instrumentation.span("road_task"):
+                            execute_road_task(
+                                osm_road_data,
+                                task,
+                                windowed=self.windowed,
+                                block_size=self.block_size,
+                                direct=self.direct,
+                                coverage_resolution=self.coverage_resolution,
+                            )
+                    except rasterio.errors.RasterioIOError:
+                        return city_id
+                    self._record_completed_task(task, inputs_by_output_path)
+        finally:
+            self.manifest.save()
+
+    def _get_all_road_tasks(
+        self, force: bool = False
+    ) -> Tuple[List[int], List[RoadRasterTask], Dict[Path, Dict]]:
+        """
+        The road tasks of all cities that aren't up to date (see _filter_up_to_date_tasks),
+        along with the cities that have no RGB tifs to generate roads for.
+        """
+        missing_city_ids = []
+        tasks = []
+        for city_id in self.city_catalog.ids.tolist():
+            city_tasks = self._get_city_road_tasks(city_id)
+            if len(city_tasks) == 0:
+                missing_city_ids.append(city_id)
+            tasks.extend(city_tasks)
+        tasks, inputs_by_output_path = self._filter_up_to_date_tasks(tasks, force=force)
+        return missing_city_ids, tasks, inputs_by_output_path
+
+    def generate_roads_parallel(
+        self,
+        num_workers: Optional[int] = None,
+        memory_budget_bytes: Optional[int] = None,
+        force: bool = False,
+    ):
+        """
+        Generate road rasters using a RoadWorkerPool, which loads each city's roads at most
+        once per worker. `memory_budget_bytes` bounds the total size of the road networks
+        kept loaded across all workers.
+
+        Outputs that are up to date in the manifest are skipped, unless `force` is set.
+        """
+        r, tasks, inputs_by_output_path = self._get_all_road_tasks(force=force)
+        tasks_by_output_path = {task.output_path: task for task in tasks}
+
+        pool = RoadWorkerPool(
+            num_workers=num_workers,
+            memory_budget_bytes=memory_budget_bytes,
+            windowed=self.windowed,
+            block_size=self.block_size,
+            direct=self.direct,
+            coverage_resolution=self.coverage_resolution,
+        )
+        results = pool.run(tasks)
+        for result in results:
+            if result.error is None:
+                self._record_completed_task(
+                    tasks_by_output_path[result.output_path], inputs_by_output_path
                 )
-            )
-        self.logger.info(f"Images with errors: {[p for p in r if p is not None]}")
+        self.manifest.save()
+
+        r.extend({result.city_id for result in results if result.error is not None})
+        self.logger.info(f"Images with errors: {r}")
+
+    def generate_roads_queued(
+        self,
+        queue_path: Path,
+        num_workers: Optional[int] = None,
+        memory_budget_bytes: Optional[int] = None,
+        force: bool = False,
+    ):
+        """
+        Generate road rasters through a persistent JobQueue at `queue_path`, with one job
+        per output. Workers of other runs pointed at the same queue (e.g. on other hosts
+        sharing the filesystem) pull from the same jobs, and a crashed run picks up where it
+        left off when restarted. Failed tasks are retried by the queue, and tasks that
+        failed in an earlier run are retried again. Tasks that are already done in the
+        queue are only redone if `force` is set.
 
-    def generate_roads(self):
+        Outputs that are done in the queue are recorded in this run's manifest, so runs on
+        different hosts should not share an output manifest while they overlap.
+        """
+        r, tasks, inputs_by_output_path = self._get_all_road_tasks(force=force)
+        tasks_by_output_key = {str(task.output_path): task for task in tasks}
+
+        queue = JobQueue(queue_path)
+        queue.add(
+            ((key, road_task_to_payload(task)) for key, task in tasks_by_output_key.items()),
+            retry_failed=True,
+            redo_done=force,
+        )
+        pool = RoadWorkerPool(
+            num_workers=num_workers,
+            memory_budget_bytes=memory_budget_bytes,
+            windowed=self.windowed,
+            block_size=self.block_size,
+            direct=self.direct,
+            coverage_resolution=self.coverage_resolution,
+        )
+        pool.run_queue(queue)
+
+        for key in queue.keys(JobState.Done):
+            if key in tasks_by_output_key:
+                self._record_completed_task(
+                    tasks_by_output_key[key], inputs_by_output_path
+                )
+        self.manifest.save()
+
+        r.extend(
+            {
+                tasks_by_output_key[key].city_id
+                for key in queue.failures()
+                if key in tasks_by_output_key
+            }
+        )
+        self.logger.info(f"Images with errors: {r}")
+
+    def generate_roads(self, force: bool = False):
+        """
+        Generate road rasters serially. Outputs that are up to date in the manifest are
+        skipped, unless `force` is set.
+        """
         r = []
         for city_path in tqdm(
-            self.cities_gdf["asset_identifier"], desc="Processing images"
+            self.city_catalog.ids.tolist(), desc="Processing images"
         ):
-            r.append(self._generate_roads_helper(city_path))
+            r.append(self._generate_roads_helper(city_path, force=force))
         self.logger.info(f"Images with errors: {[p for p in r if p is not None]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate OSM road rasters for previously downloaded Sentinel-2 mosaics."
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Regenerate outputs even if they are up to date",
+    )
+    parser.add_argument(
+        "--per-grid",
+        action="store_true",
+        help="Generate a road raster for every distinct RGB tif grid",
+    )
+    parser.add_argument(
+        "--windowed",
+        action="store_true",
+        help="Generate and write road rasters one block at a time",
+    )
+    parser.add_argument(
+        "--direct",
+        action="store_true",
+        help="Rasterize roads directly in each scene's CRS, without reprojecting a raster",
+    )
+    parser.add_argument(
+        "--regional-store",
+        type=Path,
+        default=None,
+        help="Regional road store to serve cities without their own graphml file from",
+    )
+    parser.add_argument(
+        "--coverage-resolution",
+        type=float,
+        default=None,
+        help="Generate per-class road coverage fractions on a grid of this resolution "
+        "(in the RGB tifs' CRS units) instead of binary road masks",
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--queue",
+        type=Path,
+        default=None,
+        help="Run through a persistent SQLite job queue at this path, which workers on "
+        "other hosts can share",
+    )
+    parser.add_argument(
+        "--profile-report",
+        type=Path,
+        default=None,
+        help="Write a JSON report of per-stage timings, bytes written and peak RSS here",
+    )
+    args = parser.parse_args()
+
+    with (
+        instrumentation.profile_run(args.profile_report)
+        if args.profile_report
+        else nullcontext()
+    ):
+        osm_road_generator = OSMRoadGenerator(
+            windowed=args.windowed,
+            per_grid=args.per_grid,
+            direct=args.direct,
+            regional_store_path=args.regional_store,
+            coverage_resolution=args.coverage_resolution,
+        )
+        if args.queue is not None:
+            osm_road_generator.generate_roads_queued(
+                args.queue, num_workers=args.workers, force=args.force
+            )
+        else:
+            osm_road_generator.generate_roads_parallel(
+                num_workers=args.workers, force=args.force
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import json
+from pathlib import Path
+from typing import Dict
+
+from sample.utils import atomic_write_path, file_sha256
+
+
+class OutputManifest:
+    """
+    JSON manifest recording, for each output file under `root_path`, the inputs it was
+    generated from (e.g. input file hashes and settings) and its size. An output is up to date
+    if it still exists with the recorded size and was generated from the same inputs.
+
+    File hashes are cached in the manifest by path, size and mtime, so unchanged input files
+    are not re-hashed on every run. The manifest itself is written atomically.
+    """
+
+    def __init__(self, root_path: Path, manifest_filename: str = "manifest.json"):
+        self.root_path = root_path
+        self.manifest_path = root_path / manifest_filename
+        self.outputs = {}
+        self.files = {}
+        if self.manifest_path.exists():
+            manifest = json.loads(self.manifest_path.read_text())
+            self.outputs = manifest.get("outputs", {})
+            self.files = manifest.get("files", {})
+
+    def _key(self, output_path: Path) -> str:
+        return output_path.relative_to(self.root_path).as_posix()
+
+    def file_sha256(self, path: Path) -> str:
+        stat = path.stat()
+        key = str(path.absolute())
+        cached = self.files.get(key)
+        if cached is None or cached["size"] != stat.st_size or cached["mtime_ns"] != stat.st_mtime_ns:
+            cached = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": file_sha256(path)}
+            self.files[key] = cached
+        return cached["sha256"]
+
+    def is_up_to_date(self, output_path: Path, inputs: Dict) -> bool:
+        entry = self.outputs.get(self._key(output_path))
+        if entry is None or not output_path.exists():
+            return False
+        return entry["inputs"] == inputs and entry["size"] == output_path.stat().st_size
+
+    def record(self, output_path: Path, inputs: Dict):
+        self.outputs[self._key(output_path)] = {"inputs": inputs, "size": output_path.stat().st_size}
+
+    def save(self):
+        self.root_path.mkdir(parents=True, exist_ok=True)
+        with atomic_write_path(self.manifest_path) as tmp_path:
+            tmp_path.write_text(json.dumps({"outputs": self.outputs, "files": self.files}, indent=2, sort_keys=True))
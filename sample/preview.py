@@ -0,0 +1,179 @@
+import os
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import rasterio
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+from tqdm import tqdm
+
+from sample.utils import get_simple_logger, raster_grid_fingerprint
+
+
+class PreviewTask(NamedTuple):
+    """
+    A side-by-side preview of a city's RGB mosaic and road raster, titled `title`.
+    """
+
+    title: str
+    visual_tif_path: Path
+    road_tif_path: Path
+    output_path: Path
+
+
+def preview_shape(height: int, width: int, max_size: int) -> Tuple[int, int]:
+    """
+    The shape of a raster downsampled so its longest side is at most `max_size` pixels,
+    keeping its aspect ratio. Rasters are never upsampled.
+    """
+    scale = min(max_size / max(height, width), 1)
+    return max(round(height * scale), 1), max(round(width * scale), 1)
+
+
+def read_preview(path: Path, max_size: int, resampling: Resampling = Resampling.average) -> np.ndarray:
+    """
+    Reads a raster downsampled to at most `max_size` pixels on its longest side, as a
+    (height, width, band) array. GDAL reads from the closest overview, if the raster has
+    any, so the full-resolution raster is never read into memory.
+
+    GDAL can't downsample reads with `Resampling.max` (e.g. to keep one-pixel roads visible),
+    so those go through a WarpedVRT onto the coarser grid instead, which warps the
+    full-resolution raster chunk by chunk.
+    """
+    with rasterio.open(path) as ds:
+        height, width = preview_shape(ds.height, ds.width, max_size)
+        if resampling == Resampling.max:
+            transform = ds.transform * rasterio.Affine.scale(ds.width / width, ds.height / height)
+            with WarpedVRT(
+                ds, crs=ds.crs, transform=transform, width=width, height=height, resampling=resampling
+            ) as vrt:
+                img = vrt.read()
+        else:
+            img = ds.read(out_shape=(ds.count, height, width), resampling=resampling)
+        return np.moveaxis(img, 0, -1)
+
+
+def render_preview(task: PreviewTask, max_size: int = 1024, dpi: int = 100):
+    """
+    Renders and saves the preview of a task, with each panel at most `max_size` pixels on
+    its longest side. The figure is drawn directly on an Agg canvas rather than through
+    pyplot, so it isn't kept in pyplot's list of open figures. Roads are downsampled by
+    their maximum, so thin roads don't fade into the background like averaged RGB pixels.
+    """
+    visual_img = read_preview(task.visual_tif_path, max_size)
+    road_img = read_preview(task.road_tif_path, max_size, resampling=Resampling.max)
+
+    height, width = visual_img.shape[:2]
+    fig = Figure(figsize=(2 * width / dpi, height / dpi + 0.5), dpi=dpi)
+    FigureCanvasAgg(fig)
+    axes = fig.subplots(1, 2)
+
+    for ax, img in zip(axes, (visual_img, road_img)):
+        ax.imshow(img, interpolation="nearest")
+        ax.get_yaxis().set_visible(False)
+        ax.get_xaxis().set_visible(False)
+    fig.suptitle(task.title)
+    fig.tight_layout()
+
+    task.output_path.parent.mkdir(parents=True, exist_ok=True)
+    fig.savefig(task.output_path)
+    fig.clear()
+
+
+def _render_preview_helper(args) -> Tuple[PreviewTask, Optional[str]]:
+    task, max_size, dpi = args
+    try:
+        render_preview(task, max_size=max_size, dpi=dpi)
+    except Exception as e:
+        return task, f"{type(e).__name__}: {e}"
+    return task, None
+
+
+class PreviewGenerator:
+    """
+    Generates .png previews of each city's RGB mosaic and road raster side by side, in
+    `plot_output_path`. Previews are rendered in a process pool of `pool_size` workers,
+    from rasters read at the preview's resolution (see read_preview). So preview time and
+    memory scale with `max_size`, the longest side of each panel in pixels, rather than
+    with the size of the scenes.
+    """
+
+    def __init__(
+        self,
+        root_s2_img_path: Path = Path("data/sentinel2_images"),
+        root_osm_img_path: Path = Path("data/osm_images"),
+        plot_output_path: Path = Path("plots"),
+        max_size: int = 1024,
+        dpi: int = 100,
+        pool_size: int = os.cpu_count() // 2,
+    ):
+        self.logger = get_simple_logger(self.__class__.__name__)
+        self.root_s2_img_path = root_s2_img_path
+        self.root_osm_img_path = root_osm_img_path
+        self.plot_output_path = plot_output_path
+        self.max_size = max_size
+        self.dpi = dpi
+        self.pool_size = pool_size
+
+    def _get_road_tif_path(self, visual_tif_path: Path, city_id: int) -> Optional[Path]:
+        # Road rasters are named as OSMRoadGenerator writes them: one per grid, at the
+        # mosaic's own relative path, or one per city on the grid of its first mosaic
+        relative_path = visual_tif_path.relative_to(self.root_s2_img_path)
+        with rasterio.open(visual_tif_path) as visual_ds:
+            grid_fingerprint = raster_grid_fingerprint(visual_ds)
+
+        for road_tif_path in (self.root_osm_img_path / relative_path, self.root_osm_img_path / f"{city_id}.tif"):
+            if not road_tif_path.exists():
+                continue
+            with rasterio.open(road_tif_path) as road_ds:
+                if raster_grid_fingerprint(road_ds) == grid_fingerprint:
+                    return road_tif_path
+        return None
+
+    def get_city_preview_task(self, city_id: int, city_name: str) -> Optional[PreviewTask]:
+        """
+        The preview of a city's first mosaic that has a road raster on its grid, if any.
+        """
+        city_tif_paths = sorted((self.root_s2_img_path / str(city_id)).rglob("*.tif"))
+        if len(city_tif_paths) == 0:
+            self.logger.warning(f"Failed to find visual images for {city_name}")
+            return None
+
+        for visual_tif_path in city_tif_paths:
+            road_tif_path = self._get_road_tif_path(visual_tif_path, city_id)
+            if road_tif_path is not None:
+                return PreviewTask(
+                    city_name, visual_tif_path, road_tif_path, self.plot_output_path / f"{city_name}.png"
+                )
+
+        self.logger.warning(f"Failed to find road image for {city_name}")
+        return None
+
+    def generate_previews(self, cities: Iterable[Tuple[int, str]], parallel: bool = True) -> List[PreviewTask]:
+        """
+        Generates the previews of `cities`, given as (city ID, city name) pairs, and returns
+        the tasks that failed.
+        """
+        tasks = [task for task in (self.get_city_preview_task(*city) for city in cities) if task is not None]
+        args = [(task, self.max_size, self.dpi) for task in tasks]
+
+        if parallel and len(args) > 1:
+            with Pool(min(self.pool_size, len(args))) as p:
+                results = list(
+                    tqdm(p.imap_unordered(_render_preview_helper, args), total=len(args), desc="Creating previews")
+                )
+        else:
+            results = [_render_preview_helper(arg) for arg in tqdm(args, desc="Creating previews")]
+
+        failed_tasks = []
+        for task, error in results:
+            if error is None:
+                self.logger.info(f"Saved plot to {task.output_path}")
+            else:
+                self.logger.error(f"Failed to create plot for {task.title}: {error}")
+                failed_tasks.append(task)
+        return failed_tasks
@@ -0,0 +1,123 @@
+import os
+from contextlib import contextmanager
+from enum import Enum, auto
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+import numpy as np
+import rasterio
+import rasterio.io
+import rasterio.shutil
+from rasterio.enums import Resampling
+
+from sample import instrumentation
+from sample.utils import atomic_write_path
+
+
+class Compression(Enum):
+    Deflate = auto()
+    Zstd = auto()
+    Lzw = auto()
+
+    def __str__(self):
+        return self.name.lower()
+
+
+class CogOptions(NamedTuple):
+    """
+    Cloud-Optimized GeoTIFF settings shared by all raster outputs. `level` is the codec's
+    compression level (GDAL's default if None), and `predictor` enables horizontal
+    differencing for integer rasters (floating point prediction for float rasters) before
+    compression. If `overviews` is set, internal overviews are built with
+    `overview_resampling`, halving the resolution until the whole raster fits in one block.
+    """
+
+    compress: Compression = Compression.Deflate
+    level: Optional[int] = None
+    predictor: bool = True
+    overviews: bool = True
+    overview_resampling: Resampling = Resampling.average
+    num_threads: int = 1
+
+
+def overview_factors(width: int, height: int, block_size: int) -> List[int]:
+    """
+    Decimation factors (2, 4, 8, ...) of the overviews of a `width` x `height` raster,
+    down to the first overview that fits in a single `block_size` x `block_size` block.
+    """
+    factors = []
+    factor = 2
+    while max(width, height) / (factor // 2) > block_size:
+        factors.append(factor)
+        factor *= 2
+    return factors
+
+
+def _gtiff_predictor(dtype) -> int:
+    return 3 if np.issubdtype(np.dtype(dtype), np.floating) else 2
+
+
+@contextmanager
+def cog_writer(
+    output_path: Path,
+    profile: Dict,
+    block_size: int = 512,
+    cog_options: CogOptions = CogOptions(),
+) -> Iterator[rasterio.io.DatasetWriter]:
+    """
+    Context manager yielding a dataset to write a raster to, which is saved to `output_path`
+    as a Cloud-Optimized GeoTIFF with `block_size` x `block_size` tiles once the context
+    exits. `profile` holds the raster's size, count, dtype, nodata, CRS and transform, as
+    for rasterio.open; any driver, compression and tiling settings in it are overridden.
+
+    Rasters are written to a tiled GeoTIFF staging file next to `output_path` first (so
+    they can still be written window by window), and overviews are built there. On exit,
+    it is copied to the COG layout, with overviews ahead of the full-resolution tiles, to a
+    temporary path that is renamed to `output_path` once complete.
+    """
+    options = {str(key).lower(): value for key, value in profile.items()}
+    for key in ("driver", "compress", "predictor", "zlevel", "zstd_level", "tiled", "blockxsize", "blockysize"):
+        options.pop(key, None)
+
+    staging_path = output_path.with_name(f".{output_path.name}.{os.getpid()}.staging.tif")
+    staging_options = dict(
+        driver="GTiff",
+        tiled=True,
+        blockxsize=block_size,
+        blockysize=block_size,
+        # Staging files are only read once, by the copy, so compress them as fast as possible
+        compress="zstd",
+        zstd_level=1,
+        BIGTIFF="IF_SAFER",
+        num_threads=cog_options.num_threads,
+    )
+    if cog_options.predictor:
+        staging_options["predictor"] = _gtiff_predictor(options["dtype"])
+
+    copy_options = dict(
+        driver="COG",
+        compress=str(cog_options.compress).upper(),
+        predictor="YES" if cog_options.predictor else "NO",
+        blocksize=block_size,
+        overviews="FORCE_USE_EXISTING" if cog_options.overviews else "NONE",
+        BIGTIFF="IF_SAFER",
+        num_threads=cog_options.num_threads,
+    )
+    if cog_options.level is not None:
+        copy_options["level"] = cog_options.level
+
+    try:
+        with rasterio.open(staging_path, "w", **options, **staging_options) as dst:
+            yield dst
+            if cog_options.overviews:
+                factors = overview_factors(dst.width, dst.height, block_size)
+                if len(factors) > 0:
+                    dst.build_overviews(factors, cog_options.overview_resampling)
+                    dst.update_tags(ns="rio_overview", resampling=cog_options.overview_resampling.name)
+
+        with instrumentation.span("cog_copy"), atomic_write_path(output_path) as tmp_path:
+            rasterio.shutil.copy(staging_path, tmp_path, **copy_options)
+        instrumentation.count("bytes_written", output_path.stat().st_size)
+    finally:
+        if staging_path.exists():
+            staging_path.unlink()
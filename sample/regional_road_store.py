@@ -0,0 +1,571 @@
+import argparse
+import bz2
+import gzip
+import json
+import shutil
+import tempfile
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import shapely
+from pyproj import CRS, Transformer
+
+from sample.road_network_cache import RoadNetwork, read_road_network, write_road_network
+from sample.road_query_engine import UNMAPPED_ROAD_CLASS, classify_highways
+from sample.utils import file_sha256, get_simple_logger, json_sha256, replace_directory
+
+REGIONAL_STORE_VERSION = 1
+OSM_CRS = CRS.from_epsg(4326)
+
+# Roads are transformed and partitioned in batches of this many, with vectorized operations
+ROAD_BATCH_SIZE = 10_000
+
+# Buffered coordinates are spilled to disk beyond this many (~80 MB of float64 pairs)
+DEFAULT_BUFFER_COORDS = 5_000_000
+
+logger = get_simple_logger(__name__)
+
+
+def default_partition_size(crs: CRS) -> float:
+    """
+    Partition tiles of roughly 10 km, in the units of `crs`.
+    """
+    return 0.1 if crs.is_geographic else 10_000.0
+
+
+def _open_source(path: Path):
+    if path.suffix == ".gz":
+        return gzip.open(path, "rb")
+    if path.suffix == ".bz2":
+        return bz2.open(path, "rb")
+    return open(path, "rb")
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _iterparse_items(path: Path, container_tags: Tuple[str, ...]) -> Iterator[ET.Element]:
+    """
+    Streams the complete child elements of any `container_tags` element in an XML file.
+    Each element is detached from the tree once it has been yielded, so memory use doesn't
+    grow with the size of the file.
+    """
+    with _open_source(path) as f:
+        stack = []
+        for event, elem in ET.iterparse(f, events=("start", "end")):
+            if event == "start":
+                stack.append(elem)
+                continue
+            stack.pop()
+            if len(stack) > 0 and _local_name(stack[-1].tag) in container_tags:
+                yield elem
+                stack[-1].remove(elem)
+
+
+def _sorted_lookup(ids: np.ndarray, sorted_ids: np.ndarray) -> np.ndarray:
+    """
+    Positions of `ids` in `sorted_ids`, or -1 for ids that aren't in it.
+    """
+    if len(sorted_ids) == 0:
+        return np.full(len(ids), -1)
+    positions = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    return np.where(sorted_ids[positions] == ids, positions, -1)
+
+
+def _spill_sorted_chunk(chunk_path: Path, ids: np.ndarray, values: Optional[np.ndarray] = None) -> Tuple[Path, ...]:
+    """
+    Saves a chunk of `ids` (and the rows of `values` paired with them, if any) sorted by id,
+    to be merged with merge_sorted_chunks. Returns the paths of the saved arrays.
+    """
+    order = np.argsort(ids, kind="stable")
+    paths = (chunk_path.with_suffix(".ids.npy"),)
+    np.save(paths[0], ids[order])
+    if values is not None:
+        paths += (chunk_path.with_suffix(".values.npy"),)
+        np.save(paths[1], values[order])
+    return paths
+
+
+def merge_sorted_chunks(
+    chunks: List[Tuple[Path, ...]], output_path: Path, block_size: int = DEFAULT_BUFFER_COORDS
+) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Out-of-core k-way merge of chunks of sorted ids (each a path to an .npy array, optionally
+    with a path to the array of values paired with them, as written by _spill_sorted_chunk)
+    into a single sorted array of unique ids, keeping the values of the first chunk an id
+    appears in. The merged ids (and values) are written to raw files next to `output_path`
+    and returned memory-mapped, and at most about `block_size` ids are held in memory.
+    """
+    chunk_ids = [np.load(chunk[0], mmap_mode="r") for chunk in chunks]
+    chunk_values = [np.load(chunk[1], mmap_mode="r") if len(chunk) > 1 else None for chunk in chunks]
+    has_values = len(chunks) > 0 and chunk_values[0] is not None
+    n_value_columns = chunk_values[0].shape[1] if has_values else 0
+    cursors = [0] * len(chunks)
+    block_size = max(1, block_size // max(1, len(chunks)))
+    ids_path, values_path = output_path.with_suffix(".ids"), output_path.with_suffix(".values")
+
+    last_id, n_ids = None, 0
+    with open(ids_path, "wb") as ids_file, open(values_path, "wb") as values_file:
+        while True:
+            blocks = [
+                (i, ids[cursors[i] : cursors[i] + block_size])
+                for i, ids in enumerate(chunk_ids)
+                if cursors[i] < len(ids)
+            ]
+            if len(blocks) == 0:
+                break
+            # Every id up to the smallest last id of the blocks is in a block, as chunks are sorted
+            threshold = min(block[-1] for _, block in blocks)
+            merged_ids, merged_values = [], []
+            for i, block in blocks:
+                n_taken = int(np.searchsorted(block, threshold, side="right"))
+                merged_ids.append(block[:n_taken])
+                if has_values:
+                    merged_values.append(chunk_values[i][cursors[i] : cursors[i] + n_taken])
+                cursors[i] += n_taken
+
+            merged_ids = np.concatenate(merged_ids)
+            order = np.argsort(merged_ids, kind="stable")
+            merged_ids = merged_ids[order]
+            keep = np.ones(len(merged_ids), dtype=bool)
+            keep[1:] = merged_ids[1:] != merged_ids[:-1]
+            if last_id is not None:
+                keep &= merged_ids != last_id
+            ids_file.write(merged_ids[keep].tobytes())
+            if has_values:
+                values_file.write(np.concatenate(merged_values)[order][keep].astype(np.float64).tobytes())
+            n_ids += int(keep.sum())
+            last_id = merged_ids[-1]
+
+    if n_ids == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, n_value_columns)) if has_values else None
+    ids = np.memmap(ids_path, dtype=np.int64, mode="r")
+    values = np.memmap(values_path, dtype=np.float64, mode="r", shape=(n_ids, n_value_columns)) if has_values else None
+    return ids, values
+
+
+def iter_osm_xml_roads(
+    osm_path: Path, highway_types: Dict[str, int], work_dir: Path, buffer_size: int = DEFAULT_BUFFER_COORDS
+) -> Iterator[Tuple[np.ndarray, int]]:
+    """
+    Streams the (lon/lat coordinates, road class code) of every way in an OSM XML file
+    (optionally .gz or .bz2 compressed) with a `highway` tag in `highway_types`.
+
+    As OSM XML lists all nodes before the ways that reference them, the file is read twice:
+    first to spill the node references of matching ways to `work_dir`, and then to look up
+    the coordinates of just those nodes, which are kept in memory-mapped arrays. At most
+    `buffer_size` node references or nodes are held in memory while reading, and the
+    referenced node ids are deduplicated per chunk and merged out of core.
+    """
+    ref_chunks, length_chunks, code_chunks, unique_ref_chunks = [], [], [], []
+    refs, lengths, codes = [], [], []
+
+    def spill():
+        if len(codes) > 0:
+            chunk_index = len(code_chunks)
+            unique_ref_chunks.append(
+                _spill_sorted_chunk(work_dir / f"ways_unique_refs_{chunk_index}", np.unique(np.asarray(refs, np.int64)))
+            )
+            for chunks, name, values, dtype in [
+                (ref_chunks, "refs", refs, np.int64),
+                (length_chunks, "lengths", lengths, np.int64),
+                (code_chunks, "codes", codes, np.int8),
+            ]:
+                chunk_path = work_dir / f"ways_{name}_{chunk_index}.npy"
+                np.save(chunk_path, np.asarray(values, dtype=dtype))
+                chunks.append(chunk_path)
+                values.clear()
+
+    for elem in _iterparse_items(osm_path, ("osm",)):
+        if elem.tag != "way":
+            continue
+        highway = next((tag.get("v") for tag in elem.iter("tag") if tag.get("k") == "highway"), None)
+        if highway not in highway_types:
+            continue
+        way_refs = [int(nd.get("ref")) for nd in elem.iter("nd")]
+        refs.extend(way_refs)
+        lengths.append(len(way_refs))
+        codes.append(highway_types[highway])
+        if len(refs) > buffer_size:
+            spill()
+    spill()
+    if len(code_chunks) == 0:
+        return
+
+    node_ids, _ = merge_sorted_chunks(unique_ref_chunks, work_dir / "node_ids", block_size=buffer_size)
+    node_coords = np.lib.format.open_memmap(work_dir / "node_coords.npy", "w+", np.float64, (len(node_ids), 2))
+    node_coords[:] = np.nan
+
+    def store_nodes(ids, coords):
+        positions = _sorted_lookup(np.asarray(ids, dtype=np.int64), node_ids)
+        found = positions >= 0
+        node_coords[positions[found]] = np.asarray(coords)[found]
+        ids.clear()
+        coords.clear()
+
+    ids, coords = [], []
+    for elem in _iterparse_items(osm_path, ("osm",)):
+        if elem.tag == "node":
+            ids.append(int(elem.get("id")))
+            coords.append((float(elem.get("lon")), float(elem.get("lat"))))
+            if len(ids) >= buffer_size:
+                store_nodes(ids, coords)
+    store_nodes(ids, coords)
+
+    for refs_path, lengths_path, codes_path in zip(ref_chunks, length_chunks, code_chunks):
+        chunk_coords = node_coords[_sorted_lookup(np.load(refs_path), node_ids)]
+        chunk_lengths = np.load(lengths_path)
+        chunk_codes = np.load(codes_path)
+        for way_coords, code in zip(np.split(chunk_coords, np.cumsum(chunk_lengths)[:-1]), chunk_codes):
+            # Ways can reference nodes outside of a clipped extract
+            way_coords = way_coords[~np.isnan(way_coords[:, 0])]
+            if len(way_coords) >= 2:
+                yield way_coords, int(code)
+
+
+def iter_osm_pbf_roads(
+    pbf_path: Path, highway_types: Dict[str, int], work_dir: Path
+) -> Iterator[Tuple[np.ndarray, int]]:
+    """
+    Same as iter_osm_xml_roads, for OSM PBF files. This needs pyosmium, which keeps node
+    locations in a file-backed index in `work_dir`.
+    """
+    import osmium
+
+    processor = osmium.FileProcessor(str(pbf_path), osmium.osm.NODE | osmium.osm.WAY).with_locations(
+        f"sparse_file_array,{work_dir / 'node_locations.bin'}"
+    )
+    for obj in processor:
+        if not obj.is_way() or obj.tags.get("highway") not in highway_types:
+            continue
+        way_coords = np.array([(node.lon, node.lat) for node in obj.nodes if node.location.valid()])
+        if len(way_coords) >= 2:
+            yield way_coords, highway_types[obj.tags["highway"]]
+
+
+def iter_graphml_roads(
+    graphml_path: Path, highway_types: Dict[str, int], work_dir: Path, buffer_size: int = DEFAULT_BUFFER_COORDS
+) -> Iterator[Tuple[np.ndarray, int]]:
+    """
+    Streams the (coordinates, road class code) of every edge in an OSMnx GraphML file
+    (e.g. a merged regional graph) whose `highway` attribute is in `highway_types`. Edges
+    without a geometry are straight lines between their nodes. The CRS is read by
+    graphml_crs.
+
+    Node coordinates are spilled to `work_dir` in sorted chunks of `buffer_size` nodes,
+    which are merged into memory-mapped arrays to look up edge endpoints.
+    """
+    key_names = {}
+    node_ids, node_coords, node_chunks = [], [], []
+    sorted_node_ids = sorted_node_coords = None
+
+    def spill_nodes():
+        if len(node_ids) > 0:
+            chunk_path = work_dir / f"nodes_{len(node_chunks)}"
+            ids, coords = np.asarray(node_ids, np.int64), np.asarray(node_coords, np.float64).reshape(-1, 2)
+            node_chunks.append(_spill_sorted_chunk(chunk_path, ids, coords))
+            node_ids.clear()
+            node_coords.clear()
+
+    for elem in _iterparse_items(graphml_path, ("graphml", "graph")):
+        tag = _local_name(elem.tag)
+        if tag == "key":
+            key_names[elem.get("id")] = elem.get("attr.name")
+        elif tag == "node":
+            data = {key_names.get(d.get("key")): d.text for d in elem if _local_name(d.tag) == "data"}
+            node_ids.append(int(elem.get("id")))
+            node_coords.append((float(data["x"]), float(data["y"])))
+            if len(node_ids) >= buffer_size:
+                spill_nodes()
+        elif tag == "edge":
+            data = {key_names.get(d.get("key")): d.text for d in elem if _local_name(d.tag) == "data"}
+            if data.get("highway") not in highway_types:
+                continue
+            if data.get("geometry") is not None:
+                edge_coords = shapely.get_coordinates(shapely.from_wkt(data["geometry"]))
+            else:
+                if sorted_node_ids is None:
+                    # OSMnx writes all nodes before the edges
+                    spill_nodes()
+                    sorted_node_ids, sorted_node_coords = merge_sorted_chunks(
+                        node_chunks, work_dir / "nodes", block_size=buffer_size
+                    )
+                positions = _sorted_lookup(
+                    np.array([int(elem.get("source")), int(elem.get("target"))]), sorted_node_ids
+                )
+                if np.any(positions < 0):
+                    continue
+                edge_coords = sorted_node_coords[positions]
+            yield edge_coords, highway_types[data["highway"]]
+
+
+def graphml_crs(graphml_path: Path) -> CRS:
+    """
+    The CRS recorded in an OSMnx GraphML file's graph attributes (which come before any
+    nodes, so only the start of the file is read).
+    """
+    key_names = {}
+    for elem in _iterparse_items(graphml_path, ("graphml", "graph")):
+        tag = _local_name(elem.tag)
+        if tag == "key":
+            key_names[elem.get("id")] = elem.get("attr.name")
+        elif tag == "data" and key_names.get(elem.get("key")) == "crs":
+            return CRS.from_user_input(elem.text)
+        elif tag in ("node", "edge"):
+            break
+    return OSM_CRS
+
+
+def _highway_type_codes(simple_type_to_osm_highway_type_mapping: Dict[str, List[str]]) -> Dict[str, int]:
+    highway_types = [
+        highway_type
+        for highway_types in simple_type_to_osm_highway_type_mapping.values()
+        for highway_type in highway_types
+    ]
+    codes = classify_highways(highway_types, simple_type_to_osm_highway_type_mapping)
+    return {highway_type: int(code) for highway_type, code in zip(highway_types, codes) if code != UNMAPPED_ROAD_CLASS}
+
+
+def _take_ragged(coords: np.ndarray, lengths: np.ndarray, indices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The coordinates and lengths of the roads at `indices`, of roads stored as consecutive
+    runs of `lengths` coordinates in `coords`.
+    """
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])[indices]
+    selected_lengths = lengths[indices]
+    run_offsets = np.concatenate([[0], np.cumsum(selected_lengths)[:-1]])
+    coord_indices = np.repeat(starts - run_offsets, selected_lengths) + np.arange(selected_lengths.sum())
+    return coords[coord_indices], selected_lengths
+
+
+class _PartitionWriter:
+    """
+    Sorts roads into square partitions of `partition_size` (in the store's CRS) by their
+    envelope's center, buffering them per partition and spilling all buffers to `work_dir`
+    whenever they hold more than `buffer_coords` coordinates. Roads are added one at a
+    time, but transformed and partitioned a batch at a time.
+    """
+
+    def __init__(self, work_dir: Path, partition_size: float, transformer: Optional[Transformer], buffer_coords: int):
+        self.work_dir = work_dir
+        self.partition_size = partition_size
+        self.transformer = transformer
+        self.buffer_coords = buffer_coords
+
+        self.batch_coords, self.batch_codes = [], []
+        self.buffers: Dict[Tuple[int, int], List[Tuple[np.ndarray, np.ndarray, np.ndarray]]] = {}
+        self.num_buffered_coords = 0
+        self.num_spills = 0
+        self.partitions = set()
+
+    def add(self, coords: np.ndarray, road_class_code: int):
+        self.batch_coords.append(coords)
+        self.batch_codes.append(road_class_code)
+        if len(self.batch_codes) >= ROAD_BATCH_SIZE:
+            self._partition_batch()
+
+    def _partition_batch(self):
+        if len(self.batch_codes) == 0:
+            return
+        lengths = np.array([len(coords) for coords in self.batch_coords], dtype=np.int64)
+        coords = np.concatenate(self.batch_coords).astype(np.float64)
+        codes = np.asarray(self.batch_codes, dtype=np.int8)
+        self.batch_coords, self.batch_codes = [], []
+        if self.transformer is not None:
+            coords = np.column_stack(self.transformer.transform(coords[:, 0], coords[:, 1]))
+
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        centers = (np.minimum.reduceat(coords, starts) + np.maximum.reduceat(coords, starts)) / 2
+        cells = np.floor(centers / self.partition_size).astype(np.int64)
+        for cell in np.unique(cells, axis=0):
+            indices = np.flatnonzero(np.all(cells == cell, axis=1))
+            cell_coords, cell_lengths = _take_ragged(coords, lengths, indices)
+            self.buffers.setdefault(tuple(cell), []).append((cell_coords, cell_lengths, codes[indices]))
+            self.num_buffered_coords += len(cell_coords)
+
+        if self.num_buffered_coords > self.buffer_coords:
+            self._spill()
+
+    def _spill(self):
+        for cell, chunks in self.buffers.items():
+            cell_dir = self.work_dir / f"{cell[0]}_{cell[1]}"
+            cell_dir.mkdir(exist_ok=True)
+            coords, lengths, codes = (np.concatenate(arrays) for arrays in zip(*chunks))
+            np.savez(cell_dir / f"{self.num_spills}.npz", coords=coords, lengths=lengths, codes=codes)
+            self.partitions.add(cell)
+        self.buffers = {}
+        self.num_buffered_coords = 0
+        self.num_spills += 1
+
+    def finish(self, output_dir: Path, crs: CRS) -> Dict[str, Dict]:
+        """
+        Writes every partition to `output_dir` in the road network cache format (see
+        sample.road_network_cache), one partition in memory at a time. Returns the extent
+        of each partition's roads and its number of roads, keyed by partition name.
+        """
+        self._partition_batch()
+        self._spill()
+
+        partitions = {}
+        for cell in sorted(self.partitions):
+            name = f"{cell[0]}_{cell[1]}"
+            chunks = []
+            for chunk_path in sorted((self.work_dir / name).glob("*.npz")):
+                with np.load(chunk_path) as chunk:
+                    chunks.append((chunk["coords"], chunk["lengths"], chunk["codes"]))
+            coords, lengths, codes = (np.concatenate(arrays) for arrays in zip(*chunks))
+            offsets = np.concatenate([[0], np.cumsum(lengths)])
+            geometries = shapely.from_ragged_array(shapely.GeometryType.LINESTRING, coords, (offsets,))
+            write_road_network(RoadNetwork(geometries, codes, crs), output_dir / name, metadata={})
+            partitions[name] = {
+                "bounds": [*coords.min(axis=0).tolist(), *coords.max(axis=0).tolist()],
+                "n_roads": len(codes),
+            }
+            shutil.rmtree(self.work_dir / name)
+        return partitions
+
+
+def build_regional_store(
+    source_path: Path,
+    store_path: Path,
+    simple_type_to_osm_highway_type_mapping: Dict[str, List[str]],
+    crs: Optional[CRS] = None,
+    partition_size: Optional[float] = None,
+    buffer_coords: int = DEFAULT_BUFFER_COORDS,
+):
+    """
+    Ingests a regional road extract (OSM XML, optionally compressed, OSM PBF, or OSMnx
+    GraphML) into a RegionalRoadStore at `store_path`, streaming the source rather than
+    loading it whole. OSM XML is read twice (see iter_osm_xml_roads), PBF and GraphML once.
+    Only roads of the mapped highway types are kept. Roads are stored in `crs` (the source's
+    CRS by default), in square partitions of `partition_size` CRS units.
+
+    Roads are buffered per partition and spilled to disk, so memory use is bounded by
+    `buffer_coords` while reading, and by the largest partition while writing. Node
+    coordinates are looked up in file-backed indices, built with out-of-core merges. The
+    store is built in a temporary folder that replaces `store_path` once complete (see
+    replace_directory).
+    """
+    highway_types = _highway_type_codes(simple_type_to_osm_highway_type_mapping)
+    is_graphml = ".graphml" in source_path.suffixes
+    source_crs = graphml_crs(source_path) if is_graphml else OSM_CRS
+    crs = CRS.from_user_input(crs) if crs is not None else source_crs
+    partition_size = partition_size or default_partition_size(crs)
+    transformer = None if crs == source_crs else Transformer.from_crs(source_crs, crs, always_xy=True)
+
+    logger.info(f"Building regional road store {store_path} from {source_path}...")
+    store_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = Path(tempfile.mkdtemp(prefix=f".{store_path.name}.", dir=store_path.parent))
+    try:
+        work_dir = tmp_path / ".work"
+        work_dir.mkdir()
+        writer = _PartitionWriter(work_dir, partition_size, transformer, buffer_coords)
+        if is_graphml:
+            roads = iter_graphml_roads(source_path, highway_types, work_dir, buffer_size=buffer_coords)
+        elif source_path.suffix == ".pbf":
+            roads = iter_osm_pbf_roads(source_path, highway_types, work_dir)
+        else:
+            roads = iter_osm_xml_roads(source_path, highway_types, work_dir, buffer_size=buffer_coords)
+        for coords, road_class_code in roads:
+            writer.add(coords, road_class_code)
+
+        partitions = writer.finish(tmp_path / "partitions", crs)
+        shutil.rmtree(work_dir)
+        stat = source_path.stat()
+        metadata = {
+            "version": REGIONAL_STORE_VERSION,
+            "crs": crs.to_wkt(),
+            "partition_size": partition_size,
+            "source": {"name": source_path.name, "size": stat.st_size, "sha256": file_sha256(source_path)},
+            "mapping_sha256": json_sha256(simple_type_to_osm_highway_type_mapping),
+            "partitions": partitions,
+        }
+        (tmp_path / "metadata.json").write_text(json.dumps(metadata, indent=2))
+
+        replace_directory(tmp_path, store_path)
+    finally:
+        if tmp_path.exists():
+            shutil.rmtree(tmp_path)
+    logger.info(f"Done, {sum(p['n_roads'] for p in partitions.values())} roads in {len(partitions)} partitions.")
+
+
+class RegionalRoadStore:
+    """
+    Roads of a whole region, as built by build_regional_store: square partitions of roads
+    (assigned by the center of their envelope), each in the road network cache format, and a
+    metadata file recording the CRS, source and extent of every partition's roads. Any
+    bounding box is served by loading just the partitions whose roads reach into it, so
+    adjacent and overlapping cities share the same stored roads.
+    """
+
+    def __init__(self, store_path: Path):
+        self.store_path = store_path
+        self.metadata = json.loads((store_path / "metadata.json").read_text())
+        if self.metadata.get("version") != REGIONAL_STORE_VERSION:
+            raise ValueError(f"Unsupported regional road store version in {store_path}, it needs to be rebuilt")
+        self.crs = CRS.from_wkt(self.metadata["crs"])
+        self.mapping_sha256 = self.metadata["mapping_sha256"]
+
+    def fingerprint(self) -> str:
+        """
+        Hash of the store's metadata, which changes whenever the store is rebuilt from a
+        different source or with different settings.
+        """
+        return json_sha256(self.metadata)
+
+    def partitions_in_bounds(self, bounds: Tuple[float, float, float, float]) -> List[str]:
+        bbox = shapely.box(*bounds)
+        return [
+            name
+            for name, partition in self.metadata["partitions"].items()
+            if shapely.intersects(shapely.box(*partition["bounds"]), bbox)
+        ]
+
+    def load(self, bounds: Tuple[float, float, float, float], bounds_crs: Optional[CRS] = None) -> RoadNetwork:
+        """
+        The roads of all partitions reaching into `bounds` (given in `bounds_crs`, or the
+        store's CRS), which include every stored road intersecting `bounds`.
+        """
+        if bounds_crs is not None and CRS.from_user_input(bounds_crs) != self.crs:
+            bounds = Transformer.from_crs(bounds_crs, self.crs, always_xy=True).transform_bounds(
+                *bounds, densify_pts=21
+            )
+        road_networks = [
+            read_road_network(self.store_path / "partitions" / name) for name in self.partitions_in_bounds(bounds)
+        ]
+        if len(road_networks) == 0:
+            return RoadNetwork(np.empty(0, dtype=object), np.empty(0, dtype=np.int8), self.crs)
+        return RoadNetwork(
+            np.concatenate([road_network.geometries for road_network in road_networks]),
+            np.concatenate([road_network.road_class_codes for road_network in road_networks]),
+            self.crs,
+        )
+
+
+def main():
+    from sample.osm_road_data import SIMPLE_TYPE_TO_OSM_HIGHWAY_TYPE_MAPPING
+
+    parser = argparse.ArgumentParser(
+        description="Build a partitioned regional road store from an OSM XML/PBF or GraphML extract."
+    )
+    parser.add_argument("source_path", type=Path)
+    parser.add_argument("store_path", type=Path)
+    parser.add_argument("--crs", default=None, help="CRS to store roads in (default: the source's)")
+    parser.add_argument("--partition-size", type=float, default=None, help="Partition size in CRS units")
+    args = parser.parse_args()
+
+    build_regional_store(
+        args.source_path,
+        args.store_path,
+        SIMPLE_TYPE_TO_OSM_HIGHWAY_TYPE_MAPPING,
+        crs=args.crs,
+        partition_size=args.partition_size,
+    )
+
+
+if __name__ == "__main__":
+    # e.g. python -m sample.regional_road_store region.osm.pbf data/osm_networks/region.roads
+    main()
@@ -0,0 +1,182 @@
+import json
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+import shapely
+from pyproj import CRS
+
+from sample.road_query_engine import classify_highways
+from sample.utils import atomic_write_path, file_sha256, get_simple_logger, json_sha256, replace_directory
+
+ROAD_NETWORK_CACHE_VERSION = 1
+DEFAULT_CACHE_DIR_NAME = ".road_network_cache"
+
+logger = get_simple_logger(__name__)
+
+
+class RoadNetwork(NamedTuple):
+    """
+    The parts of an OSM road network needed for rasterization: one LineString per edge,
+    its road class code (see sample.road_query_engine), and the CRS of the geometries.
+    """
+
+    geometries: np.ndarray
+    road_class_codes: np.ndarray
+    crs: CRS
+
+
+def road_network_cache_path(osm_graphml_path: Path, cache_dir: Optional[Path] = None) -> Path:
+    """
+    Location of the cached road network for a graphml file. By default, caches live next to
+    the graphml files, in a `.road_network_cache` folder.
+    """
+    if cache_dir is None:
+        cache_dir = osm_graphml_path.parent / DEFAULT_CACHE_DIR_NAME
+    return cache_dir / f"{osm_graphml_path.name}.roads"
+
+
+def write_road_network(road_network: RoadNetwork, output_path: Path, metadata: Dict):
+    """
+    Writes a road network as flat arrays (LineString coordinates, per-edge coordinate offsets
+    and road class codes) in .npy format, so they can be memory-mapped when loaded.
+
+    The arrays are written to a temporary folder that is then moved into place, so a partially
+    written cache is never picked up by a reader.
+    """
+    geometry_type, coords, (offsets,) = shapely.to_ragged_array(road_network.geometries)
+    if geometry_type != shapely.GeometryType.LINESTRING:
+        raise ValueError(f"Expected road network of LineStrings, got {geometry_type!r}")
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = Path(tempfile.mkdtemp(prefix=f".{output_path.name}.", dir=output_path.parent))
+    try:
+        np.save(tmp_path / "coords.npy", coords)
+        np.save(tmp_path / "offsets.npy", offsets.astype(np.int64))
+        np.save(tmp_path / "road_class.npy", road_network.road_class_codes.astype(np.int8))
+        metadata = {
+            **metadata,
+            "version": ROAD_NETWORK_CACHE_VERSION,
+            "crs": road_network.crs.to_wkt(),
+            "n_edges": len(road_network.geometries),
+        }
+        (tmp_path / "metadata.json").write_text(json.dumps(metadata, indent=2))
+
+        replace_directory(tmp_path, output_path)
+    finally:
+        if tmp_path.exists():
+            shutil.rmtree(tmp_path)
+
+
+def read_road_network(cache_path: Path) -> RoadNetwork:
+    """
+    Loads a road network previously written with `write_road_network`.
+    """
+    metadata = json.loads((cache_path / "metadata.json").read_text())
+    coords = np.load(cache_path / "coords.npy", mmap_mode="r")
+    offsets = np.load(cache_path / "offsets.npy", mmap_mode="r")
+    road_class_codes = np.load(cache_path / "road_class.npy", mmap_mode="r")
+
+    geometries = shapely.from_ragged_array(shapely.GeometryType.LINESTRING, coords, (offsets,))
+    return RoadNetwork(geometries, np.asarray(road_class_codes), CRS.from_wkt(metadata["crs"]))
+
+
+def convert_graphml_to_road_network(
+    osm_graphml_path: Path,
+    simple_type_to_osm_highway_type_mapping: Dict[str, List[str]],
+    cache_path: Path,
+) -> RoadNetwork:
+    """
+    One-time conversion of an OSM graphml file into the cached road network format. The
+    graph is parsed with OSMnx, and only edge geometries and road classes are kept.
+    """
+    import osmnx as ox
+
+    logger.info(f"Converting OSM graph {osm_graphml_path} to {cache_path}...")
+    osm_nx_graph = ox.load_graphml(osm_graphml_path)
+    edges_gdf = ox.graph_to_gdfs(osm_nx_graph, nodes=False)
+    del osm_nx_graph
+
+    road_network = RoadNetwork(
+        np.asarray(edges_gdf.geometry.values),
+        classify_highways(edges_gdf["highway"], simple_type_to_osm_highway_type_mapping),
+        CRS.from_user_input(edges_gdf.crs),
+    )
+    stat = osm_graphml_path.stat()
+    write_road_network(
+        road_network,
+        cache_path,
+        metadata={
+            "source": {
+                "name": osm_graphml_path.name,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": file_sha256(osm_graphml_path),
+            },
+            "mapping_sha256": json_sha256(simple_type_to_osm_highway_type_mapping),
+        },
+    )
+    logger.info("Done.")
+    return road_network
+
+
+def _is_cache_current(
+    osm_graphml_path: Path,
+    cache_path: Path,
+    simple_type_to_osm_highway_type_mapping: Dict[str, List[str]],
+) -> bool:
+    metadata_path = cache_path / "metadata.json"
+    if not metadata_path.exists():
+        return False
+
+    metadata = json.loads(metadata_path.read_text())
+    if metadata.get("version") != ROAD_NETWORK_CACHE_VERSION or metadata.get("mapping_sha256") != json_sha256(
+        simple_type_to_osm_highway_type_mapping
+    ):
+        return False
+
+    stat = osm_graphml_path.stat()
+    source = metadata["source"]
+    if source["size"] != stat.st_size:
+        return False
+    if source["mtime_ns"] == stat.st_mtime_ns:
+        return True
+
+    # The file was touched, only rebuild if its contents actually changed
+    if source["sha256"] != file_sha256(osm_graphml_path):
+        return False
+    source["mtime_ns"] = stat.st_mtime_ns
+    with atomic_write_path(metadata_path) as tmp_path:
+        tmp_path.write_text(json.dumps(metadata, indent=2))
+    return True
+
+
+def load_road_network(
+    osm_graphml_path: Path,
+    simple_type_to_osm_highway_type_mapping: Dict[str, List[str]],
+    cache_dir: Optional[Path] = None,
+) -> RoadNetwork:
+    """
+    Loads the road network for an OSM graphml file from its cache, (re)building the cache
+    first if it is missing or stale. A cache is stale if the graphml file contents (checked
+    by size, mtime and SHA-256) or the highway type mapping differ from when it was built.
+    """
+    cache_path = road_network_cache_path(osm_graphml_path, cache_dir)
+    if _is_cache_current(osm_graphml_path, cache_path, simple_type_to_osm_highway_type_mapping):
+        return read_road_network(cache_path)
+    return convert_graphml_to_road_network(osm_graphml_path, simple_type_to_osm_highway_type_mapping, cache_path)
+
+
+def main(osm_graphml_paths: List[str]):
+    from sample.osm_road_data import SIMPLE_TYPE_TO_OSM_HIGHWAY_TYPE_MAPPING
+
+    for osm_graphml_path in osm_graphml_paths:
+        load_road_network(Path(osm_graphml_path), SIMPLE_TYPE_TO_OSM_HIGHWAY_TYPE_MAPPING)
+
+
+if __name__ == "__main__":
+    # e.g. python -m sample.road_network_cache data/osm_networks/*.graphml.gz
+    main(sys.argv[1:])
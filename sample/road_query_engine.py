@@ -0,0 +1,88 @@
+from typing import Dict, Iterable, List, Sequence
+
+import numpy as np
+import shapely
+from shapely.geometry import box
+
+ROAD_CLASSES = ("primary", "secondary", "local")
+UNMAPPED_ROAD_CLASS = -1
+
+# Approximate per-road memory overhead of shapely/GEOS geometry objects and the STRtree
+GEOMETRY_OVERHEAD_BYTES = 300
+
+
+def classify_highways(
+    highway_values: Iterable,
+    simple_type_to_osm_highway_type_mapping: Dict[str, List[str]],
+    road_classes: Sequence[str] = ROAD_CLASSES,
+) -> np.ndarray:
+    """
+    Map OSM `highway` tag values to integer road class codes, where each code is the
+    position of the simplified road type in `road_classes`. Values that are not part of the
+    mapping (including list-valued tags from merged edges) are assigned UNMAPPED_ROAD_CLASS.
+    """
+    osm_highway_type_to_code = {
+        osm_highway_type: code
+        for code, simple_type in enumerate(road_classes)
+        for osm_highway_type in simple_type_to_osm_highway_type_mapping[simple_type]
+    }
+    return np.array(
+        [
+            osm_highway_type_to_code.get(value, UNMAPPED_ROAD_CLASS) if isinstance(value, str) else UNMAPPED_ROAD_CLASS
+            for value in highway_values
+        ],
+        dtype=np.int8,
+    )
+
+
+class RoadQueryEngine:
+    """
+    Spatial index over a set of road geometries with precomputed road class codes.
+
+    The STRtree is built once, so bounding box queries only touch the candidate roads whose
+    envelopes overlap the query box, rather than every road in the network. Exact intersection
+    tests and optional clipping are then done with vectorized shapely operations.
+    """
+
+    def __init__(
+        self,
+        geometries: np.ndarray,
+        road_class_codes: np.ndarray,
+        road_classes: Sequence[str] = ROAD_CLASSES,
+    ):
+        self.geometries = np.asarray(geometries, dtype=object)
+        self.road_class_codes = np.asarray(road_class_codes, dtype=np.int8)
+        assert self.geometries.shape == self.road_class_codes.shape
+        self.road_classes = tuple(road_classes)
+
+        # Unmapped roads are never returned, so leave them out of the index entirely
+        self.indexed_positions = np.flatnonzero(self.road_class_codes != UNMAPPED_ROAD_CLASS)
+        self.tree = shapely.STRtree(self.geometries[self.indexed_positions])
+
+    def __len__(self) -> int:
+        return len(self.geometries)
+
+    def estimated_nbytes(self) -> int:
+        """
+        Rough estimate of the memory held by the geometries, codes and spatial index.
+        """
+        n_coords = int(shapely.get_num_coordinates(self.geometries).sum())
+        return 16 * n_coords + (GEOMETRY_OVERHEAD_BYTES + 1) * len(self.geometries)
+
+    def query_indices(self, bbox: box) -> Dict[str, np.ndarray]:
+        """
+        Returns the (sorted) positions of roads intersecting `bbox`, grouped by road class.
+        """
+        candidates = self.tree.query(bbox)
+        candidate_positions = self.indexed_positions[candidates]
+        intersecting = shapely.intersects(self.geometries[candidate_positions], bbox)
+        positions = np.sort(candidate_positions[intersecting])
+
+        codes = self.road_class_codes[positions]
+        return {road_class: positions[codes == code] for code, road_class in enumerate(self.road_classes)}
+
+    def clip(self, positions: np.ndarray, bbox: box) -> np.ndarray:
+        """
+        Returns the road geometries at `positions`, clipped to the rectangle `bbox`.
+        """
+        return shapely.clip_by_rect(self.geometries[positions], *bbox.bounds)
@@ -0,0 +1,322 @@
+import os
+import resource
+import shutil
+from collections import OrderedDict
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import rasterio
+from tqdm import tqdm
+
+from sample import instrumentation
+from sample.job_queue import Job, JobQueue
+from sample.osm_road_data import OSMRoadData
+from sample.utils import atomic_write_path, get_simple_logger
+
+
+class RoadRasterTask(NamedTuple):
+    """
+    A single road raster to generate: the roads in `osm_graphml_path`, rasterized on the
+    grid of `visual_tif_path`, and written to `output_path`. Any `link_paths` (outputs for
+    other images on the same grid) are hard-linked to the output once it is written.
+
+    If `bounds` (in EPSG:4326) are given, `osm_graphml_path` is a regional road store
+    instead, and the roads within `bounds` are loaded from it.
+    """
+
+    city_id: int
+    osm_graphml_path: Path
+    visual_tif_path: Path
+    output_path: Path
+    link_paths: Tuple[Path, ...] = ()
+    bounds: Optional[Tuple[float, float, float, float]] = None
+
+
+def road_task_to_payload(task: RoadRasterTask) -> Dict:
+    """
+    JSON-serializable form of a task, for queueing it in a JobQueue.
+    """
+    return {
+        "city_id": int(task.city_id),
+        "osm_graphml_path": str(task.osm_graphml_path),
+        "visual_tif_path": str(task.visual_tif_path),
+        "output_path": str(task.output_path),
+        "link_paths": [str(link_path) for link_path in task.link_paths],
+        "bounds": None if task.bounds is None else list(task.bounds),
+    }
+
+
+def road_task_from_payload(payload: Dict) -> RoadRasterTask:
+    return RoadRasterTask(
+        payload["city_id"],
+        Path(payload["osm_graphml_path"]),
+        Path(payload["visual_tif_path"]),
+        Path(payload["output_path"]),
+        tuple(Path(link_path) for link_path in payload["link_paths"]),
+        None if payload.get("bounds") is None else tuple(payload["bounds"]),
+    )
+
+
+class RoadTaskResult(NamedTuple):
+    city_id: int
+    output_path: Path
+    error: Optional[str]
+    peak_rss_bytes: int
+
+
+def load_osm_road_data(
+    osm_graphml_path: Path, bounds: Optional[Tuple[float, float, float, float]] = None
+) -> OSMRoadData:
+    """
+    Loads the roads of a task (see RoadRasterTask): a whole graphml file, or the roads
+    within `bounds` from a regional road store.
+    """
+    if bounds is None:
+        return OSMRoadData(osm_graphml_path)
+    return OSMRoadData.from_regional_store(osm_graphml_path, bounds)
+
+
+class OSMRoadDataCache:
+    """
+    Least-recently-used cache of loaded OSM road networks, keyed by graphml path (and
+    bounds, for roads loaded from a regional road store). Road networks are evicted once
+    their estimated total size exceeds `memory_budget_bytes`, though the most recently used
+    one is always kept.
+    """
+
+    def __init__(self, memory_budget_bytes: Optional[int] = None):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.osm_road_data = OrderedDict()
+        self.nbytes = {}
+
+    def get(self, osm_graphml_path: Path, bounds: Optional[Tuple[float, float, float, float]] = None) -> OSMRoadData:
+        key = osm_graphml_path if bounds is None else (osm_graphml_path, bounds)
+        if key in self.osm_road_data:
+            self.osm_road_data.move_to_end(key)
+            return self.osm_road_data[key]
+
+        osm_road_data = load_osm_road_data(osm_graphml_path, bounds)
+        self.osm_road_data[key] = osm_road_data
+        self.nbytes[key] = osm_road_data.estimated_nbytes()
+        self._evict()
+        return osm_road_data
+
+    def total_nbytes(self) -> int:
+        return sum(self.nbytes.values())
+
+    def _evict(self):
+        if self.memory_budget_bytes is None:
+            return
+        while len(self.osm_road_data) > 1 and self.total_nbytes() > self.memory_budget_bytes:
+            evicted_path, _ = self.osm_road_data.popitem(last=False)
+            del self.nbytes[evicted_path]
+
+
+def link_output(output_path: Path, link_path: Path):
+    """
+    Hard-links `link_path` to `output_path`, atomically replacing any existing file. Falls
+    back to a copy if the filesystem doesn't support hard links.
+    """
+    link_path.parent.mkdir(parents=True, exist_ok=True)
+    with atomic_write_path(link_path) as tmp_path:
+        try:
+            os.link(output_path, tmp_path)
+        except OSError:
+            shutil.copy2(output_path, tmp_path)
+
+
+def execute_road_task(
+    osm_road_data: OSMRoadData,
+    task: RoadRasterTask,
+    windowed: bool = False,
+    block_size: int = 512,
+    direct: bool = False,
+    coverage_resolution: Optional[float] = None,
+):
+    """
+    Writes the road raster for a task and links it to the task's other outputs. The raster
+    is written to a temporary file that is renamed once complete, so an interrupted task
+    never leaves a truncated output behind.
+    """
+    task.output_path.parent.mkdir(parents=True, exist_ok=True)
+    with rasterio.open(task.visual_tif_path) as visual_ds, atomic_write_path(task.output_path) as tmp_path:
+        osm_road_data.write_road_image(
+            visual_ds,
+            tmp_path,
+            windowed=windowed,
+            block_size=block_size,
+            direct=direct,
+            coverage_resolution=coverage_resolution,
+        )
+    for link_path in task.link_paths:
+        link_output(task.output_path, link_path)
+
+
+def _peak_rss_bytes() -> int:
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# Per-worker state, set up by _init_worker
+_worker_cache: Optional[OSMRoadDataCache] = None
+_worker_options = {}
+
+
+def _init_worker(
+    memory_budget_bytes: Optional[int],
+    windowed: bool,
+    block_size: int,
+    direct: bool,
+    coverage_resolution: Optional[float],
+):
+    global _worker_cache, _worker_options
+    _worker_cache = OSMRoadDataCache(memory_budget_bytes)
+    _worker_options = {
+        "windowed": windowed,
+        "block_size": block_size,
+        "direct": direct,
+        "coverage_resolution": coverage_resolution,
+    }
+
+
+def _run_task(task: RoadRasterTask) -> RoadTaskResult:
+    error = None
+    try:
+        with instrumentation.span("road_task"):
+            osm_road_data = _worker_cache.get(task.osm_graphml_path, task.bounds)
+            execute_road_task(osm_road_data, task, **_worker_options)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    instrumentation.flush()
+    return RoadTaskResult(task.city_id, task.output_path, error, _peak_rss_bytes())
+
+
+def _run_task_chunk(tasks: List[RoadRasterTask]) -> List[RoadTaskResult]:
+    return [_run_task(task) for task in tasks]
+
+
+def _run_job(job: Job):
+    task = road_task_from_payload(job.payload)
+    with instrumentation.span("road_task"):
+        osm_road_data = _worker_cache.get(task.osm_graphml_path, task.bounds)
+        execute_road_task(osm_road_data, task, **_worker_options)
+
+
+def _run_queue_worker(queue: JobQueue) -> int:
+    try:
+        return queue.work(_run_job)
+    finally:
+        instrumentation.flush()
+
+
+class RoadWorkerPool:
+    """
+    Process pool for generating road rasters, where each worker keeps the road networks it
+    has loaded in an OSMRoadDataCache. Tasks are handed out in chunks of scenes sharing a
+    road network, so a worker loads a network at most once per chunk (and only once, as long
+    as it fits in its share of the memory budget). A city with more scenes than its share of
+    the run is split into several chunks, so its scenes are still spread across workers.
+
+    `memory_budget_bytes` is the total budget for cached road networks across all workers,
+    and is split evenly between the workers that are started. Workers report their peak RSS with every result, and
+    the pool logs the highest one seen.
+
+    Tasks can also be pulled from a persistent JobQueue (see run_queue), in which case
+    workers in other processes or on other hosts can share the work.
+    """
+
+    def __init__(
+        self,
+        num_workers: Optional[int] = None,
+        memory_budget_bytes: Optional[int] = None,
+        windowed: bool = False,
+        block_size: int = 512,
+        direct: bool = False,
+        coverage_resolution: Optional[float] = None,
+    ):
+        self.logger = get_simple_logger(self.__class__.__name__)
+        self.num_workers = num_workers or max(os.cpu_count() // 2, 1)
+        self.memory_budget_bytes = memory_budget_bytes
+        self.windowed = windowed
+        self.block_size = block_size
+        self.direct = direct
+        self.coverage_resolution = coverage_resolution
+
+    def _chunk_tasks(self, tasks: Iterable[RoadRasterTask]) -> List[List[RoadRasterTask]]:
+        # Chunks of tasks sharing a road network, of at most an even share of the tasks per
+        # worker. The largest chunks are started first, so they don't hold up the end of the run.
+        tasks_by_network = {}
+        for task in sorted(tasks, key=lambda task: str(task.visual_tif_path)):
+            tasks_by_network.setdefault((task.osm_graphml_path, task.bounds), []).append(task)
+        num_tasks = sum(len(network_tasks) for network_tasks in tasks_by_network.values())
+        chunk_size = max(-(-num_tasks // self.num_workers), 1)
+        task_chunks = [
+            network_tasks[start : start + chunk_size]
+            for network_tasks in tasks_by_network.values()
+            for start in range(0, len(network_tasks), chunk_size)
+        ]
+        return sorted(task_chunks, key=len, reverse=True)
+
+    def run(self, tasks: Iterable[RoadRasterTask]) -> List[RoadTaskResult]:
+        task_chunks = self._chunk_tasks(tasks)
+        num_tasks = sum(len(task_chunk) for task_chunk in task_chunks)
+        if num_tasks == 0:
+            return []
+
+        num_workers = min(self.num_workers, len(task_chunks))
+        worker_memory_budget_bytes = None
+        if self.memory_budget_bytes is not None:
+            worker_memory_budget_bytes = self.memory_budget_bytes // num_workers
+
+        with Pool(
+            num_workers,
+            initializer=_init_worker,
+            initargs=(
+                worker_memory_budget_bytes,
+                self.windowed,
+                self.block_size,
+                self.direct,
+                self.coverage_resolution,
+            ),
+        ) as p:
+            results = []
+            with tqdm(total=num_tasks, desc="Processing images") as progress:
+                for chunk_results in p.imap_unordered(_run_task_chunk, task_chunks):
+                    results.extend(chunk_results)
+                    progress.update(len(chunk_results))
+
+        for result in results:
+            if result.error is not None:
+                self.logger.error(f"Failed to generate {result.output_path}: {result.error}")
+        peak_rss_bytes = max(result.peak_rss_bytes for result in results)
+        self.logger.info(f"Peak worker RSS: {peak_rss_bytes / 2**20:.1f} MB")
+        return results
+
+    def run_queue(self, queue: JobQueue) -> int:
+        """
+        Runs road tasks (see road_task_to_payload) from `queue` until it has no more jobs to
+        hand out. Tasks that fail are retried by the queue, and its failed jobs are logged.
+        Returns the number of tasks completed by this pool.
+        """
+        worker_memory_budget_bytes = None
+        if self.memory_budget_bytes is not None:
+            worker_memory_budget_bytes = self.memory_budget_bytes // self.num_workers
+
+        with Pool(
+            self.num_workers,
+            initializer=_init_worker,
+            initargs=(
+                worker_memory_budget_bytes,
+                self.windowed,
+                self.block_size,
+                self.direct,
+                self.coverage_resolution,
+            ),
+        ) as p:
+            num_completed = sum(p.map(_run_queue_worker, [queue] * self.num_workers))
+
+        for key, error in queue.failures().items():
+            self.logger.error(f"Failed to generate {key}: {error}")
+        self.logger.info(f"Completed {num_completed} tasks, queue: {queue.counts()}")
+        return num_completed
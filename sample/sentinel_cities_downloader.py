@@ -1,11 +1,17 @@
 from pathlib import Path
 from multiprocessing import Pool
+from typing import Dict, Iterable, Optional, Tuple
 
 from tqdm import tqdm
-import geopandas as gpd
+import pystac
 import rioxarray  # noqa: F401
 
+from sample import instrumentation
+from sample.city_catalog import CityCatalog
+from sample.job_queue import Job, JobQueue
 from sample.sentinel_downloader import SentinelDownloader, Season
+from sample.stac_search import StacSearchQuery
+from sample.tile_cache import stats_difference
 
 
 class SentinelCitiesDownloader(SentinelDownloader):
@@ -17,69 +23,316 @@ class SentinelCitiesDownloader(SentinelDownloader):
         self,
         cities_geojson_path: Path = Path("data/city_ids_and_bounds.geojson"),
         s2_mosaics_output_path: Path = Path("data/sentinel2_images"),
+        city_ids: Optional[Iterable[int]] = None,
+        city_catalog: Optional[CityCatalog] = None,
         **kwargs,
     ):
         super().__init__(**kwargs)
 
-        # Load GeoDataFrame of cities
-        if not cities_geojson_path.exists():
-            raise FileNotFoundError(cities_geojson_path)
-
-        self.cities_gdf = gpd.read_file(cities_geojson_path)
+        # Load the catalog of cities, unless one is shared with other stages
+        if city_catalog is None:
+            city_catalog = CityCatalog.from_geojson(cities_geojson_path)
+        self.city_catalog = city_catalog if city_ids is None else city_catalog.select(ids=city_ids)
 
         # Setup output folder for saving images
         s2_mosaics_output_path.mkdir(parents=True, exist_ok=True)
         self.output_folder = s2_mosaics_output_path
 
+    def __getstate__(self):
+        # Pool tasks are given their city's ID and bounds, so the catalog isn't pickled into them
+        state = self.__dict__.copy()
+        state["city_catalog"] = None
+        return state
+
+    def _get_daterange(self, year: int, season: Season) -> str:
+        start_mm_dd, end_mm_dd = self.season_dates[season]
+        end_year = year if season != Season.Winter else year + 1
+        return f"{year}-{start_mm_dd}/{end_year}-{end_mm_dd}"
+
+    def _get_output_mosaic_path(self, asset_identifier, year: int, season: Season) -> Path:
+        return self.output_folder / str(asset_identifier) / str(year) / f"{season}.tif"
+
+    def _is_existing_mosaic(self, output_mosaic_path: Path) -> bool:
+        return output_mosaic_path.exists() and output_mosaic_path.stat().st_size > 0
+
+    def _get_pending_dateranges(self, asset_identifier) -> Dict[Tuple[int, Season], str]:
+        """
+        Returns the date range of each (year, season) whose mosaic hasn't been downloaded yet.
+        """
+        return {
+            (year, season): self._get_daterange(year, season)
+            for year in self.years
+            for season in self.season_dates
+            if season in self.seasons
+            and not self._is_existing_mosaic(self._get_output_mosaic_path(asset_identifier, year, season))
+        }
+
+    @staticmethod
+    def _get_spanning_daterange(dateranges: Iterable[str]) -> str:
+        starts, ends = zip(*(daterange.split("/") for daterange in dateranges))
+        return f"{min(starts)}/{max(ends)}"
+
+    def _search_all(self, location_list, stack_per_city=False) -> Dict[Tuple, pystac.ItemCollection]:
+        """
+        Search STAC for all missing (city, year, season) mosaics at once. The searches run
+        concurrently over a single pooled HTTP session, rather than one at a time in each
+        pool worker. Returns the items found, keyed by (asset identifier, year, season).
+
+        With `stack_per_city`, each city is searched once over the date range spanning all
+        its missing mosaics, and its items are keyed by (asset identifier, None, None).
+        """
+        keys, queries = [], []
+        for asset_identifier, asset_bounds in location_list:
+            pending_dateranges = self._get_pending_dateranges(asset_identifier)
+            if stack_per_city and len(pending_dateranges) > 0:
+                pending_dateranges = {(None, None): self._get_spanning_daterange(pending_dateranges.values())}
+            for (year, season), daterange in pending_dateranges.items():
+                keys.append((asset_identifier, year, season))
+                queries.append(StacSearchQuery(asset_bounds, daterange, self.max_cloudcover))
+
+        self.logger.info(f"Searching STAC for {len(queries)} date ranges...")
+        items_by_key = {}
+        for key, result in zip(keys, self.downloader.search_batch(queries)):
+            if isinstance(result, Exception):
+                self.logger.error(f"Failed to search STAC for {key}: {result}")
+            else:
+                items_by_key[key] = result
+
+        cache_stats = self.downloader.cache_stats()
+        if cache_stats is not None:
+            self.logger.info(
+                f"STAC search cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses"
+            )
+        return items_by_key
+
+    def _log_tile_cache_stats(self, start_stats: Optional[Dict[str, float]]):
+        """
+        Logs the tile cache statistics of the reads since `start_stats` were taken. The
+        proxy's own statistics are cumulative over every worker and city it served.
+        """
+        tile_cache_stats = self.downloader.tile_cache_stats()
+        if tile_cache_stats is not None and start_stats is not None:
+            tile_cache_stats = stats_difference(tile_cache_stats, start_stats)
+            self.logger.info(
+                f"Tile cache: {100 * tile_cache_stats['hit_ratio']:.1f}% hit ratio, "
+                f"{tile_cache_stats['bytes_fetched'] / 2**20:.1f} MB fetched, "
+                f"{tile_cache_stats['bytes_saved'] / 2**20:.1f} MB saved"
+            )
+
     def _download_helper(self, info):
-        asset_identifier, asset_geom = info
-        download_seasons = {k: v for k, v in self.season_dates.items() if k in self.seasons}
+        start_stats = self.downloader.tile_cache_stats()
+        with instrumentation.span("city_download"):
+            self._download_city_seasons(info)
+        self._log_tile_cache_stats(start_stats)
+        instrumentation.flush()
+
+    def _download_city_seasons(self, info):
+        asset_identifier, asset_bounds, items_by_key = info
+        download_seasons = [season for season in self.season_dates if season in self.seasons]
 
         for year in tqdm(self.years, desc=f"{asset_identifier} - years"):
             # Store images by year
             curr_output_folder = self.output_folder / str(asset_identifier) / str(year)
             curr_output_folder.mkdir(parents=True, exist_ok=True)
 
-            for season, (start_mm_dd, end_mm_dd) in tqdm(
-                download_seasons.items(), desc=f"{asset_identifier} - seasons"
-            ):
-                output_mosaic_path = curr_output_folder / f"{season}.tif"
-                if output_mosaic_path.exists() and output_mosaic_path.stat().st_size > 0:
+            for season in tqdm(download_seasons, desc=f"{asset_identifier} - seasons"):
+                output_mosaic_path = self._get_output_mosaic_path(asset_identifier, year, season)
+                if self._is_existing_mosaic(output_mosaic_path):
                     self.logger.info(f"Skipping existing mosaic {output_mosaic_path}")
                     continue
 
-                end_year = year if season != Season.Winter else year + 1
-                daterange = f"{year}-{start_mm_dd}/{end_year}-{end_mm_dd}"
+                daterange = self._get_daterange(year, season)
 
                 try:
-                    rgb_mosaic = self._get_rgb_mosaic_for_bounds(asset_geom.bounds, daterange)
+                    # Items are searched for here if the up-front batch search didn't find them
+                    rgb_mosaic = self._get_rgb_mosaic_for_bounds(
+                        asset_bounds, daterange, items=items_by_key.get((asset_identifier, year, season))
+                    )
 
                     if rgb_mosaic is not None:
-                        rgb_mosaic.rio.to_raster(output_mosaic_path)
+                        self.mosaic_writer.write(rgb_mosaic, output_mosaic_path)
                     else:
                         self.logger.error(f"Failed to retrieve RGB mosaic for {season} - {year}")
                 except Exception as e:
                     self.logger.exception(f"Caught exception: {e}")
 
-    def download_all(self, parallel=False, debug=False):
+    def _download_city_stack_helper(self, info):
+        start_stats = self.downloader.tile_cache_stats()
+        with instrumentation.span("city_download"):
+            self._download_city_stack(info)
+        self._log_tile_cache_stats(start_stats)
+        instrumentation.flush()
+
+    def _download_city_stack(self, info):
+        """
+        Downloads all missing mosaics of a city from a single search and stack over the
+        whole date range, split into seasons by item datetime.
+        """
+        asset_identifier, asset_bounds, items_by_key = info
+        pending_dateranges = self._get_pending_dateranges(asset_identifier)
+        if len(pending_dateranges) == 0:
+            self.logger.info(f"Skipping {asset_identifier}, all mosaics exist")
+            return
+
+        daterange = self._get_spanning_daterange(pending_dateranges.values())
+        try:
+            # Items are searched for here if the up-front batch search didn't find them
+            rgb_mosaics = self._get_rgb_mosaics_by_season(
+                asset_bounds,
+                daterange,
+                pending_dateranges.keys(),
+                items=items_by_key.get((asset_identifier, None, None)),
+            )
+        except Exception as e:
+            self.logger.exception(f"Failed to create mosaics for {asset_identifier} ({daterange}): {e}")
+            return
+
+        for year, season in tqdm(pending_dateranges, desc=f"{asset_identifier} - seasons"):
+            rgb_mosaic = rgb_mosaics.get((year, season))
+            if rgb_mosaic is None:
+                self.logger.error(f"Failed to retrieve RGB mosaic for {season} - {year}")
+                continue
+
+            output_mosaic_path = self._get_output_mosaic_path(asset_identifier, year, season)
+            output_mosaic_path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                self.mosaic_writer.write(rgb_mosaic, output_mosaic_path)
+            except Exception as e:
+                self.logger.exception(f"Caught exception: {e}")
+
+    def _download_job(self, job: Job, items_by_key: Dict[Tuple, pystac.ItemCollection]):
+        """
+        Downloads the mosaic of a single (city, year, season) job, raising if it can't be
+        created so the queue retries it.
+        """
+        asset_identifier = job.payload["asset_identifier"]
+        year = job.payload["year"]
+        season = next(season for season in Season if str(season) == job.payload["season"])
+        output_mosaic_path = self._get_output_mosaic_path(asset_identifier, year, season)
+        if self._is_existing_mosaic(output_mosaic_path):
+            self.logger.info(f"Skipping existing mosaic {output_mosaic_path}")
+            return
+
+        with instrumentation.span("mosaic_download"):
+            # Items are searched for here if the up-front batch search didn't find them
+            rgb_mosaic = self._get_rgb_mosaic_for_bounds(
+                tuple(job.payload["bounds"]),
+                self._get_daterange(year, season),
+                items=items_by_key.get((asset_identifier, year, season)),
+            )
+            if rgb_mosaic is None:
+                raise RuntimeError(f"Failed to retrieve RGB mosaic for {season} - {year}")
+            output_mosaic_path.parent.mkdir(parents=True, exist_ok=True)
+            self.mosaic_writer.write(rgb_mosaic, output_mosaic_path)
+
+    def _queue_worker_helper(self, info):
+        queue, items_by_key = info
+        start_stats = self.downloader.tile_cache_stats()
+        queue.work(lambda job: self._download_job(job, items_by_key))
+        self._log_tile_cache_stats(start_stats)
+        instrumentation.flush()
+
+    def _download_all_queued(self, queue: JobQueue, location_list, items_by_key, parallel=False):
+        """
+        Adds a job for every missing (city, year, season) mosaic to `queue`, and works on
+        the queue's jobs (including those added by other runs) until none are left.
+        """
+        queue.add(
+            (
+                (
+                    f"{asset_identifier}/{year}/{season}",
+                    {
+                        "asset_identifier": int(asset_identifier),
+                        "year": year,
+                        "season": str(season),
+                        "bounds": list(asset_bounds),
+                    },
+                )
+                for asset_identifier, asset_bounds in location_list
+                for year, season in self._get_pending_dateranges(asset_identifier)
+            ),
+            retry_failed=True,
+        )
+
+        if parallel:
+            with Pool(self.pool_size) as p:
+                p.map(self._queue_worker_helper, [(queue, items_by_key)] * self.pool_size)
+        else:
+            self._queue_worker_helper((queue, items_by_key))
+
+        for key, error in queue.failures().items():
+            self.logger.error(f"Failed to download {key}: {error}")
+        self.logger.info(f"Download queue: {queue.counts()}")
+
+    def download_all(
+        self,
+        parallel=False,
+        debug=False,
+        batch_search=True,
+        stack_per_city=False,
+        queue_path: Optional[Path] = None,
+    ):
         """
-        Download Sentinel-2 Level-2A products from AWS STAC Catalog, using StackStacDownloader
+        Download Sentinel-2 Level-2A products from AWS STAC Catalog, using StackStacDownloader.
+
+        With `batch_search`, the STAC searches for every city, year and season are run
+        concurrently up front, and workers only stack and mosaic the items found.
+
+        With `stack_per_city`, each city is searched and stacked once over its whole date
+        range, and the stack is split into seasonal mosaics, rather than searching and
+        stacking every season separately. Output paths are the same either way.
+
+        With `queue_path`, each missing (city, year, season) mosaic is a job in a persistent
+        JobQueue at that path, which workers pull one job at a time, so large cities don't
+        hold up the rest. Failed jobs are retried, an interrupted run resumes from the
+        queue, and runs on other hosts sharing the queue file split the jobs between them.
+        This can't be combined with `stack_per_city`.
         """
+        if queue_path is not None and stack_per_city:
+            raise ValueError("stack_per_city downloads whole cities, so it can't use a job queue")
+
+        location_list = [(city.city_id, city.bounds) for city in self.city_catalog]
+        items_by_key = self._search_all(location_list, stack_per_city=stack_per_city) if batch_search else {}
+        download_helper = self._download_city_stack_helper if stack_per_city else self._download_helper
+        # Started here, so all pool workers share one tile cache proxy, and stopped once they're done
+        self.downloader.start_tile_cache_proxy()
+        try:
+            if queue_path is not None:
+                self._download_all_queued(JobQueue(queue_path), location_list, items_by_key, parallel=parallel)
+            else:
+                self._download_all_cities(location_list, items_by_key, download_helper, parallel=parallel)
+            self._count_tile_cache_stats()
+        finally:
+            self.downloader.stop_tile_cache_proxy()
 
-        location_list = list(zip(self.cities_gdf["asset_identifier"], self.cities_gdf["geometry"]))
+    def _download_all_cities(self, location_list, items_by_key, download_helper, parallel=False):
+        # Only send each worker the items for its own city
+        city_items_by_key = {asset_identifier: {} for asset_identifier, _ in location_list}
+        for key, items in items_by_key.items():
+            city_items_by_key[key[0]][key] = items
+        location_list = [
+            (asset_identifier, asset_bounds, city_items_by_key[asset_identifier])
+            for asset_identifier, asset_bounds in location_list
+        ]
 
         if parallel:
             with Pool(self.pool_size) as p:
                 _ = list(
                     tqdm(
-                        p.imap_unordered(self._download_helper, location_list),
+                        p.imap_unordered(download_helper, location_list),
                         total=len(location_list),
                         desc="Processing cities",
                     )
                 )
         else:
             for location in tqdm(location_list, desc="Processing cities"):
-                self._download_helper(location)
+                download_helper(location)
+
+    def _count_tile_cache_stats(self):
+        tile_cache_stats = self.downloader.tile_cache_stats()
+        if tile_cache_stats is not None:
+            instrumentation.count("tile_cache_bytes_fetched", tile_cache_stats["bytes_fetched"])
+            instrumentation.count("tile_cache_bytes_saved", tile_cache_stats["bytes_saved"])
 
 
 def main():
@@ -1,11 +1,16 @@
-from typing import Iterable
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
 from enum import Enum, auto
+from pathlib import Path
 import os
 
-import xrspatial.multispectral as ms
+import pystac
 import xarray as xr
 
+from sample.compositing import CompositeMode
+from sample.mosaic_writer import MosaicWriter
 from sample.stackstac_downloader import StackStacDownloader
+from sample.true_color import StretchMode, stretch_to_uint8
 from sample.utils import get_simple_logger
 
 
@@ -22,7 +27,8 @@ class Season(Enum):
 class SentinelDownloader:
     """
     Class to handle downloading Sentinel-2 mosaics for any/all seasons,
-    utilizing the functionality in StackStacDownloader.
+    utilizing the functionality in StackStacDownloader. Mosaics are computed and
+    written chunk by chunk with `mosaic_writer`.
     """
 
     def __init__(
@@ -31,11 +37,19 @@ class SentinelDownloader:
         years: Iterable[int] = range(2017, 2022),
         seasons: Iterable[Season] = list(Season),
         pool_size: int = os.cpu_count() // 2,
+        stac_cache_path: Optional[Path] = None,
+        tile_cache_dir: Optional[Path] = None,
+        mosaic_writer: Optional[MosaicWriter] = None,
+        composite_mode: CompositeMode = CompositeMode.First,
+        stretch_mode: StretchMode = StretchMode.Gain,
     ):
         self.logger = get_simple_logger(self.__class__.__name__)
         self.max_cloudcover = max_cloudcover
         self.pool_size = pool_size
-        self.downloader = StackStacDownloader()
+        self.downloader = StackStacDownloader(cache_path=stac_cache_path, tile_cache_dir=tile_cache_dir)
+        self.mosaic_writer = mosaic_writer or MosaicWriter()
+        self.composite_mode = composite_mode
+        self.stretch_mode = stretch_mode
         self.years = years
         self.seasons = seasons
         self.season_dates = {
@@ -45,14 +59,41 @@ class SentinelDownloader:
             Season.Winter: ["12-01", "02-28"],
         }
 
+    def _get_year_season(self, date: Optional[datetime]) -> Optional[Tuple[int, Season]]:
+        """
+        Returns the (year, season) a date falls in, or None if it falls outside all of
+        `season_dates`. Winter dates in January and February belong to the previous year's
+        winter, matching the date ranges that are searched for each season.
+        """
+        if date is None:
+            return None
+        mm_dd = date.strftime("%m-%d")
+        for season, (start_mm_dd, end_mm_dd) in self.season_dates.items():
+            if start_mm_dd <= end_mm_dd:
+                if start_mm_dd <= mm_dd <= end_mm_dd:
+                    return date.year, season
+            elif mm_dd >= start_mm_dd:
+                return date.year, season
+            elif mm_dd <= end_mm_dd:
+                return date.year - 1, season
+        return None
+
+    def _to_rgb(self, mosaic: xr.DataArray) -> xr.DataArray:
+        # Scale the reflectance values to the range 0-255 as uint8
+        return stretch_to_uint8(mosaic, mode=self.stretch_mode)
+
     def _get_rgb_mosaic_for_bounds(
         self,
         bounds: Iterable[float],
         daterange: str,
+        items: Optional[pystac.ItemCollection] = None,
     ) -> xr.DataArray:
         """
-        Retrieves an Sentinel-2 RGB mosaic from STAC. The xarray-spatial `true_color` function
-        is used to scale the native uint16 reflectance values to the range 0-255 as uint8.
+        Retrieves an Sentinel-2 RGB mosaic from STAC. Reflectance values are stretched to the
+        range 0-255 as uint8 (see stretch_to_uint8).
+
+        If the STAC `items` for the bounds and date range were already retrieved, they are
+        used instead of searching again.
         """
         rgb_mosaic = None
         try:
@@ -60,16 +101,43 @@ class SentinelDownloader:
                 daterange=daterange,
                 bounds=bounds,
                 max_cloudcover=self.max_cloudcover,
+                items=items,
+                chunksize=self.mosaic_writer.chunk_size,
+                composite_mode=self.composite_mode,
             )
-            rgb_mosaic = (
-                ms.true_color(*mosaic, nodata=0)
-                .isel(band=[0, 1, 2])
-                .transpose("band", ...)
-            )
-            rgb_mosaic.attrs = mosaic.attrs.copy()
+            rgb_mosaic = self._to_rgb(mosaic)
         except Exception as e:
             self.logger.error(
                 f"Failed to create mosaic for {bounds} ({daterange}): {e}"
             )
 
         return rgb_mosaic
+
+    def _get_rgb_mosaics_by_season(
+        self,
+        bounds: Iterable[float],
+        daterange: str,
+        seasons: Iterable[Tuple[int, Season]],
+        items: Optional[pystac.ItemCollection] = None,
+    ) -> Dict[Tuple[int, Season], xr.DataArray]:
+        """
+        Retrieves Sentinel-2 RGB mosaics for several (year, season)s within `daterange` from
+        a single search and stack, by splitting the items into seasons by their datetime.
+        Seasons without any items are left out of the returned mosaics.
+        """
+        seasons = set(seasons)
+
+        def _group_fn(item: pystac.Item) -> Optional[Tuple[int, Season]]:
+            year_season = self._get_year_season(item.datetime)
+            return year_season if year_season in seasons else None
+
+        mosaics = self.downloader.stack_and_mosaic_groups(
+            daterange=daterange,
+            bounds=bounds,
+            group_fn=_group_fn,
+            max_cloudcover=self.max_cloudcover,
+            items=items,
+            chunksize=self.mosaic_writer.chunk_size,
+            composite_mode=self.composite_mode,
+        )
+        return {year_season: self._to_rgb(mosaic) for year_season, mosaic in mosaics.items()}
@@ -0,0 +1,150 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+import pystac
+
+from sample.stac_search import StacSearchQuery
+from sample.utils import json_sha256
+
+DEFAULT_TTL_SECONDS = 30 * 24 * 60 * 60
+DEFAULT_MAX_SIZE_BYTES = 512 * 2**20
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS searches (
+    key TEXT PRIMARY KEY,
+    max_cloudcover REAL NOT NULL,
+    items TEXT NOT NULL,
+    nbytes INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+)
+"""
+
+
+def _cloud_cover(item: Dict) -> float:
+    return item.get("properties", {}).get("eo:cloud_cover", float("inf"))
+
+
+class StacSearchCache:
+    """
+    Persistent SQLite cache of STAC item search results.
+
+    Searches are keyed by collection, bounding box and date range, but not by cloud cover
+    limit. Each entry records the limit it was searched with, so a search with a lower (or
+    equal) limit is answered by filtering the cached items on `eo:cloud_cover`, while a
+    search with a higher limit is a miss and replaces the entry.
+
+    Entries expire `ttl_seconds` after they were searched, and the least recently used ones
+    are evicted once the cached items total more than `max_size_bytes`. Hit and miss counts
+    are kept for the lifetime of the cache object.
+    """
+
+    def __init__(
+        self,
+        cache_path: Path,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        max_size_bytes: int = DEFAULT_MAX_SIZE_BYTES,
+    ):
+        self.cache_path = cache_path
+        self.ttl_seconds = ttl_seconds
+        self.max_size_bytes = max_size_bytes
+        self.hits = 0
+        self.misses = 0
+
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # Searches run on a thread pool, so share one connection behind a lock
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(cache_path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(SCHEMA)
+
+    def __getstate__(self):
+        raise TypeError(f"{self.__class__.__name__} holds an open database connection and can't be pickled")
+
+    @staticmethod
+    def key(collection: str, query: StacSearchQuery) -> str:
+        return json_sha256(
+            {
+                "collection": collection,
+                "bbox": [round(float(coord), 9) for coord in query.bounds],
+                "datetime": query.daterange,
+            }
+        )
+
+    def get(self, collection: str, query: StacSearchQuery) -> Optional[pystac.ItemCollection]:
+        """
+        Returns the cached items matching `query`, or None if they aren't cached.
+        """
+        key = self.key(collection, query)
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT max_cloudcover, items, created_at FROM searches WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[2] > self.ttl_seconds:
+                self._connection.execute("DELETE FROM searches WHERE key = ?", (key,))
+                row = None
+            if row is None or row[0] < query.max_cloudcover:
+                self.misses += 1
+                return None
+            self._connection.execute("UPDATE searches SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+
+        features = [item for item in json.loads(row[1]) if _cloud_cover(item) <= query.max_cloudcover]
+        return pystac.ItemCollection.from_dict({"type": "FeatureCollection", "features": features})
+
+    def put(self, collection: str, query: StacSearchQuery, items: pystac.ItemCollection):
+        """
+        Caches the items found for `query`, unless a broader search is already cached.
+        """
+        key = self.key(collection, query)
+        items_json = json.dumps([item.to_dict(transform_hrefs=False) for item in items])
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                """
+                INSERT INTO searches VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    max_cloudcover = excluded.max_cloudcover,
+                    items = excluded.items,
+                    nbytes = excluded.nbytes,
+                    created_at = excluded.created_at,
+                    accessed_at = excluded.accessed_at
+                WHERE excluded.max_cloudcover >= searches.max_cloudcover OR searches.created_at < ?
+                """,
+                (key, query.max_cloudcover, items_json, len(items_json), now, now, now - self.ttl_seconds),
+            )
+            self._evict()
+
+    def _evict(self):
+        total_nbytes = self._connection.execute("SELECT COALESCE(SUM(nbytes), 0) FROM searches").fetchone()[0]
+        if total_nbytes <= self.max_size_bytes:
+            return
+
+        evicted_keys = []
+        for key, nbytes in self._connection.execute("SELECT key, nbytes FROM searches ORDER BY accessed_at"):
+            if total_nbytes <= self.max_size_bytes:
+                break
+            evicted_keys.append((key,))
+            total_nbytes -= nbytes
+        self._connection.executemany("DELETE FROM searches WHERE key = ?", evicted_keys)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM searches").fetchone()[0]
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups > 0 else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
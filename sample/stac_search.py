@@ -0,0 +1,126 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, Iterable, List, NamedTuple, Optional, Sequence, Union
+
+import pystac
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+if TYPE_CHECKING:
+    from sample.stac_cache import StacSearchCache
+
+
+class StacSearchQuery(NamedTuple):
+    """
+    A STAC item search for a bounding box ([lon1, lat1, lon2, lat2]) and date range
+    ("YYYY-MM-DD/YYYY-MM-DD"), limited to items with at most `max_cloudcover` percent cloud cover.
+    """
+
+    bounds: Sequence[float]
+    daterange: str
+    max_cloudcover: int = 10
+
+
+class StacSearchClient:
+    """
+    Minimal client for a STAC API's item search endpoint. All requests go through a single
+    pooled requests.Session, which retries failed requests (connection errors, 429 and 5xx
+    responses) with exponential backoff.
+
+    Batches of searches are run concurrently, with at most `max_concurrency` in flight. Items
+    are sorted by ascending cloud cover, and results are paged through until exhausted.
+
+    If a `cache` is given, it is consulted before searching, and search results are added to it.
+    """
+
+    def __init__(
+        self,
+        stac_catalog_url: str = "https://earth-search.aws.element84.com/v1",
+        collection: str = "sentinel-2-l2a",
+        max_concurrency: int = 8,
+        max_retries: int = 3,
+        backoff_factor: float = 0.5,
+        page_limit: int = 100,
+        timeout: float = 60,
+        cache: Optional["StacSearchCache"] = None,
+    ):
+        self.stac_catalog_url = stac_catalog_url.rstrip("/")
+        self.collection = collection
+        self.max_concurrency = max_concurrency
+        self.page_limit = page_limit
+        self.timeout = timeout
+        self.cache = cache
+
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET", "POST"],
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _search_body(self, query: StacSearchQuery) -> Dict:
+        return {
+            "collections": [self.collection],
+            "bbox": list(query.bounds),
+            "datetime": query.daterange,
+            "limit": self.page_limit,
+            "query": {"eo:cloud_cover": {"lte": query.max_cloudcover}},
+            "sortby": [{"field": "properties.eo:cloud_cover", "direction": "asc"}],
+        }
+
+    def _request_page(self, method: str, url: str, body: Optional[Dict]) -> Dict:
+        if method == "POST":
+            response = self.session.post(url, json=body, timeout=self.timeout)
+        else:
+            response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def search(self, query: StacSearchQuery) -> pystac.ItemCollection:
+        """
+        Runs a single search, following "next" links until all matching items are retrieved.
+        """
+        if self.cache is not None:
+            items = self.cache.get(self.collection, query)
+            if items is not None:
+                return items
+
+        method, url, body = "POST", f"{self.stac_catalog_url}/search", self._search_body(query)
+        features = []
+        while url is not None:
+            page = self._request_page(method, url, body)
+            features.extend(page.get("features", []))
+
+            next_link = next((link for link in page.get("links", []) if link.get("rel") == "next"), None)
+            if next_link is None:
+                url = None
+            else:
+                method = next_link.get("method", "GET").upper()
+                url = next_link["href"]
+                if method == "POST":
+                    link_body = next_link.get("body", {})
+                    body = {**body, **link_body} if next_link.get("merge", False) else link_body
+
+        items = pystac.ItemCollection.from_dict({"type": "FeatureCollection", "features": features})
+        if self.cache is not None:
+            self.cache.put(self.collection, query, items)
+        return items
+
+    def search_batch(self, queries: Iterable[StacSearchQuery]) -> List[Union[pystac.ItemCollection, Exception]]:
+        """
+        Runs many searches concurrently. Results are returned in the order of `queries`; a
+        search that failed (after retries) returns its exception instead of items.
+        """
+
+        def _search_or_exception(query: StacSearchQuery):
+            try:
+                return self.search(query)
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            return list(executor.map(_search_or_exception, queries))
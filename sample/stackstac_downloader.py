@@ -1,6 +1,21 @@
-import pystac_client
+import multiprocessing
+from pathlib import Path
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Union
+
+import pystac
 import stackstac
 import numpy as np
+import xarray
+
+from sample import instrumentation
+from sample.compositing import CompositeMode, composite_stack
+from sample.stac_cache import DEFAULT_TTL_SECONDS, StacSearchCache
+from sample.stac_search import StacSearchClient, StacSearchQuery
+from sample.tile_cache import DEFAULT_MAX_SIZE_BYTES as DEFAULT_TILE_CACHE_MAX_BYTES, TileCacheProxy
+from sample.utils import get_simple_logger
+
+# Sentinel-2 scene classification band, used to mask cloudy pixels when compositing
+SCL_ASSET = "scl"
 
 
 class StackStacDownloader:
@@ -11,14 +26,118 @@ class StackStacDownloader:
     This has not been tested extensively with STAC catalogs other than the
     Sentinel-2 catalog on AWS, and is heavily geared towards creating low-cloud
     visual RGB mosaics.
+
+    If `cache_path` is given, search results are cached there (see StacSearchCache), so
+    repeated searches over the same bounds and date ranges don't hit the network.
+
+    If `tile_cache_dir` is given, asset reads go through a local caching proxy (see
+    TileCacheProxy), so COG blocks that were already read (e.g. by an overlapping city, or a
+    previous run) aren't downloaded again. The proxy runs until `stop_tile_cache_proxy` or
+    `close` is called, or the downloader's context exits.
     """
 
     def __init__(
         self,
         stac_catalog_url="https://earth-search.aws.element84.com/v1",
+        max_concurrency=8,
+        cache_path: Optional[Path] = None,
+        cache_ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        tile_cache_dir: Optional[Path] = None,
+        tile_cache_max_bytes: int = DEFAULT_TILE_CACHE_MAX_BYTES,
     ):
         self.stac_catalog_url = stac_catalog_url
-        self.api = None
+        self.max_concurrency = max_concurrency
+        self.cache_path = cache_path
+        self.cache_ttl_seconds = cache_ttl_seconds
+        self.tile_cache_dir = tile_cache_dir
+        self.tile_cache_max_bytes = tile_cache_max_bytes
+        self.search_client = None
+        self.tile_cache_proxy = None
+        self.logger = get_simple_logger(self.__class__.__name__)
+
+    def _get_search_client(self) -> StacSearchClient:
+        # Created lazily, so the downloader stays cheap to pickle into pool workers
+        if self.search_client is None:
+            cache = None
+            if self.cache_path is not None:
+                cache = StacSearchCache(self.cache_path, ttl_seconds=self.cache_ttl_seconds)
+            self.search_client = StacSearchClient(
+                self.stac_catalog_url, max_concurrency=self.max_concurrency, cache=cache
+            )
+        return self.search_client
+
+    def cache_stats(self) -> Optional[Dict[str, float]]:
+        """
+        Search cache hit/miss counts for this process, or None if caching is disabled.
+        """
+        if self.search_client is None or self.search_client.cache is None:
+            return None
+        return self.search_client.cache.stats()
+
+    def start_tile_cache_proxy(self) -> Optional[TileCacheProxy]:
+        """
+        Starts the tile cache proxy, if tile caching is enabled and it isn't running yet.
+        This is done lazily on the first stack, but a process pool's workers can't start
+        processes, so pools should start it first to share it with all their workers.
+        """
+        if self.tile_cache_proxy is None and self.tile_cache_dir is not None:
+            if multiprocessing.current_process().daemon:
+                self.logger.warning("Can't start the tile cache proxy in a daemon process, reading tiles directly")
+                self.tile_cache_dir = None
+                return None
+            self.tile_cache_proxy = TileCacheProxy(
+                self.tile_cache_dir, max_size_bytes=self.tile_cache_max_bytes
+            ).start()
+        return self.tile_cache_proxy
+
+    def stop_tile_cache_proxy(self):
+        """
+        Stops the tile cache proxy, if this process started it. It is started again on the
+        next stack.
+        """
+        if self.tile_cache_proxy is not None:
+            self.tile_cache_proxy.stop()
+            self.tile_cache_proxy = None
+
+    def close(self):
+        self.stop_tile_cache_proxy()
+        if self.search_client is not None and self.search_client.cache is not None:
+            self.search_client.cache.close()
+        self.search_client = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def tile_cache_stats(self) -> Optional[Dict[str, float]]:
+        """
+        Tile cache hit ratio and bytes fetched/saved of all reads through the proxy, or None
+        if tile caching is disabled.
+        """
+        if self.tile_cache_proxy is None:
+            return None
+        return self.tile_cache_proxy.stats()
+
+    def _proxy_asset_hrefs(self, items: pystac.ItemCollection, assets) -> pystac.ItemCollection:
+        tile_cache_proxy = self.start_tile_cache_proxy()
+        if tile_cache_proxy is None:
+            return items
+
+        proxied_items = []
+        for item in items:
+            item = item.clone()
+            for asset_key in assets:
+                if asset_key in item.assets:
+                    item.assets[asset_key].href = tile_cache_proxy.proxy_url(item.assets[asset_key].href)
+            proxied_items.append(item)
+        return pystac.ItemCollection(proxied_items)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["search_client"] = None
+        return state
 
     def standardize_bounds(self, bounds):
         # Bounds are [lon1, lat1, lon2, lat2]
@@ -28,6 +147,53 @@ class StackStacDownloader:
         bounds = bounds - latlon_offsets
         return bounds.tolist()
 
+    def search(self, daterange, bounds, max_cloudcover=10) -> pystac.ItemCollection:
+        """
+        Search for Sentinel-2 L2A items within the bounds and date range, sorted by
+        ascending cloud cover.
+        """
+        # Bounds should be standardized to (-180,180), (-90, 90)
+        bounds = self.standardize_bounds(bounds)
+        with instrumentation.span("stac_search"):
+            return self._get_search_client().search(StacSearchQuery(bounds, daterange, max_cloudcover))
+
+    def search_batch(
+        self, queries: Iterable[StacSearchQuery]
+    ) -> List[Union[pystac.ItemCollection, Exception]]:
+        """
+        Run many searches concurrently over a shared HTTP session. See StacSearchClient.search_batch.
+        """
+        queries = [query._replace(bounds=self.standardize_bounds(query.bounds)) for query in queries]
+        with instrumentation.span("stac_search_batch"):
+            return self._get_search_client().search_batch(queries)
+
+    def _stack(
+        self,
+        items: pystac.ItemCollection,
+        bounds,
+        assets,
+        epsg,
+        chunksize,
+        composite_mode: CompositeMode,
+        resolution,
+    ):
+        stack_assets = list(assets)
+        if composite_mode != CompositeMode.First and SCL_ASSET not in stack_assets:
+            stack_assets.append(SCL_ASSET)
+
+        with instrumentation.span("stack"):
+            return stackstac.stack(
+                self._proxy_asset_hrefs(items, stack_assets),
+                assets=stack_assets,
+                epsg=epsg,
+                resolution=resolution,
+                bounds_latlon=bounds,
+                sortby_date=False,
+                chunksize=chunksize,
+            ).where(
+                lambda x: x > 0, other=np.nan
+            )  # sentinel-2 uses 0 as nodata
+
     def stack_and_mosaic(
         self,
         daterange,
@@ -35,35 +201,78 @@ class StackStacDownloader:
         max_cloudcover=10,
         assets=["red", "green", "blue"],
         epsg=4326,
+        items: Optional[pystac.ItemCollection] = None,
+        chunksize=1024,
+        composite_mode: CompositeMode = CompositeMode.First,
+        resolution=None,
     ):
+        """
+        Stack and mosaic the items matching the date range, bounds and cloud cover limit. If
+        `items` were already retrieved (e.g. with search_batch), the search is skipped.
+
+        The mosaic is lazy, and split into `chunksize` x `chunksize` pixel Dask chunks. Pixels
+        are composited according to `composite_mode` (see composite_stack), which for the
+        best-pixel and median modes also stacks the SCL band to mask out cloudy pixels.
+        """
         # Bounds should be standardized to (-180,180), (-90, 90)
         bounds = self.standardize_bounds(bounds)
 
-        if self.api is None:
-            self.api = pystac_client.Client.open(self.stac_catalog_url)
+        if items is None:
+            items = self.search(daterange, bounds, max_cloudcover=max_cloudcover)
 
-        s2_search = self.api.search(
-            datetime=daterange,
-            bbox=bounds,
-            limit=100,
-            collections=["sentinel-2-l2a"],
-            query=[f"eo:cloud_cover<={max_cloudcover}"],
-            sortby=["+properties.eo:cloud_cover"],
-        )
-
-        if s2_search.matched() == 0:
+        if len(items) == 0:
             raise RuntimeError("Failed to find any images for specified date range and geographic bounds.")
 
-        items = s2_search.item_collection()
-
-        rgb_stack = stackstac.stack(items, assets=assets, epsg=epsg, bounds_latlon=bounds, sortby_date=False).where(
-            lambda x: x > 0, other=np.nan
-        )  # sentinel-2 uses 0 as nodata
+        rgb_stack = self._stack(items, bounds, assets, epsg, chunksize, composite_mode, resolution)
 
         if len(rgb_stack) > 0:
-            mosaic = stackstac.mosaic(
-                rgb_stack, reverse=False
-            )  # mosaic starting at the front of the stack (lowest cloud cover values)
-            return mosaic
+            # mosaic starting at the front of the stack (lowest cloud cover values)
+            return composite_stack(rgb_stack, mode=composite_mode, bands=assets, scl_band=SCL_ASSET)
         else:
             raise RuntimeError("Failed to find any matching STAC items.")
+
+    def stack_and_mosaic_groups(
+        self,
+        daterange,
+        bounds,
+        group_fn: Callable[[pystac.Item], Optional[Hashable]],
+        max_cloudcover=10,
+        assets=["red", "green", "blue"],
+        epsg=4326,
+        items: Optional[pystac.ItemCollection] = None,
+        chunksize=1024,
+        composite_mode: CompositeMode = CompositeMode.First,
+        resolution=None,
+    ) -> Dict[Hashable, xarray.DataArray]:
+        """
+        Like stack_and_mosaic, but mosaics groups of items separately, e.g. the seasons of
+        a multi-year date range. Items are grouped by `group_fn`, and items it returns None
+        for are left out.
+
+        All items are searched for and stacked once, on a single grid covering `bounds`,
+        and each group's mosaic is composited from its own time steps of that stack.
+        Groups without any items are left out of the returned mosaics.
+        """
+        # Bounds should be standardized to (-180,180), (-90, 90)
+        bounds = self.standardize_bounds(bounds)
+
+        if items is None:
+            items = self.search(daterange, bounds, max_cloudcover=max_cloudcover)
+
+        # Keep the (cloud cover) order of items within each group
+        group_keys = [group_fn(item) for item in items]
+        grouped_items = [item for item, key in zip(items, group_keys) if key is not None]
+        if len(grouped_items) == 0:
+            raise RuntimeError("Failed to find any images for specified date range and geographic bounds.")
+
+        time_indices = {}
+        for time_index, key in enumerate(key for key in group_keys if key is not None):
+            time_indices.setdefault(key, []).append(time_index)
+
+        stack = self._stack(
+            pystac.ItemCollection(grouped_items), bounds, assets, epsg, chunksize, composite_mode, resolution
+        )
+        return {
+            key: composite_stack(stack.isel(time=indices), mode=composite_mode, bands=assets, scl_band=SCL_ASSET)
+            for key, indices in time_indices.items()
+        }
@@ -0,0 +1,417 @@
+import hashlib
+import json
+import multiprocessing
+import re
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote, unquote
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from sample.utils import atomic_write_path, get_simple_logger
+
+DEFAULT_BLOCK_SIZE = 256 * 2**10
+DEFAULT_MAX_SIZE_BYTES = 10 * 2**30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blocks (
+    key TEXT PRIMARY KEY,
+    nbytes INTEGER NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    url TEXT PRIMARY KEY,
+    size INTEGER NOT NULL
+);
+"""
+
+RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)$")
+CONTENT_RANGE_PATTERN = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)$")
+
+
+class TileCache:
+    """
+    Read-through disk cache of byte ranges of remote files (e.g. Sentinel-2 COGs), which
+    are assumed never to change.
+
+    Files are split into aligned blocks of `block_size` bytes. Reads are served from
+    cached blocks where possible, and consecutive missing blocks are fetched with a
+    single HTTP range request and cached. Blocks are stored as files under `cache_dir`,
+    with an SQLite index shared by all processes using the same directory. The least
+    recently used blocks are evicted once they total more than `max_size_bytes`.
+
+    Block hits and misses, bytes fetched and bytes saved (i.e. served from cached blocks
+    instead of fetched) are counted for the lifetime of the cache object.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path,
+        max_size_bytes: int = DEFAULT_MAX_SIZE_BYTES,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+        max_retries: int = 3,
+        backoff_factor: float = 0.5,
+        timeout: float = 60,
+    ):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.block_size = block_size
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.bytes_fetched = 0
+        self.bytes_saved = 0
+
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            cache_dir / "index.sqlite", check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET", "HEAD"],
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=32, max_retries=retry))
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=32, max_retries=retry))
+
+    def _block_key(self, url: str, block_index: int) -> str:
+        return hashlib.sha256(f"{url}\n{self.block_size}\n{block_index}".encode()).hexdigest()
+
+    def _block_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / key
+
+    def file_size(self, url: str) -> int:
+        with self._lock:
+            row = self._connection.execute("SELECT size FROM files WHERE url = ?", (url,)).fetchone()
+        if row is not None:
+            return row[0]
+
+        response = self.session.head(url, timeout=self.timeout, allow_redirects=True)
+        response.raise_for_status()
+        size = int(response.headers["Content-Length"])
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?)", (url, size))
+        return size
+
+    def _get_cached_block(self, key: str) -> Optional[bytes]:
+        try:
+            data = self._block_path(key).read_bytes()
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self._connection.execute("UPDATE blocks SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        return data
+
+    def _put_block(self, key: str, data: bytes):
+        block_path = self._block_path(key)
+        block_path.parent.mkdir(exist_ok=True)
+        with atomic_write_path(block_path) as tmp_path:
+            tmp_path.write_bytes(data)
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO blocks VALUES (?, ?, ?)", (key, len(data), time.time()))
+            self._evict()
+
+    def _evict(self):
+        total_nbytes = self._connection.execute("SELECT COALESCE(SUM(nbytes), 0) FROM blocks").fetchone()[0]
+        if total_nbytes <= self.max_size_bytes:
+            return
+
+        evicted_keys = []
+        for key, nbytes in self._connection.execute("SELECT key, nbytes FROM blocks ORDER BY accessed_at"):
+            if total_nbytes <= self.max_size_bytes:
+                break
+            evicted_keys.append(key)
+            total_nbytes -= nbytes
+        self._connection.executemany("DELETE FROM blocks WHERE key = ?", [(key,) for key in evicted_keys])
+        for key in evicted_keys:
+            self._block_path(key).unlink(missing_ok=True)
+
+    def _fetch(self, url: str, start: int, stop: int) -> bytes:
+        """
+        Fetches bytes [start, stop) of the file at `url`, raising if the response doesn't
+        hold exactly that range (e.g. a truncated body), so it's never cached.
+        """
+        response = self.session.get(url, headers={"Range": f"bytes={start}-{stop - 1}"}, timeout=self.timeout)
+        response.raise_for_status()
+        data = response.content
+        if response.status_code == 206:
+            match = CONTENT_RANGE_PATTERN.match(response.headers.get("Content-Range", ""))
+            if match is None or (int(match.group(1)), int(match.group(2)) + 1) != (start, stop):
+                raise RuntimeError(
+                    f"Expected bytes {start}-{stop - 1} of {url}, got Content-Range "
+                    f"{response.headers.get('Content-Range')!r}"
+                )
+        else:
+            # The server ignored the range and sent the whole file
+            data = data[start:stop]
+        if len(data) != stop - start:
+            raise RuntimeError(f"Expected {stop - start} bytes of {url} from offset {start}, got {len(data)}")
+        with self._lock:
+            self.bytes_fetched += len(data)
+        return data
+
+    def _fetch_blocks(self, url: str, block_indices: List[int], size: int) -> Dict[int, bytes]:
+        start = block_indices[0] * self.block_size
+        stop = min((block_indices[-1] + 1) * self.block_size, size)
+        data = self._fetch(url, start, stop)
+
+        blocks = {}
+        for block_index in block_indices:
+            offset = block_index * self.block_size - start
+            blocks[block_index] = data[offset : offset + self.block_size]
+            self._put_block(self._block_key(url, block_index), blocks[block_index])
+        return blocks
+
+    def read(self, url: str, start: int, stop: int) -> bytes:
+        """
+        Returns bytes [start, stop) of the file at `url`, clamped to the file size.
+        """
+        stop = min(stop, self.file_size(url))
+        if start >= stop:
+            return b""
+
+        first_block, last_block = start // self.block_size, (stop - 1) // self.block_size
+        blocks = {}
+        missing_runs: List[List[int]] = []
+        for block_index in range(first_block, last_block + 1):
+            data = self._get_cached_block(self._block_key(url, block_index))
+            if data is not None:
+                blocks[block_index] = data
+                with self._lock:
+                    self.hits += 1
+                    self.bytes_saved += len(data)
+            else:
+                with self._lock:
+                    self.misses += 1
+                if len(missing_runs) > 0 and missing_runs[-1][-1] == block_index - 1:
+                    missing_runs[-1].append(block_index)
+                else:
+                    missing_runs.append([block_index])
+
+        for missing_run in missing_runs:
+            blocks.update(self._fetch_blocks(url, missing_run, self.file_size(url)))
+
+        data = b"".join(blocks[block_index] for block_index in range(first_block, last_block + 1))
+        offset = start - first_block * self.block_size
+        return data[offset : offset + stop - start]
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups > 0 else 0.0,
+            "bytes_fetched": self.bytes_fetched,
+            "bytes_saved": self.bytes_saved,
+        }
+
+    def close(self):
+        self.session.close()
+        with self._lock:
+            self._connection.close()
+
+
+def stats_difference(stats: Dict[str, float], start_stats: Dict[str, float]) -> Dict[str, float]:
+    """
+    Cache statistics (see TileCache.stats) of the reads between two snapshots of them.
+    """
+    difference = {key: stats[key] - start_stats[key] for key in ("hits", "misses", "bytes_fetched", "bytes_saved")}
+    lookups = difference["hits"] + difference["misses"]
+    difference["hit_ratio"] = difference["hits"] / lookups if lookups > 0 else 0.0
+    return difference
+
+
+def _parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Returns the [start, stop) byte range of a single-range HTTP Range header, or None for
+    the whole file.
+    """
+    match = RANGE_PATTERN.match(range_header or "")
+    if match is None:
+        return None
+    first, last = match.groups()
+    if first == "":
+        # Suffix range of the last bytes
+        return max(size - int(last), 0), size
+    return int(first), size if last == "" else min(int(last) + 1, size)
+
+
+STATS_PATH = "/_stats"
+
+
+def _tile_cache_handler_class(tile_cache: TileCache):
+    logger = get_simple_logger(TileCacheProxy.__name__)
+
+    class _TileCacheHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _url(self) -> Optional[str]:
+            url = unquote(self.path.lstrip("/"))
+            return url if url.startswith(("http://", "https://")) else None
+
+        def _send_empty_response(self, status: int, headers: Optional[Dict[str, str]] = None):
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def do_HEAD(self):
+            url = self._url()
+            if url is None:
+                self._send_empty_response(404)
+                return
+            try:
+                size = tile_cache.file_size(url)
+            except Exception as e:
+                logger.error(f"Failed to get size of {url}: {e}")
+                self._send_empty_response(502)
+                return
+            self.send_response(200)
+            self.send_header("Content-Length", str(size))
+            self.send_header("Accept-Ranges", "bytes")
+            self.end_headers()
+
+        def do_GET(self):
+            if self.path == STATS_PATH:
+                data, status, headers = json.dumps(tile_cache.stats()).encode(), 200, {}
+            elif self._url() is None:
+                # e.g. GDAL listing the "directory" of a file
+                self._send_empty_response(404)
+                return
+            else:
+                url = self._url()
+                try:
+                    size = tile_cache.file_size(url)
+                    byte_range = _parse_range(self.headers.get("Range"), size)
+                    start, stop = byte_range if byte_range is not None else (0, size)
+                    if start >= size:
+                        self._send_empty_response(416, {"Content-Range": f"bytes */{size}"})
+                        return
+                    data = tile_cache.read(url, start, stop)
+                except Exception as e:
+                    logger.error(f"Failed to read {url}: {e}")
+                    self._send_empty_response(502)
+                    return
+
+                status, headers = 200, {"Accept-Ranges": "bytes"}
+                if byte_range is not None:
+                    status = 206
+                    headers["Content-Range"] = f"bytes {start}-{start + len(data) - 1}/{size}"
+
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return _TileCacheHandler
+
+
+def _serve_tile_cache(cache_dir: Path, max_size_bytes: int, block_size: int, host: str, connection):
+    tile_cache = TileCache(cache_dir, max_size_bytes=max_size_bytes, block_size=block_size)
+    server = ThreadingHTTPServer((host, 0), _tile_cache_handler_class(tile_cache))
+    server.daemon_threads = True
+    connection.send(server.server_port)
+    server.serve_forever()
+
+
+class TileCacheProxy:
+    """
+    Local HTTP server that serves remote files through a TileCache, so GDAL (and therefore
+    stackstac) reads can be cached by pointing them at `proxy_url(url)` instead of `url`.
+    Supports HEAD and single-range GET requests, which is all GDAL's /vsicurl/ needs.
+
+    The server runs in its own process: GDAL can hold the GIL while it waits for a
+    response, which would deadlock a server thread in the same process. A started proxy
+    can be pickled into other processes (e.g. pool workers), which then share it, and its
+    cache statistics, with the process that started it.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path,
+        max_size_bytes: int = DEFAULT_MAX_SIZE_BYTES,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+        host: str = "127.0.0.1",
+        start_timeout: float = 60,
+    ):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.block_size = block_size
+        self.host = host
+        self.start_timeout = start_timeout
+        self.port = None
+        self.process = None
+
+    def __getstate__(self):
+        # Only the process that started the proxy can stop it
+        state = self.__dict__.copy()
+        state["process"] = None
+        return state
+
+    def start(self) -> "TileCacheProxy":
+        if self.port is None:
+            context = multiprocessing.get_context("spawn")
+            parent_connection, child_connection = context.Pipe(duplex=False)
+            self.process = context.Process(
+                target=_serve_tile_cache,
+                args=(self.cache_dir, self.max_size_bytes, self.block_size, self.host, child_connection),
+                daemon=True,
+            )
+            self.process.start()
+            if not parent_connection.poll(self.start_timeout):
+                self.process.terminate()
+                raise RuntimeError("Tile cache proxy failed to start")
+            self.port = parent_connection.recv()
+        return self
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+            self.process = None
+            self.port = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def proxy_url(self, url: str) -> str:
+        """
+        The URL to read `url` through the cache from. Only http(s) URLs are proxied.
+        """
+        if self.port is None:
+            raise RuntimeError("Proxy is not running")
+        if not url.startswith(("http://", "https://")):
+            return url
+        # The quoted URL keeps the file extension at the end of the path, which GDAL uses to pick a driver
+        return f"http://{self.host}:{self.port}/{quote(url, safe='')}"
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Cache statistics (see TileCache.stats) of all reads through the proxy.
+        """
+        if self.port is None:
+            raise RuntimeError("Proxy is not running")
+        response = requests.get(f"http://{self.host}:{self.port}{STATS_PATH}", timeout=10)
+        response.raise_for_status()
+        return response.json()
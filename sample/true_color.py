@@ -0,0 +1,81 @@
+from enum import Enum, auto
+from typing import Sequence, Tuple
+
+import dask.array as da
+import numpy as np
+import xarray as xr
+
+# Maps surface reflectance (as scaled by stackstac) of 0-0.3 to the full uint8 range
+DEFAULT_GAIN = 255 / 0.3
+NODATA = 0
+
+
+class StretchMode(Enum):
+    Gain = auto()
+    Percentile = auto()
+
+    def __str__(self):
+        return self.name.lower()
+
+
+def _stretch_block(block: np.ndarray, low: np.ndarray, scale: np.ndarray, block_info=None) -> np.ndarray:
+    # The stretch parameters of the bands in this block
+    band_start, band_stop = block_info[0]["array-location"][0]
+    low = low[band_start:band_stop]
+    scale = scale[band_start:band_stop]
+
+    # One float32 temporary per block, scaled in place
+    stretched = np.subtract(block, low, dtype=np.float32)
+    stretched *= scale
+    stretched += 1
+    np.nan_to_num(stretched, copy=False, nan=NODATA)
+    np.clip(stretched, 1, 255, out=stretched)
+
+    out = stretched.astype(np.uint8)
+    # Zero and negative reflectances are nodata, like NaN
+    out[~(block > 0)] = NODATA
+    return out
+
+
+def _band_percentiles(data: da.Array, percentiles: Tuple[float, float], sample_step: int) -> np.ndarray:
+    sample = data[:, ::sample_step, ::sample_step].compute()
+    sample = np.where(sample > 0, sample, np.nan).reshape(sample.shape[0], -1)
+    if np.isnan(sample).all():
+        return np.zeros((2, data.shape[0]))
+    return np.nanpercentile(sample, percentiles, axis=1)
+
+
+def stretch_to_uint8(
+    mosaic: xr.DataArray,
+    mode: StretchMode = StretchMode.Gain,
+    gain: float = DEFAULT_GAIN,
+    percentiles: Sequence[float] = (2, 98),
+    sample_step: int = 8,
+) -> xr.DataArray:
+    """
+    Stretches a (band, y, x) reflectance mosaic to uint8, chunk by chunk. Valid pixels are
+    mapped to 1-255, and NaN and non-positive pixels to 0 (nodata).
+
+    * Gain: values are multiplied by a fixed `gain`, so the mosaic is only computed once.
+    * Percentile: each band's low and high `percentiles` (of every `sample_step`th pixel
+      in each direction) are stretched to 1 and 255. The percentiles have to be computed
+      first, so unless the mosaic is persisted, it is computed twice.
+    """
+    data = mosaic.data if isinstance(mosaic.data, da.Array) else da.from_array(mosaic.data)
+    n_bands = data.shape[0]
+
+    if mode == StretchMode.Gain:
+        low = np.zeros(n_bands)
+        scale = np.full(n_bands, gain * 254 / 255)
+    else:
+        low, high = _band_percentiles(data, tuple(percentiles), sample_step)
+        scale = 254 / np.maximum(high - low, np.finfo(np.float32).eps)
+
+    stretched = da.map_blocks(
+        _stretch_block,
+        data,
+        low=low.astype(np.float32)[:, np.newaxis, np.newaxis],
+        scale=scale.astype(np.float32)[:, np.newaxis, np.newaxis],
+        dtype=np.uint8,
+    )
+    return mosaic.copy(data=stretched)
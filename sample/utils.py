@@ -1,14 +1,95 @@
+import errno
+import hashlib
+import json
 import logging
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
 
 
 def get_simple_logger(
     name=__name__, base_level=logging.DEBUG, console_level=logging.DEBUG
 ):
     logger = logging.getLogger(name)
-    formatter = logging.Formatter("%(asctime)s: (%(name)s) %(levelname)s: %(message)s")
     logger.setLevel(level=base_level)
+    # Loggers are shared by name, so only the first call adds a handler
+    if any(getattr(handler, "_simple_logger_handler", False) for handler in logger.handlers):
+        return logger
+
+    formatter = logging.Formatter("%(asctime)s: (%(name)s) %(levelname)s: %(message)s")
     console_handler = logging.StreamHandler()
+    console_handler._simple_logger_handler = True
     console_handler.setLevel(level=console_level)
     console_handler.setFormatter(formatter)
     logger.addHandler(console_handler)
     return logger
+
+
+def file_sha256(path: Path, chunk_size: int = 1 << 20) -> str:
+    """
+    Returns the hex SHA-256 digest of a file's contents, read in chunks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def raster_grid_fingerprint(ds) -> str:
+    """
+    Returns a hex digest identifying the grid (CRS, transform and shape) of a rasterio
+    dataset, so datasets on identical grids can be recognized without comparing pixels.
+    """
+    crs_wkt = ds.crs.to_wkt() if ds.crs is not None else ""
+    grid = [crs_wkt, [float(v) for v in tuple(ds.transform)[:6]], ds.width, ds.height]
+    return hashlib.sha256(repr(grid).encode()).hexdigest()
+
+
+def json_sha256(obj) -> str:
+    """
+    Returns the hex SHA-256 digest of a JSON-serializable object, independent of key order.
+    """
+    return hashlib.sha256(json.dumps(obj, sort_keys=True).encode()).hexdigest()
+
+
+@contextmanager
+def atomic_write_path(path: Path):
+    """
+    Context manager yielding a temporary path next to `path` to write to. On success the
+    temporary file is renamed to `path`, so readers never see a partially written file;
+    on failure it is removed.
+    """
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def replace_directory(tmp_path: Path, path: Path):
+    """
+    Moves the completely written directory `tmp_path` to `path`. A directory can't replace a
+    non-empty one in a single rename, so any existing directory is first renamed aside and
+    removed afterwards. If another process moves its own directory to `path` at the same
+    time, the one that got there first is kept (it is complete too), and `tmp_path` is
+    removed.
+    """
+    old_dir = Path(tempfile.mkdtemp(prefix=f".{path.name}.", suffix=".old", dir=path.parent))
+    try:
+        try:
+            os.rename(path, old_dir / path.name)
+        except FileNotFoundError:
+            pass
+        try:
+            os.replace(tmp_path, path)
+        except OSError as e:
+            if e.errno not in (errno.ENOTEMPTY, errno.EEXIST) or not path.is_dir():
+                raise
+            shutil.rmtree(tmp_path)
+    finally:
+        shutil.rmtree(old_dir, ignore_errors=True)
@@ -0,0 +1,92 @@
+import pickle
+
+import numpy as np
+import rasterio
+import rasterio.transform
+
+from sample.chip_exporter import ChipDataset, ChipExporter
+
+
+def _write_tif(path, values, transform):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    profile = dict(
+        driver="GTiff",
+        width=values.shape[2],
+        height=values.shape[1],
+        count=values.shape[0],
+        dtype="uint8",
+        crs="EPSG:32618",
+        transform=transform,
+    )
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(values)
+
+
+def _random_image(rng, height, width):
+    return rng.integers(1, 256, size=(3, height, width), dtype=np.uint8)
+
+
+def test_export_and_read_chips(tmp_path):
+    rng = np.random.default_rng(0)
+    s2_path = tmp_path / "sentinel2_images"
+    osm_path = tmp_path / "osm_images"
+    transform = rasterio.transform.from_origin(500000, 4000000, 10, 10)
+
+    # City 1: road raster per city, the top left chip is nodata
+    city1_summer = _random_image(rng, 40, 50)
+    city1_summer[:, :16, :16] = 0
+    city1_roads = _random_image(rng, 40, 50)
+    _write_tif(s2_path / "1" / "2021" / "summer.tif", city1_summer, transform)
+    _write_tif(osm_path / "1.tif", city1_roads, transform)
+    # On another grid than the road raster, so skipped
+    _write_tif(s2_path / "1" / "2021" / "fall.tif", _random_image(rng, 32, 32), transform)
+
+    # City 2: road rasters per grid
+    city2_spring = _random_image(rng, 32, 32)
+    city2_roads = _random_image(rng, 32, 32)
+    _write_tif(s2_path / "2" / "2020" / "spring.tif", city2_spring, transform)
+    _write_tif(osm_path / "2" / "2020" / "spring.tif", city2_roads, transform)
+
+    store_path = tmp_path / "chips"
+    exporter = ChipExporter(s2_path, osm_path, store_path, chip_size=16, shard_size=2, pool_size=2)
+    exporter.export_all(parallel=True)
+
+    dataset = ChipDataset(store_path)
+    # 2 rows x 3 cols of chips in city 1 (without the nodata one), 2 x 2 in city 2
+    assert len(dataset) == 5 + 4
+    assert dataset.metadata["shards"][0] == ["1/00000.images.npy", "1/00000.roads.npy"]
+
+    expected = {(1, 2021, "summer"): (city1_summer, city1_roads), (2, 2020, "spring"): (city2_spring, city2_roads)}
+    seen = set()
+    for i in range(len(dataset)):
+        entry = dataset.index[i]
+        image, roads = dataset[i]
+        city_image, city_roads = expected[(int(entry["city_id"]), int(entry["year"]), str(entry["season"]))]
+        row, col = int(entry["row"]), int(entry["col"])
+        np.testing.assert_array_equal(image, city_image[:, row : row + 16, col : col + 16])
+        np.testing.assert_array_equal(roads, city_roads[:, row : row + 16, col : col + 16])
+        seen.add((int(entry["city_id"]), row, col))
+    assert (1, 0, 0) not in seen
+
+    # Pickled datasets reopen their shards
+    image, _ = pickle.loads(pickle.dumps(dataset))[len(dataset) - 1]
+    np.testing.assert_array_equal(image, city2_spring[:, 16:, 16:])
+
+    # Exported cities are skipped on the next run
+    shard_mtime = (store_path / "1" / "00000.images.npy").stat().st_mtime_ns
+    exporter.export_all(parallel=False)
+    assert (store_path / "1" / "00000.images.npy").stat().st_mtime_ns == shard_mtime
+    assert len(ChipDataset(store_path)) == 9
+
+    # Cities with new mosaics or regenerated road rasters are exported again
+    _write_tif(s2_path / "2" / "2021" / "spring.tif", city2_spring, transform)
+    _write_tif(osm_path / "2" / "2021" / "spring.tif", city2_roads, transform)
+    exporter.export_all(parallel=False)
+    assert (store_path / "1" / "00000.images.npy").stat().st_mtime_ns == shard_mtime
+    assert len(ChipDataset(store_path)) == 9 + 4
+
+    _write_tif(osm_path / "1.tif", city1_summer, transform)
+    exporter.export_all(parallel=False)
+    assert (store_path / "1" / "00000.images.npy").stat().st_mtime_ns != shard_mtime
+    image, roads = ChipDataset(store_path)[0]
+    np.testing.assert_array_equal(roads, image)
@@ -0,0 +1,78 @@
+import json
+import os
+import pickle
+
+import numpy as np
+import shapely
+from shapely.geometry import box, mapping
+
+from sample import city_catalog
+from sample.city_catalog import City, CityCatalog, city_catalog_cache_path
+from sample.sentinel_cities_downloader import SentinelCitiesDownloader
+
+
+def _write_cities_geojson(path, cities):
+    features = [
+        {"type": "Feature", "properties": {"asset_identifier": city_id, "asset_name": name}, "geometry": mapping(geom)}
+        for city_id, name, geom in cities
+    ]
+    path.write_text(json.dumps({"type": "FeatureCollection", "features": features}))
+
+
+TEST_CITIES = [
+    (1, "San Jose", box(0, 0, 1, 1)),
+    (2, "Santa Fe", box(2, 0, 3, 1)),
+    # L-shaped, so its bounds overlap boxes its geometry doesn't
+    (3, "Austin", shapely.union(box(0, 2, 3, 3), box(2, 2, 3, 5))),
+]
+
+
+def _fail_to_hash(path):
+    raise AssertionError(f"{path} was hashed")
+
+
+def test_catalog_is_cached(tmp_path, monkeypatch):
+    geojson_path = tmp_path / "cities.geojson"
+    _write_cities_geojson(geojson_path, TEST_CITIES)
+
+    catalog = CityCatalog.from_geojson(geojson_path)
+    assert city_catalog_cache_path(geojson_path).exists()
+    assert list(catalog)[0] == City(1, "San Jose", (0.0, 0.0, 1.0, 1.0))
+    assert catalog.crs.to_epsg() == 4326
+
+    cached_catalog = CityCatalog.from_geojson(geojson_path)
+    np.testing.assert_array_equal(cached_catalog.ids, catalog.ids)
+    np.testing.assert_array_equal(cached_catalog.bounds, catalog.bounds)
+    assert shapely.equals(cached_catalog.geometries(), catalog.geometries()).all()
+
+    # Touching the GeoJSON keeps the cache, and records the new mtime so it's only hashed once
+    os.utime(geojson_path, ns=(0, 0))
+    assert len(CityCatalog.from_geojson(geojson_path)) == 3
+    monkeypatch.setattr(city_catalog, "file_sha256", _fail_to_hash)
+    assert len(CityCatalog.from_geojson(geojson_path)) == 3
+    monkeypatch.undo()
+
+    # The cache is rebuilt when the GeoJSON changes
+    _write_cities_geojson(geojson_path, TEST_CITIES[:2])
+    assert len(CityCatalog.from_geojson(geojson_path)) == 2
+
+
+def test_select_cities(tmp_path):
+    geojson_path = tmp_path / "cities.geojson"
+    _write_cities_geojson(geojson_path, TEST_CITIES)
+    catalog = CityCatalog.from_geojson(geojson_path)
+
+    assert catalog.select(ids=[3, 1, 42]).ids.tolist() == [1, 3]
+    assert catalog.select(name_pattern="SAN *").names.tolist() == ["San Jose"]
+    assert catalog.select(name_pattern="san*").ids.tolist() == [1, 2]
+    assert catalog.select(bbox=(0.5, 0.5, 2.5, 2.5)).ids.tolist() == [1, 2, 3]
+    # Within Austin's bounds, but outside its geometry
+    assert catalog.select(bbox=(0.5, 3.5, 1.5, 4.5)).ids.tolist() == []
+    assert catalog.select(ids=[1, 3], bbox=(1.5, 0.5, 2.5, 4)).ids.tolist() == [3]
+    assert len(catalog.select(ids=[])) == 0
+
+
+def test_downloader_does_not_pickle_catalog():
+    downloader = SentinelCitiesDownloader(city_ids=[13], stac_cache_path=None, tile_cache_dir=None)
+    assert downloader.city_catalog.ids.tolist() == [13]
+    assert pickle.loads(pickle.dumps(downloader)).city_catalog is None
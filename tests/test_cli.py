@@ -0,0 +1,54 @@
+import subprocess
+import sys
+
+import numpy as np
+import rasterio
+import rasterio.transform
+import rasterio.warp
+
+from sample.cli import build_parser, main
+from sample.osm_road_generator import OSMRoadGenerator
+
+HEAVY_MODULES = ("numpy", "geopandas", "rasterio", "osmnx", "stackstac", "dask", "xarray", "matplotlib")
+
+
+def test_import_is_lightweight():
+    # In a fresh interpreter, as the test session has already imported everything
+    code = f"import sys, sample.cli; print([m for m in {HEAVY_MODULES!r} if m in sys.modules])"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
+
+
+def test_parse_stage_options():
+    args = build_parser().parse_args(["download", "--cities", "13", "42", "--seasons", "summer", "--workers", "2"])
+    assert args.handler.__name__ == "run_download"
+    assert args.stac_cache is None and args.tile_cache is None
+    assert args.cities == [13, 42] and args.seasons == ["summer"] and args.years == [2021] and args.workers == 2
+
+    args = build_parser().parse_args(["all", "--direct", "--bbox", "-73", "41", "-72", "42"])
+    assert args.direct and args.queue is None and args.seasons == ["spring", "summer", "fall"]
+    assert args.bbox == [-73, 41, -72, 42]
+
+
+def test_roads_for_selected_cities(tmp_path):
+    # Synthetic lat/lon image over downtown Hartford, the only city with a graphml file
+    bounds = rasterio.warp.transform_bounds("EPSG:32618", "EPSG:4326", 690000, 4622000, 696000, 4628000)
+    tif_path = tmp_path / "sentinel2_images" / "13" / "2021" / "summer.tif"
+    tif_path.parent.mkdir(parents=True)
+    with rasterio.open(
+        tif_path,
+        "w",
+        driver="GTiff",
+        width=300,
+        height=300,
+        count=3,
+        dtype="uint8",
+        crs="EPSG:4326",
+        transform=rasterio.transform.from_bounds(*bounds, 300, 300),
+    ) as dst:
+        dst.write(np.zeros((3, 300, 300), dtype=np.uint8))
+
+    osm_dir = tmp_path / "osm_images"
+    main(["roads", "--cities", "13", "--s2-dir", str(tmp_path / "sentinel2_images"), "--osm-dir", str(osm_dir)])
+    assert sorted(path.name for path in osm_dir.glob("*.tif")) == ["13.tif"]
+    assert OSMRoadGenerator(city_ids=[13], root_osm_output_path=osm_dir).city_catalog.ids.tolist() == [13]
@@ -0,0 +1,91 @@
+import dask.array as da
+import numpy as np
+import pytest
+import stackstac
+import xarray as xr
+
+from sample.compositing import CompositeMode, composite_stack
+
+
+def _stack(values, reads=None):
+    """
+    Wraps a (time, band, y, x) array as a stackstac-like stack with one chunk per item and
+    band, recording the (time, band, y, x) offset of every chunk read in `reads`.
+    """
+
+    def _read_chunk(block_info=None):
+        location = block_info[None]["array-location"]
+        if reads is not None:
+            reads.append(tuple(start for start, _ in location))
+        return values[tuple(slice(start, stop) for start, stop in location)]
+
+    data = da.map_blocks(
+        _read_chunk,
+        chunks=((1,) * values.shape[0], (1,) * values.shape[1], (2, 2), (2, 2)),
+        dtype=values.dtype,
+    )
+    return xr.DataArray(
+        data,
+        dims=("time", "band", "y", "x"),
+        coords={"band": ["red", "green", "blue", "scl"], "y": np.arange(4), "x": np.arange(4), "epsg": 32618},
+        attrs={"crs": "epsg:32618"},
+    )
+
+
+def _values():
+    # Item 0 covers the top half of the image, but its top-right chunk is cloudy (SCL 9),
+    # item 1 covers everything and is clear (SCL 4), item 2 has outlying values
+    values = np.full((3, 4, 4, 4), np.nan)
+    values[0, :3, :2] = 10.0
+    values[0, 3, :2] = 4.0
+    values[0, 3, :2, 2:] = 9.0
+    values[1, :3] = 20.0
+    values[1, 3] = 4.0
+    values[2, :3] = 90.0
+    values[2, 3] = 5.0
+    return values
+
+
+def test_first_matches_stackstac_mosaic_and_stops_early():
+    values = _values()
+    reads = []
+    mosaic = composite_stack(_stack(values, reads), mode=CompositeMode.First)
+    # stackstac puts the first item on top with reverse=True
+    expected = stackstac.mosaic(_stack(values).sel(band=["red", "green", "blue"]), reverse=True)
+
+    assert mosaic.dims == ("band", "y", "x")
+    assert mosaic["band"].values.tolist() == ["red", "green", "blue"]
+    assert mosaic.attrs == {"crs": "epsg:32618"}
+    assert int(mosaic["epsg"]) == 32618
+    np.testing.assert_array_equal(mosaic.values, expected.values)
+
+    # The top chunks are filled by item 0, and the bottom ones by item 1
+    assert not any(t == 2 for t, _, _, _ in reads)
+    assert not any(t == 1 and y == 0 for t, _, y, _ in reads)
+    assert not any(band == 3 for _, band, _, _ in reads)
+
+
+def test_best_pixel_skips_cloudy_pixels():
+    values = _values()
+    reads = []
+    mosaic = composite_stack(_stack(values, reads), mode=CompositeMode.BestPixel).values
+
+    assert (mosaic[:, :2, :2] == 10.0).all()
+    assert (mosaic[:, :2, 2:] == 20.0).all()
+    assert (mosaic[:, 2:] == 20.0).all()
+    # Item 0's bands are only read for the top-left chunk, where it has clear pixels
+    assert {(y, x) for t, band, y, x in reads if t == 0 and band != 3} == {(0, 0)}
+    assert not any(t == 2 for t, _, _, _ in reads)
+
+
+def test_median_of_clear_pixels():
+    mosaic = composite_stack(_stack(_values()), mode=CompositeMode.Median).values
+
+    assert (mosaic[:, :2, :2] == 20.0).all()
+    assert (mosaic[:, :2, 2:] == 55.0).all()
+    assert (mosaic[:, 2:] == 55.0).all()
+
+
+def test_best_pixel_requires_scl():
+    with pytest.raises(ValueError):
+        composite_stack(_stack(_values()).sel(band=["red", "green", "blue"]), mode=CompositeMode.BestPixel)
@@ -0,0 +1,60 @@
+import json
+from multiprocessing import Pool
+
+import pytest
+
+from sample import instrumentation
+
+
+@pytest.fixture(autouse=True)
+def _disable_instrumentation():
+    yield
+    instrumentation.disable()
+
+
+def _worker_task(n):
+    with instrumentation.span("task"):
+        instrumentation.count("items", n)
+    instrumentation.flush()
+    return n
+
+
+def test_disabled_instrumentation_records_nothing(tmp_path):
+    assert not instrumentation.is_enabled()
+    with instrumentation.span("stage"):
+        instrumentation.count("bytes_written", 100)
+    instrumentation.flush()
+    assert instrumentation.span("stage") is instrumentation.span("other_stage")
+
+
+def test_report_merges_pool_workers(tmp_path):
+    report_path = tmp_path / "report.json"
+    with instrumentation.profile_run(report_path):
+        instrumentation.count("items", 100)
+        with instrumentation.span("task"):
+            pass
+        with Pool(2) as p:
+            assert sum(p.map(_worker_task, range(1, 5))) == 10
+
+    report = json.loads(report_path.read_text())
+    # Workers forked from the parent don't count its records again
+    assert report["counters"] == {"items": 110}
+    assert report["stages"]["task"]["count"] == 5
+    assert report["stages"]["run"]["count"] == 1
+    assert report["stages"]["task"]["p50_s"] <= report["stages"]["task"]["p99_s"]
+    assert report["peak_rss_bytes"] > 0
+    assert len(report["peak_rss_bytes_by_process"]) >= 2
+    assert not instrumentation.is_enabled()
+
+
+def test_write_report_of_run_dir(tmp_path):
+    instrumentation.enable(tmp_path / "run")
+    for _ in range(3):
+        with instrumentation.span("stage"):
+            pass
+    instrumentation.count("bytes_written", 10)
+    instrumentation.flush()
+
+    report = instrumentation.write_report(tmp_path / "run")
+    assert report["stages"]["stage"]["count"] == 3
+    assert report["counters"]["bytes_written"] == 10
@@ -0,0 +1,88 @@
+import time
+from multiprocessing import Pool
+
+from sample.job_queue import JobQueue, JobState
+
+
+def _jobs(n):
+    return [(f"job/{i}", {"i": i}) for i in range(n)]
+
+
+def _work_helper(db_path):
+    return JobQueue(db_path).work(lambda job: time.sleep(0.001 * job.payload["i"]))
+
+
+def test_jobs_are_claimed_once_and_completed(tmp_path):
+    queue = JobQueue(tmp_path / "queue.sqlite")
+    assert queue.add(_jobs(3)) == 3
+    # Adding the same jobs again doesn't duplicate them
+    assert queue.add(_jobs(3)) == 0
+
+    job = queue.claim("a")
+    assert job.key == "job/0" and job.payload == {"i": 0} and job.attempts == 1
+    assert queue.claim("b").key == "job/1"
+    queue.complete(job, "a")
+    assert queue.counts() == {"pending": 1, "running": 1, "done": 1, "failed": 0}
+
+    # Done jobs that are added again are only run again if asked to
+    assert queue.add(_jobs(1)) == 0
+    assert queue.counts()["done"] == 1
+    assert queue.add(_jobs(1), redo_done=True) == 1
+    assert queue.claim("a").key == "job/0"
+
+
+def test_failed_jobs_are_retried(tmp_path):
+    queue = JobQueue(tmp_path / "queue.sqlite", max_attempts=2)
+    queue.add(_jobs(1))
+
+    def handler(job):
+        raise ValueError(f"attempt {job.attempts}")
+
+    assert queue.work(handler, "a") == 0
+    assert queue.counts()["failed"] == 1
+    assert queue.failures() == {"job/0": "ValueError: attempt 2"}
+    assert queue.claim("a") is None
+
+    assert queue.add(_jobs(1)) == 0
+    assert queue.add(_jobs(1), retry_failed=True) == 1
+    assert queue.counts()["pending"] == 1
+
+
+def test_expired_leases_are_reclaimed(tmp_path):
+    queue = JobQueue(tmp_path / "queue.sqlite", lease_seconds=0.05, max_attempts=2)
+    queue.add(_jobs(1))
+    crashed_job = queue.claim("crashed")
+    assert queue.claim("b") is None
+
+    time.sleep(0.1)
+    job = queue.claim("b")
+    assert job.key == crashed_job.key and job.attempts == 2
+    # The crashed worker can no longer complete the job
+    assert not queue.renew(crashed_job, "crashed")
+    queue.complete(crashed_job, "crashed")
+    assert queue.counts()["running"] == 1
+
+    # A job whose last attempt's lease expires is given up on
+    time.sleep(0.1)
+    assert queue.claim("c") is None
+    assert queue.failures() == {"job/0": "Lease expired"}
+
+
+def test_leases_are_renewed_while_working(tmp_path):
+    queue = JobQueue(tmp_path / "queue.sqlite", lease_seconds=0.1)
+    queue.add(_jobs(1))
+
+    def handler(job):
+        time.sleep(0.3)
+        assert queue.claim("other") is None
+
+    assert queue.work(handler, "a") == 1
+    assert queue.keys(JobState.Done) == ["job/0"]
+
+
+def test_workers_share_a_queue(tmp_path):
+    db_path = tmp_path / "queue.sqlite"
+    JobQueue(db_path).add(_jobs(40))
+    with Pool(4) as p:
+        assert sum(p.map(_work_helper, [db_path] * 4)) == 40
+    assert JobQueue(db_path).counts()["done"] == 40
@@ -0,0 +1,43 @@
+import dask.array as da
+import numpy as np
+import pytest
+import rasterio
+import rasterio.transform
+import rioxarray  # noqa: F401
+import xarray as xr
+
+from sample.mosaic_writer import MosaicWriter
+
+
+def _lazy_mosaic(height, width):
+    values = np.linspace(-10, 300, 3 * height * width).reshape(3, height, width)
+    values[:, :5, :5] = np.nan
+    transform = rasterio.transform.from_origin(500000, 4000000, 10, 10)
+    mosaic = xr.DataArray(da.from_array(values, chunks=(1, 100, 100)), dims=("band", "y", "x"))
+    mosaic = mosaic.rio.write_crs("EPSG:32618").rio.write_transform(transform)
+    return mosaic, values, transform
+
+
+def test_write_mosaic_in_chunks(tmp_path):
+    mosaic, values, transform = _lazy_mosaic(300, 200)
+    output_path = tmp_path / "mosaic.tif"
+    writer = MosaicWriter(num_threads=2, memory_limit_bytes=1, chunk_size=128, block_size=64)
+    writer.write(mosaic, output_path)
+
+    expected = np.clip(np.nan_to_num(values, nan=0), 0, 255).astype(np.uint8)
+    with rasterio.open(output_path) as ds:
+        assert ds.dtypes == ("uint8", "uint8", "uint8")
+        assert ds.crs.to_epsg() == 32618
+        assert ds.transform == transform
+        assert ds.nodata == 0
+        assert ds.profile["tiled"]
+        assert ds.block_shapes[0] == (64, 64)
+        assert ds.compression is not None
+        assert ds.overviews(1) == [2, 4, 8]
+        np.testing.assert_array_equal(ds.read(), expected)
+    assert list(tmp_path.iterdir()) == [output_path]
+
+
+def test_chunk_size_must_align_with_blocks():
+    with pytest.raises(ValueError):
+        MosaicWriter(chunk_size=1000, block_size=512)
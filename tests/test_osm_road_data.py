@@ -1,3 +1,144 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+import rasterio
+import rasterio.crs
+import rasterio.io
+import rasterio.transform
+import rasterio.warp
+import rasterio.windows
+
+from sample import osm_road_data as osm_road_data_module
+from sample.osm_road_data import OSMRoadData
+
+TEST_CITY_GRAPHML_FILE = Path("data/osm_networks/13.graphml.gz")  # Hartford, CT - smallest city in the dataset
+
+
+@pytest.fixture(scope="module")
+def osm_road_data():
+    return OSMRoadData(TEST_CITY_GRAPHML_FILE)
+
+
+@pytest.fixture
+def visual_ds(osm_road_data):
+    # Synthetic lat/lon image covering the city, so roads have to be reprojected
+    bounds = rasterio.warp.transform_bounds(
+        osm_road_data.osm_graph_edges_gdf.crs, "EPSG:4326", *osm_road_data.osm_graph_edges_gdf.total_bounds
+    )
+    with rasterio.io.MemoryFile() as memfile:
+        with memfile.open(
+            driver="GTiff",
+            width=600,
+            height=500,
+            count=3,
+            dtype="uint8",
+            crs="EPSG:4326",
+            transform=rasterio.transform.from_bounds(*bounds, 600, 500),
+        ):
+            pass
+        with memfile.open() as ds:
+            yield ds
+
+
+def test_missing_roads_are_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        OSMRoadData()
+    with pytest.raises(FileNotFoundError):
+        OSMRoadData(tmp_path / "missing.graphml.gz")
+
+
+def test_road_image_from_synthetic_rasterio_dataset(osm_road_data, visual_ds):
+    roads_img = osm_road_data.road_image_from_bounding_rasterio_dataset(visual_ds)
+    assert roads_img.shape == (3, 500, 600)
+    assert roads_img.dtype == np.uint8
+    assert set(np.unique(roads_img)) == {0, 255}
+    assert all(roads_img[channel].max() == 255 for channel in range(3))
+
+    # Reusing an output buffer gives the same image
+    out = np.full_like(roads_img, 7)
+    reused_img = osm_road_data.road_image_from_bounding_rasterio_dataset(visual_ds, out=out)
+    assert reused_img is out
+    np.testing.assert_array_equal(reused_img, roads_img)
+
+
+def test_direct_road_image_matches_reprojected(osm_road_data, visual_ds):
+    reprojected_img = osm_road_data.road_image_from_bounding_rasterio_dataset(visual_ds)
+    direct_img = osm_road_data.road_image_from_bounding_rasterio_dataset(visual_ds, direct=True)
+    assert direct_img.shape == reprojected_img.shape
+    assert set(np.unique(direct_img)) == {0, 255}
+
+    # Both modes burn the same roads, up to the resampling of the reprojected image
+    for channel in range(3):
+        direct_pixels = direct_img[channel] > 0
+        reprojected_pixels = reprojected_img[channel] > 0
+        overlap = np.sum(direct_pixels & reprojected_pixels) / np.sum(direct_pixels | reprojected_pixels)
+        assert overlap > 0.5
+
+    # Roads transformed for the first scene are reused, not transformed again
+    geometries, is_transformed = osm_road_data._transformed_geometries[visual_ds.crs.to_wkt()]
+    transformed_geometries = geometries[is_transformed].copy()
+    reused_img = osm_road_data.road_image_from_bounding_rasterio_dataset(visual_ds, direct=True)
+    np.testing.assert_array_equal(reused_img, direct_img)
+    assert all(a is b for a, b in zip(geometries[is_transformed], transformed_geometries))
+
+
+def test_direct_windows_mosaic_into_full_image(osm_road_data, visual_ds):
+    full_img = osm_road_data.road_image_from_bounding_rasterio_dataset(visual_ds, direct=True)
+    window = rasterio.windows.Window(100, 150, 256, 200)
+    window_img = osm_road_data.road_image_for_window(visual_ds, window, direct=True)
+    np.testing.assert_array_equal(window_img, full_img[:, 150:350, 100:356])
+
+
+def test_windowed_write_warps_grid_once(osm_road_data, visual_ds, tmp_path, monkeypatch):
+    warped_grid_calls = []
+    warped_grid = osm_road_data._warped_grid
+
+    def counting_warped_grid(*args):
+        warped_grid_calls.append(args)
+        return warped_grid(*args)
+
+    monkeypatch.setattr(osm_road_data, "_warped_grid", counting_warped_grid)
+    osm_road_data.write_road_image(visual_ds, tmp_path / "roads.tif", windowed=True, block_size=128)
+    assert len(warped_grid_calls) == 1
+    monkeypatch.undo()
+
+    with rasterio.open(tmp_path / "roads.tif") as ds:
+        windowed_img = ds.read()
+    full_img = osm_road_data.road_image_from_bounding_rasterio_dataset(visual_ds)
+    assert (windowed_img == full_img).mean() > 0.99
+
+
+def test_road_coverage_matches_downsampled_road_image(osm_road_data, monkeypatch):
+    # 100 m pixels over downtown Hartford, in the graph's CRS
+    transform = rasterio.transform.from_origin(690000, 4628000, 100, 100)
+    crs = rasterio.crs.CRS.from_epsg(32618)
+    fine_img = osm_road_data.road_image_for_grid(crs, transform * rasterio.Affine.scale(1 / 10), 600, 500, direct=True)
+    expected = np.floor(fine_img.reshape(3, 50, 10, 60, 10).mean(axis=(2, 4)) + 0.5).astype(np.uint8)
+
+    # Several strips of fine rows
+    monkeypatch.setattr(osm_road_data_module, "COVERAGE_STRIP_PIXELS", 60_000)
+    coverage_img = osm_road_data.road_coverage_for_grid(crs, transform, 60, 50, supersample=10)
+    assert coverage_img.dtype == np.uint8
+    assert 0 < coverage_img.max() < 255
+    np.testing.assert_array_equal(coverage_img, expected)
+
+
+def test_write_road_coverage(osm_road_data, visual_ds, tmp_path):
+    resolution = 10 * visual_ds.res[0]
+    for windowed in [False, True]:
+        output_path = tmp_path / f"coverage_{windowed}.tif"
+        osm_road_data.write_road_image(
+            visual_ds, output_path, windowed=windowed, block_size=16, coverage_resolution=resolution
+        )
+        with rasterio.open(output_path) as ds:
+            assert ds.shape == (int(np.ceil(visual_ds.height * visual_ds.res[1] / resolution)), 60)
+            assert ds.res == pytest.approx((resolution, resolution))
+            assert ds.bounds.left == visual_ds.bounds.left and ds.bounds.top == visual_ds.bounds.top
+            coverage_img = ds.read()
+    assert coverage_img.max() > 0
+
+
 # def test_road_image_from_road_image_from_bounding_rasterio_dataset():
 #     test_city_id = 13  # Hartford, CT - smallest city in the dataset
 #     cities_osm_folder = Path("data/osm_networks")
@@ -0,0 +1,185 @@
+from pathlib import Path
+
+import numpy as np
+import rasterio
+import rasterio.transform
+import rasterio.warp
+
+from sample.job_queue import JobQueue
+from sample.osm_road_data import SIMPLE_TYPE_TO_OSM_HIGHWAY_TYPE_MAPPING
+from sample.osm_road_generator import OSMRoadGenerator
+from sample.regional_road_store import build_regional_store
+
+TEST_CITY_ID = 13  # Hartford, CT - smallest city in the dataset
+
+
+def _write_test_visual_tif(
+    root_s2_img_path, year=2021, season="summer", width=700, height=650, utm_bounds=(690000, 4622000, 696000, 4628000)
+):
+    # Synthetic lat/lon image over downtown Hartford
+    bounds = rasterio.warp.transform_bounds("EPSG:32618", "EPSG:4326", *utm_bounds)
+    tif_path = root_s2_img_path / str(TEST_CITY_ID) / str(year) / f"{season}.tif"
+    tif_path.parent.mkdir(parents=True, exist_ok=True)
+    with rasterio.open(
+        tif_path,
+        "w",
+        driver="GTiff",
+        width=width,
+        height=height,
+        count=3,
+        dtype="uint8",
+        crs="EPSG:4326",
+        transform=rasterio.transform.from_bounds(*bounds, width, height),
+    ) as dst:
+        dst.write(np.zeros((3, height, width), dtype=np.uint8))
+
+
+def test_generate_roads_windowed(tmp_path):
+    root_s2_img_path = tmp_path / "sentinel2_images"
+    _write_test_visual_tif(root_s2_img_path)
+
+    road_imgs = {}
+    for windowed in [False, True]:
+        root_osm_output_path = tmp_path / f"osm_images_{windowed}"
+        generator = OSMRoadGenerator(
+            root_s2_img_path=root_s2_img_path,
+            root_osm_output_path=root_osm_output_path,
+            windowed=windowed,
+            block_size=256,
+        )
+        assert generator._generate_roads_helper(TEST_CITY_ID) is None
+
+        with rasterio.open(root_osm_output_path / f"{TEST_CITY_ID}.tif") as ds:
+            assert ds.shape == (650, 700)
+            assert ds.block_shapes == [(256, 256)] * 3
+            road_imgs[windowed] = ds.read()
+
+    assert road_imgs[True].max() == 255
+    assert (road_imgs[True] == road_imgs[False]).mean() > 0.99
+
+
+def test_generate_roads_per_grid(tmp_path):
+    root_s2_img_path = tmp_path / "sentinel2_images"
+    _write_test_visual_tif(root_s2_img_path, 2021, "summer")
+    _write_test_visual_tif(root_s2_img_path, 2021, "fall")
+    _write_test_visual_tif(root_s2_img_path, 2022, "summer", width=350, height=325)
+
+    root_osm_output_path = tmp_path / "osm_images"
+    generator = OSMRoadGenerator(
+        root_s2_img_path=root_s2_img_path,
+        root_osm_output_path=root_osm_output_path,
+        per_grid=True,
+    )
+    tasks = generator._get_city_road_tasks(TEST_CITY_ID)
+    assert len(tasks) == 2
+    assert generator._generate_roads_helper(TEST_CITY_ID) is None
+
+    city_output_path = root_osm_output_path / str(TEST_CITY_ID)
+    assert (city_output_path / "2021" / "fall.tif").samefile(city_output_path / "2021" / "summer.tif")
+    with rasterio.open(city_output_path / "2022" / "summer.tif") as ds:
+        assert ds.shape == (325, 350)
+
+
+def test_generate_roads_queued(tmp_path):
+    root_s2_img_path = tmp_path / "sentinel2_images"
+    _write_test_visual_tif(root_s2_img_path, 2021, "summer")
+    _write_test_visual_tif(root_s2_img_path, 2022, "summer", width=350, height=325)
+    root_osm_output_path = tmp_path / "osm_images"
+    queue_path = tmp_path / "queue.sqlite"
+
+    def generate():
+        generator = OSMRoadGenerator(
+            root_s2_img_path=root_s2_img_path, root_osm_output_path=root_osm_output_path, per_grid=True
+        )
+        generator.generate_roads_queued(queue_path, num_workers=2)
+        return generator
+
+    generator = generate()
+    assert JobQueue(queue_path).counts() == {"pending": 0, "running": 0, "done": 2, "failed": 0}
+    for year in [2021, 2022]:
+        output_path = root_osm_output_path / str(TEST_CITY_ID) / str(year) / "summer.tif"
+        assert generator.manifest.is_up_to_date(
+            output_path, generator._get_road_task_inputs(generator._get_city_road_tasks(TEST_CITY_ID)[year - 2021])
+        )
+
+    # Up-to-date outputs aren't queued again
+    mtime = (root_osm_output_path / str(TEST_CITY_ID) / "2021" / "summer.tif").stat().st_mtime_ns
+    generate()
+    assert (root_osm_output_path / str(TEST_CITY_ID) / "2021" / "summer.tif").stat().st_mtime_ns == mtime
+
+
+def test_generate_roads_from_regional_store(tmp_path):
+    root_s2_img_path = tmp_path / "sentinel2_images"
+    # Extends well east of the city's bounds, where the graphml still has roads
+    _write_test_visual_tif(root_s2_img_path, utm_bounds=(692000, 4622000, 702000, 4628000))
+    store_path = tmp_path / "region.roads"
+    build_regional_store(Path("data/osm_networks/13.graphml.gz"), store_path, SIMPLE_TYPE_TO_OSM_HIGHWAY_TYPE_MAPPING)
+
+    road_imgs = {}
+    for regional in [False, True]:
+        root_osm_output_path = tmp_path / f"osm_images_{regional}"
+        generator = OSMRoadGenerator(
+            root_s2_img_path=root_s2_img_path,
+            root_osm_output_path=root_osm_output_path,
+            regional_store_path=store_path if regional else None,
+        )
+        if regional:
+            # No per-city graphml files
+            generator.cities_osm_folder = tmp_path / "osm_networks"
+        assert generator._generate_roads_helper(TEST_CITY_ID) is None
+        with rasterio.open(root_osm_output_path / f"{TEST_CITY_ID}.tif") as ds:
+            road_imgs[regional] = ds.read()
+
+    assert road_imgs[False][:, :, -50:].any()
+    np.testing.assert_array_equal(road_imgs[True], road_imgs[False])
+
+
+def test_generate_roads_per_grid_from_regional_store(tmp_path):
+    root_s2_img_path = tmp_path / "sentinel2_images"
+    # Two grids that don't overlap, the second east of the city's bounds
+    _write_test_visual_tif(root_s2_img_path, 2021, utm_bounds=(690000, 4622000, 696000, 4628000))
+    _write_test_visual_tif(root_s2_img_path, 2022, utm_bounds=(697000, 4622000, 702000, 4628000))
+    store_path = tmp_path / "region.roads"
+    build_regional_store(Path("data/osm_networks/13.graphml.gz"), store_path, SIMPLE_TYPE_TO_OSM_HIGHWAY_TYPE_MAPPING)
+
+    road_imgs = {}
+    for regional in [False, True]:
+        root_osm_output_path = tmp_path / f"osm_images_{regional}"
+        generator = OSMRoadGenerator(
+            root_s2_img_path=root_s2_img_path,
+            root_osm_output_path=root_osm_output_path,
+            per_grid=True,
+            regional_store_path=store_path if regional else None,
+        )
+        if regional:
+            generator.cities_osm_folder = tmp_path / "osm_networks"
+        assert generator._generate_roads_helper(TEST_CITY_ID) is None
+        for year in [2021, 2022]:
+            with rasterio.open(root_osm_output_path / str(TEST_CITY_ID) / str(year) / "summer.tif") as ds:
+                road_imgs[regional, year] = ds.read()
+
+    for year in [2021, 2022]:
+        assert road_imgs[False, year].any()
+        np.testing.assert_array_equal(road_imgs[True, year], road_imgs[False, year])
+
+
+def test_generate_roads_skips_up_to_date_outputs(tmp_path):
+    root_s2_img_path = tmp_path / "sentinel2_images"
+    _write_test_visual_tif(root_s2_img_path)
+    root_osm_output_path = tmp_path / "osm_images"
+    output_path = root_osm_output_path / f"{TEST_CITY_ID}.tif"
+
+    def generate(force=False):
+        generator = OSMRoadGenerator(root_s2_img_path=root_s2_img_path, root_osm_output_path=root_osm_output_path)
+        assert generator._generate_roads_helper(TEST_CITY_ID, force=force) is None
+        return output_path.stat().st_mtime_ns
+
+    first_mtime = generate()
+    assert generate() == first_mtime
+    assert generate(force=True) != first_mtime
+
+    # A changed input grid invalidates the output
+    forced_mtime = output_path.stat().st_mtime_ns
+    _write_test_visual_tif(root_s2_img_path, width=350, height=325)
+    assert generate() != forced_mtime
+    assert sorted(path.name for path in root_osm_output_path.iterdir()) == [f"{TEST_CITY_ID}.tif", "manifest.json"]
@@ -0,0 +1,90 @@
+import matplotlib.image
+import matplotlib.pyplot as plt
+import numpy as np
+import rasterio
+import rasterio.transform
+from rasterio.enums import Resampling
+
+from sample.preview import PreviewGenerator, preview_shape, read_preview
+
+
+def _write_tif(path, values):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    profile = dict(
+        driver="GTiff",
+        width=values.shape[2],
+        height=values.shape[1],
+        count=values.shape[0],
+        dtype="uint8",
+        crs="EPSG:32618",
+        transform=rasterio.transform.from_origin(500000, 4000000, 10, 10),
+    )
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(values)
+
+
+def test_preview_shape():
+    assert preview_shape(2000, 1000, 500) == (500, 250)
+    assert preview_shape(100, 3000, 300) == (10, 300)
+    assert preview_shape(100, 50, 500) == (100, 50)
+
+
+def test_read_preview_averages_pixels(tmp_path):
+    values = np.zeros((3, 64, 128), dtype=np.uint8)
+    values[:, :, 64:] = 200
+    _write_tif(tmp_path / "image.tif", values)
+
+    preview = read_preview(tmp_path / "image.tif", max_size=16)
+    assert preview.shape == (8, 16, 3)
+    assert (preview[:, :8] == 0).all()
+    assert (preview[:, 8:] == 200).all()
+
+
+def test_read_preview_keeps_thin_roads(tmp_path):
+    values = np.zeros((3, 64, 128), dtype=np.uint8)
+    values[:, ::8, :] = 255
+    _write_tif(tmp_path / "roads.tif", values)
+
+    assert read_preview(tmp_path / "roads.tif", max_size=16).max() == 32
+    preview = read_preview(tmp_path / "roads.tif", max_size=16, resampling=Resampling.max)
+    assert preview.shape == (8, 16, 3)
+    assert (preview == 255).all()
+
+
+def test_generate_previews(tmp_path):
+    rng = np.random.default_rng(0)
+    _write_tif(
+        tmp_path / "sentinel2_images" / "1" / "2021" / "summer.tif", rng.integers(0, 256, (3, 400, 400), np.uint8)
+    )
+    _write_tif(tmp_path / "osm_images" / "1.tif", rng.integers(0, 256, (3, 400, 400), np.uint8))
+    # No road raster
+    _write_tif(tmp_path / "sentinel2_images" / "2" / "2021" / "summer.tif", rng.integers(0, 256, (3, 40, 40), np.uint8))
+
+    preview_generator = PreviewGenerator(
+        tmp_path / "sentinel2_images", tmp_path / "osm_images", tmp_path / "plots", max_size=100, dpi=50
+    )
+    failed_tasks = preview_generator.generate_previews([(1, "City A"), (2, "City B")], parallel=False)
+
+    assert failed_tasks == []
+    assert [path.name for path in (tmp_path / "plots").iterdir()] == ["City A.png"]
+    height, width = matplotlib.image.imread(tmp_path / "plots" / "City A.png").shape[:2]
+    assert (height, width) == (125, 200)
+    assert plt.get_fignums() == []
+
+
+def test_preview_pairs_mosaic_with_road_raster_on_its_grid(tmp_path):
+    rng = np.random.default_rng(0)
+    s2_path, osm_path = tmp_path / "sentinel2_images", tmp_path / "osm_images"
+    # Per-grid road rasters: fall has none, and the city's own raster is on neither grid
+    _write_tif(s2_path / "3" / "2021" / "fall.tif", rng.integers(0, 256, (3, 40, 40), np.uint8))
+    _write_tif(s2_path / "3" / "2021" / "summer.tif", rng.integers(0, 256, (3, 200, 400), np.uint8))
+    _write_tif(osm_path / "3" / "2021" / "summer.tif", rng.integers(0, 256, (3, 200, 400), np.uint8))
+    _write_tif(osm_path / "3.tif", rng.integers(0, 256, (3, 100, 100), np.uint8))
+
+    preview_generator = PreviewGenerator(s2_path, osm_path, tmp_path / "plots", max_size=100, dpi=50)
+    task = preview_generator.get_city_preview_task(3, "City C")
+    assert task.visual_tif_path == s2_path / "3" / "2021" / "summer.tif"
+    assert task.road_tif_path == osm_path / "3" / "2021" / "summer.tif"
+
+    (osm_path / "3" / "2021" / "summer.tif").unlink()
+    assert preview_generator.get_city_preview_task(3, "City C") is None
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+import rasterio
+import rasterio.transform
+from rasterio.windows import Window
+
+from sample.raster_io import CogOptions, Compression, cog_writer, overview_factors
+
+
+def _profile(width, height, dtype="uint8"):
+    return dict(
+        driver="GTiff",
+        width=width,
+        height=height,
+        count=2,
+        dtype=dtype,
+        nodata=0,
+        crs="EPSG:32618",
+        transform=rasterio.transform.from_origin(500000, 4000000, 10, 10),
+        compress="lzw",
+    )
+
+
+def test_overview_factors():
+    assert overview_factors(300, 200, 64) == [2, 4, 8]
+    assert overview_factors(512, 512, 512) == []
+    assert overview_factors(513, 100, 512) == [2]
+
+
+def test_write_cog_window_by_window(tmp_path):
+    values = np.random.default_rng(0).integers(1, 256, size=(2, 200, 300), dtype=np.uint8)
+    output_path = tmp_path / "roads.tif"
+    cog_options = CogOptions(compress=Compression.Zstd, level=9)
+
+    with cog_writer(output_path, _profile(300, 200), block_size=64, cog_options=cog_options) as dst:
+        for _, window in dst.block_windows(1):
+            dst.write(values[:, window.toslices()[0], window.toslices()[1]], window=window)
+
+    with rasterio.open(output_path) as ds:
+        assert ds.tags(ns="IMAGE_STRUCTURE")["LAYOUT"] == "COG"
+        assert ds.compression.name == "zstd"
+        assert ds.block_shapes[0] == (64, 64)
+        assert ds.overviews(1) == [2, 4, 8]
+        assert ds.nodata == 0
+        np.testing.assert_array_equal(ds.read(window=Window(10, 20, 100, 50)), values[:, 20:70, 10:110])
+        assert ds.read(1, out_shape=(25, 38)).shape == (25, 38)
+    assert list(tmp_path.iterdir()) == [output_path]
+
+
+def test_write_float_cog_without_overviews(tmp_path):
+    values = np.linspace(0, 1, 2 * 100 * 100, dtype=np.float32).reshape(2, 100, 100)
+    output_path = tmp_path / "mosaic.tif"
+
+    with cog_writer(output_path, _profile(100, 100, "float32"), 64, CogOptions(overviews=False)) as dst:
+        dst.write(values)
+
+    with rasterio.open(output_path) as ds:
+        assert ds.overviews(1) == []
+        np.testing.assert_array_equal(ds.read(), values)
+
+
+def test_failed_write_leaves_no_files(tmp_path):
+    with pytest.raises(RuntimeError):
+        with cog_writer(tmp_path / "roads.tif", _profile(100, 100)):
+            raise RuntimeError("Failed")
+    assert list(tmp_path.iterdir()) == []
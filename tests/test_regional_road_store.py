@@ -0,0 +1,126 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+import rasterio.transform
+import rasterio.warp
+import shapely
+
+from sample.osm_road_data import SIMPLE_TYPE_TO_OSM_HIGHWAY_TYPE_MAPPING, OSMRoadData
+from sample.regional_road_store import (
+    RegionalRoadStore,
+    _spill_sorted_chunk,
+    build_regional_store,
+    merge_sorted_chunks,
+)
+from sample.road_network_cache import load_road_network
+from sample.road_query_engine import ROAD_CLASSES, UNMAPPED_ROAD_CLASS
+
+TEST_CITY_GRAPHML_FILE = Path("data/osm_networks/13.graphml.gz")  # Hartford, CT - smallest city in the dataset
+
+TEST_OSM_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+  <node id="1" lat="41.70" lon="-72.70"/>
+  <node id="2" lat="41.71" lon="-72.70"/>
+  <node id="3" lat="41.71" lon="-72.69"/>
+  <node id="4" lat="41.90" lon="-72.40"/>
+  <node id="5" lat="41.91" lon="-72.40"/>
+  <way id="10">
+    <nd ref="1"/><nd ref="2"/><nd ref="3"/>
+    <tag k="highway" v="residential"/>
+  </way>
+  <way id="11">
+    <nd ref="1"/><nd ref="3"/>
+    <tag k="highway" v="footway"/>
+  </way>
+  <way id="12">
+    <nd ref="4"/><nd ref="5"/><nd ref="99"/>
+    <tag k="highway" v="motorway"/>
+    <tag k="name" v="Outside"/>
+  </way>
+  <way id="13">
+    <nd ref="2"/><nd ref="99"/>
+    <tag k="highway" v="primary"/>
+  </way>
+  <relation id="20"><member type="way" ref="10" role=""/></relation>
+</osm>
+"""
+
+
+@pytest.fixture(scope="module")
+def graphml_store_path(tmp_path_factory):
+    store_path = tmp_path_factory.mktemp("regional") / "hartford.roads"
+    # Small partitions and buffers, so roads are spilled and spread over many partitions
+    build_regional_store(
+        TEST_CITY_GRAPHML_FILE,
+        store_path,
+        SIMPLE_TYPE_TO_OSM_HIGHWAY_TYPE_MAPPING,
+        partition_size=2000,
+        buffer_coords=2_000,
+    )
+    return store_path
+
+
+def test_osm_xml_store(tmp_path):
+    osm_path = tmp_path / "region.osm"
+    osm_path.write_text(TEST_OSM_XML)
+    store_path = tmp_path / "region.roads"
+    build_regional_store(osm_path, store_path, SIMPLE_TYPE_TO_OSM_HIGHWAY_TYPE_MAPPING, buffer_coords=2)
+
+    store = RegionalRoadStore(store_path)
+    assert store.crs.to_epsg() == 4326
+    assert len(store.metadata["partitions"]) == 2
+
+    road_network = store.load((-72.75, 41.65, -72.65, 41.75))
+    # The footway isn't mapped, and the way with a single known node is dropped
+    assert road_network.road_class_codes.tolist() == [ROAD_CLASSES.index("local")]
+    np.testing.assert_allclose(
+        shapely.get_coordinates(road_network.geometries), [[-72.70, 41.70], [-72.70, 41.71], [-72.69, 41.71]]
+    )
+    assert len(store.load((-72.45, 41.85, -72.35, 41.95)).geometries) == 1
+    assert len(store.load((0, 0, 1, 1)).geometries) == 0
+
+
+def test_graphml_store_has_all_mapped_roads(graphml_store_path):
+    road_network = load_road_network(TEST_CITY_GRAPHML_FILE, SIMPLE_TYPE_TO_OSM_HIGHWAY_TYPE_MAPPING)
+    mapped = road_network.road_class_codes != UNMAPPED_ROAD_CLASS
+
+    store = RegionalRoadStore(graphml_store_path)
+    assert len(store.metadata["partitions"]) > 4
+    stored_network = store.load(tuple(shapely.total_bounds(road_network.geometries)), road_network.crs)
+    assert len(stored_network.geometries) == mapped.sum()
+    assert (
+        np.bincount(stored_network.road_class_codes).tolist()
+        == np.bincount(road_network.road_class_codes[mapped]).tolist()
+    )
+
+
+def test_osm_road_data_from_regional_store(graphml_store_path):
+    osm_road_data = OSMRoadData(TEST_CITY_GRAPHML_FILE)
+    left, bottom, right, top = 690000, 4622000, 696000, 4628000
+    bounds = rasterio.warp.transform_bounds("EPSG:32618", "EPSG:4326", left, bottom, right, top)
+    regional_road_data = OSMRoadData.from_regional_store(graphml_store_path, bounds)
+    assert len(regional_road_data.road_query_engine) < len(osm_road_data.road_query_engine)
+
+    transform = rasterio.transform.from_bounds(left, bottom, right, top, 600, 600)
+    expected_img = osm_road_data.road_image_for_grid(osm_road_data.osm_graph_edges_gdf.crs, transform, 600, 600)
+    regional_img = regional_road_data.road_image_for_grid(osm_road_data.osm_graph_edges_gdf.crs, transform, 600, 600)
+    assert expected_img.max() == 255
+    np.testing.assert_array_equal(regional_img, expected_img)
+
+
+def test_merge_sorted_chunks(tmp_path):
+    rng = np.random.default_rng(0)
+    chunk_ids = [rng.choice(1000, size=size, replace=False) for size in (300, 50, 500)]
+    chunks = [
+        _spill_sorted_chunk(tmp_path / f"chunk_{i}", ids, np.stack([ids, np.full(len(ids), i)], axis=1).astype(float))
+        for i, ids in enumerate(chunk_ids)
+    ]
+
+    # Blocks much smaller than the chunks, so the merge takes many rounds
+    ids, values = merge_sorted_chunks(chunks, tmp_path / "merged", block_size=30)
+    np.testing.assert_array_equal(ids, np.unique(np.concatenate(chunk_ids)))
+    np.testing.assert_array_equal(values[:, 0], ids)
+    # Values come from the first chunk each id appears in
+    first_chunk = [next(i for i, chunk in enumerate(chunk_ids) if node_id in chunk) for node_id in ids.tolist()]
+    np.testing.assert_array_equal(values[:, 1], first_chunk)
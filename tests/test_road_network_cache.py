@@ -0,0 +1,47 @@
+import json
+import os
+
+import networkx as nx
+import numpy as np
+import osmnx as ox
+import shapely
+from shapely.geometry import LineString
+
+from sample.osm_road_data import SIMPLE_TYPE_TO_OSM_HIGHWAY_TYPE_MAPPING
+from sample.road_network_cache import load_road_network, road_network_cache_path
+
+
+def _save_test_graphml(path, highway="residential"):
+    graph = nx.MultiDiGraph(crs="epsg:32618")
+    graph.add_node(1, x=0.0, y=0.0)
+    graph.add_node(2, x=100.0, y=0.0)
+    graph.add_node(3, x=100.0, y=100.0)
+    graph.add_edge(1, 2, highway="motorway", geometry=LineString([(0, 0), (50, 10), (100, 0)]))
+    graph.add_edge(2, 3, highway=highway)
+    ox.save_graphml(graph, path)
+
+
+def test_load_road_network_builds_and_reuses_cache(tmp_path):
+    graphml_path = tmp_path / "1.graphml"
+    _save_test_graphml(graphml_path)
+
+    road_network = load_road_network(graphml_path, SIMPLE_TYPE_TO_OSM_HIGHWAY_TYPE_MAPPING)
+    assert road_network.crs.to_epsg() == 32618
+    assert road_network.road_class_codes.tolist() == [0, 2]
+    assert shapely.equals(road_network.geometries[0], LineString([(0, 0), (50, 10), (100, 0)]))
+    assert shapely.equals(road_network.geometries[1], LineString([(100, 0), (100, 100)]))
+
+    # Touching the graphml without changing its contents keeps the cache
+    cache_path = road_network_cache_path(graphml_path)
+    cached_coords_mtime = (cache_path / "coords.npy").stat().st_mtime_ns
+    os.utime(graphml_path, ns=(0, 0))
+    cached_road_network = load_road_network(graphml_path, SIMPLE_TYPE_TO_OSM_HIGHWAY_TYPE_MAPPING)
+    assert (cache_path / "coords.npy").stat().st_mtime_ns == cached_coords_mtime
+    assert json.loads((cache_path / "metadata.json").read_text())["source"]["mtime_ns"] == 0
+    assert [path.name for path in cache_path.glob(".*.tmp")] == []
+    np.testing.assert_array_equal(cached_road_network.road_class_codes, road_network.road_class_codes)
+
+    # Changing the graphml rebuilds it
+    _save_test_graphml(graphml_path, highway="secondary")
+    rebuilt_road_network = load_road_network(graphml_path, SIMPLE_TYPE_TO_OSM_HIGHWAY_TYPE_MAPPING)
+    assert rebuilt_road_network.road_class_codes.tolist() == [0, 1]
@@ -0,0 +1,41 @@
+import numpy as np
+import shapely
+from shapely.geometry import LineString, box
+
+from sample.osm_road_data import SIMPLE_TYPE_TO_OSM_HIGHWAY_TYPE_MAPPING
+from sample.road_query_engine import UNMAPPED_ROAD_CLASS, RoadQueryEngine, classify_highways
+
+
+def _random_roads(n_roads=500, seed=0):
+    rng = np.random.default_rng(seed)
+    starts = rng.uniform(0, 1000, size=(n_roads, 2))
+    ends = starts + rng.normal(0, 25, size=(n_roads, 2))
+    geometries = np.array([LineString([tuple(s), tuple(e)]) for s, e in zip(starts, ends)], dtype=object)
+    highway_types = ["motorway", "primary", "residential", "footway"]
+    highways = [highway_types[i] for i in rng.integers(0, len(highway_types), size=n_roads)]
+    return geometries, highways
+
+
+def test_classify_highways():
+    codes = classify_highways(
+        ["motorway", "secondary_link", "living_street", "footway", ["residential", "tertiary"]],
+        SIMPLE_TYPE_TO_OSM_HIGHWAY_TYPE_MAPPING,
+    )
+    assert codes.tolist() == [0, 1, 2, UNMAPPED_ROAD_CLASS, UNMAPPED_ROAD_CLASS]
+
+
+def test_query_indices_matches_brute_force():
+    geometries, highways = _random_roads()
+    codes = classify_highways(highways, SIMPLE_TYPE_TO_OSM_HIGHWAY_TYPE_MAPPING)
+    engine = RoadQueryEngine(geometries, codes)
+
+    bbox = box(200, 300, 450, 600)
+    positions = engine.query_indices(bbox)
+
+    intersecting = ~shapely.is_empty(shapely.intersection(geometries, bbox))
+    for code, road_class in enumerate(engine.road_classes):
+        expected = np.flatnonzero(intersecting & (codes == code))
+        np.testing.assert_array_equal(positions[road_class], expected)
+
+    clipped = engine.clip(positions["local"], bbox)
+    assert all(shapely.covers(bbox.buffer(1e-9), clipped))
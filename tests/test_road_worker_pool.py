@@ -0,0 +1,87 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import rasterio
+import rasterio.transform
+
+from sample import instrumentation
+from sample.road_worker_pool import OSMRoadDataCache, RoadRasterTask, RoadWorkerPool
+
+TEST_CITY_GRAPHML_FILE = Path("data/osm_networks/13.graphml.gz")  # Hartford, CT - smallest city in the dataset
+
+
+def test_osm_road_data_cache_memory_budget():
+    cache = OSMRoadDataCache(memory_budget_bytes=1)
+    osm_road_data = cache.get(TEST_CITY_GRAPHML_FILE)
+    assert cache.get(TEST_CITY_GRAPHML_FILE) is osm_road_data
+    assert 0 < cache.total_nbytes() == osm_road_data.estimated_nbytes()
+
+    # Only the most recently used road network is kept when over budget
+    cache.get(TEST_CITY_GRAPHML_FILE.absolute())
+    assert list(cache.osm_road_data) == [TEST_CITY_GRAPHML_FILE.absolute()]
+
+
+def _write_visual_tifs(tmp_path):
+    tif_paths = []
+    for i, bounds in enumerate([(690000, 4622000, 693000, 4625000), (693000, 4625000, 696000, 4628000)]):
+        tif_path = tmp_path / f"visual_{i}.tif"
+        with rasterio.open(
+            tif_path,
+            "w",
+            driver="GTiff",
+            width=300,
+            height=300,
+            count=3,
+            dtype="uint8",
+            crs="EPSG:32618",
+            transform=rasterio.transform.from_bounds(*bounds, 300, 300),
+        ) as dst:
+            dst.write(np.zeros((3, 300, 300), dtype=np.uint8))
+        tif_paths.append(tif_path)
+    return tif_paths
+
+
+def test_road_worker_pool(tmp_path):
+    tasks = [
+        RoadRasterTask(13, TEST_CITY_GRAPHML_FILE, tif_path, tmp_path / f"roads_{i}.tif")
+        for i, tif_path in enumerate(_write_visual_tifs(tmp_path))
+    ]
+    tasks.append(RoadRasterTask(13, TEST_CITY_GRAPHML_FILE, tmp_path / "missing.tif", tmp_path / "roads_missing.tif"))
+
+    results = RoadWorkerPool(num_workers=2).run(tasks)
+
+    errors = {result.output_path.name: result.error for result in results}
+    assert errors["roads_0.tif"] is None and errors["roads_1.tif"] is None
+    assert errors["roads_missing.tif"] is not None
+    for i in range(2):
+        with rasterio.open(tmp_path / f"roads_{i}.tif") as ds:
+            assert ds.read().max() == 255
+
+
+def test_road_worker_pool_loads_each_network_once(tmp_path):
+    # The same graphml file under two paths, which the workers cache as two road networks
+    tasks = [
+        RoadRasterTask(13, graphml_path, tif_path, tmp_path / f"roads_{j}_{i}.tif")
+        for j, graphml_path in enumerate([TEST_CITY_GRAPHML_FILE, TEST_CITY_GRAPHML_FILE.absolute()])
+        for i, tif_path in enumerate(_write_visual_tifs(tmp_path))
+    ]
+    report_path = tmp_path / "report.json"
+    with instrumentation.profile_run(report_path):
+        results = RoadWorkerPool(num_workers=2).run(tasks)
+
+    assert all(result.error is None for result in results)
+    assert json.loads(report_path.read_text())["stages"]["graphml_load"]["count"] == 2
+
+
+def test_road_worker_pool_spreads_city_scenes_across_workers():
+    tasks = [RoadRasterTask(13, TEST_CITY_GRAPHML_FILE, Path(f"{i}.tif"), Path(f"roads_{i}.tif")) for i in range(5)]
+    tasks.append(RoadRasterTask(42, Path("42.graphml"), Path("42.tif"), Path("roads_42.tif")))
+
+    # Each worker's share is 3 tasks, so the first city is split between both workers
+    task_chunks = RoadWorkerPool(num_workers=2)._chunk_tasks(tasks)
+    assert [[task.visual_tif_path.name for task in task_chunk] for task_chunk in task_chunks] == [
+        ["0.tif", "1.tif", "2.tif"],
+        ["3.tif", "4.tif"],
+        ["42.tif"],
+    ]
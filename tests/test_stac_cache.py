@@ -0,0 +1,77 @@
+import json
+import time
+
+import pystac
+
+from sample.stac_cache import StacSearchCache
+from sample.stac_search import StacSearchQuery
+
+
+def _item_collection(cloud_covers):
+    features = [
+        {
+            "type": "Feature",
+            "stac_version": "1.0.0",
+            "id": f"item{i}",
+            "geometry": {"type": "Point", "coordinates": [0.0, 0.0]},
+            "bbox": [0.0, 0.0, 0.0, 0.0],
+            "properties": {"datetime": "2020-06-01T00:00:00Z", "eo:cloud_cover": cloud_cover},
+            "links": [],
+            "assets": {},
+        }
+        for i, cloud_cover in enumerate(cloud_covers)
+    ]
+    return pystac.ItemCollection.from_dict({"type": "FeatureCollection", "features": features})
+
+
+def test_narrower_cloud_cover_is_filtered_from_cache(tmp_path):
+    cache = StacSearchCache(tmp_path / "stac_cache.sqlite")
+    query = StacSearchQuery([0, 0, 1, 1], "2020-06-01/2020-08-31", max_cloudcover=20)
+    assert cache.get("sentinel-2-l2a", query) is None
+
+    cache.put("sentinel-2-l2a", query, _item_collection([1.0, 8.0, 15.0]))
+    assert [item.id for item in cache.get("sentinel-2-l2a", query)] == ["item0", "item1", "item2"]
+    narrower = cache.get("sentinel-2-l2a", query._replace(max_cloudcover=10))
+    assert [item.id for item in narrower] == ["item0", "item1"]
+
+    # Broader searches, and other collections or date ranges, aren't answered from the cache
+    assert cache.get("sentinel-2-l2a", query._replace(max_cloudcover=30)) is None
+    assert cache.get("sentinel-2-l1c", query) is None
+    assert cache.get("sentinel-2-l2a", query._replace(daterange="2021-06-01/2021-08-31")) is None
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 4
+
+    # A narrower search doesn't replace the broader cached one
+    cache.put("sentinel-2-l2a", query._replace(max_cloudcover=5), _item_collection([1.0]))
+    assert len(cache.get("sentinel-2-l2a", query)) == 3
+    cache.close()
+
+    # The cache persists across instances
+    reopened_cache = StacSearchCache(tmp_path / "stac_cache.sqlite")
+    assert len(reopened_cache.get("sentinel-2-l2a", query)) == 3
+
+
+def test_expired_and_evicted_entries_are_misses(tmp_path):
+    expired_cache = StacSearchCache(tmp_path / "expired.sqlite", ttl_seconds=-1)
+    query = StacSearchQuery([0, 0, 1, 1], "2020-06-01/2020-08-31")
+    expired_cache.put("sentinel-2-l2a", query, _item_collection([1.0]))
+    assert expired_cache.get("sentinel-2-l2a", query) is None
+    assert len(expired_cache) == 0
+
+    items = _item_collection([1.0, 2.0])
+    entry_nbytes = len(json.dumps([item.to_dict(transform_hrefs=False) for item in items]))
+    cache = StacSearchCache(tmp_path / "evicted.sqlite", max_size_bytes=2 * entry_nbytes)
+    queries = [query._replace(bounds=[i, 0, i + 1, 1]) for i in range(3)]
+    cache.put("sentinel-2-l2a", queries[0], items)
+    time.sleep(0.01)
+    cache.put("sentinel-2-l2a", queries[1], items)
+    time.sleep(0.01)
+    cache.get("sentinel-2-l2a", queries[0])
+    time.sleep(0.01)
+    cache.put("sentinel-2-l2a", queries[2], items)
+
+    # The least recently used entry is evicted
+    assert len(cache) == 2
+    assert cache.get("sentinel-2-l2a", queries[1]) is None
+    assert cache.get("sentinel-2-l2a", queries[0]) is not None
+    assert cache.get("sentinel-2-l2a", queries[2]) is not None
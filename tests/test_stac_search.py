@@ -0,0 +1,116 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from sample.stac_cache import StacSearchCache
+from sample.stac_search import StacSearchClient, StacSearchQuery
+
+
+def _stac_item(item_id, cloud_cover):
+    return {
+        "type": "Feature",
+        "stac_version": "1.0.0",
+        "id": item_id,
+        "geometry": {"type": "Point", "coordinates": [0.0, 0.0]},
+        "bbox": [0.0, 0.0, 0.0, 0.0],
+        "properties": {"datetime": "2020-06-01T00:00:00Z", "eo:cloud_cover": cloud_cover},
+        "links": [],
+        "assets": {},
+    }
+
+
+class _StubStacHandler(BaseHTTPRequestHandler):
+    """
+    Serves two pages of items for POST /search, failing the first request with a 503, and
+    fails every search with an empty date range.
+    """
+
+    requests_seen = []
+    fail_next = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/geo+json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.requests_seen.append(body)
+
+        if _StubStacHandler.fail_next:
+            _StubStacHandler.fail_next = False
+            self._send_json(503, {"code": "ServiceUnavailable"})
+        elif body["datetime"] == "":
+            self._send_json(400, {"code": "BadRequest"})
+        elif body.get("token") is None:
+            next_link = {
+                "rel": "next",
+                "href": f"http://{self.headers['Host']}/search",
+                "method": "POST",
+                "body": {"token": "page2"},
+                "merge": True,
+            }
+            self._send_json(
+                200,
+                {"type": "FeatureCollection", "features": [_stac_item("a", 1.0)], "links": [next_link]},
+            )
+        else:
+            self._send_json(200, {"type": "FeatureCollection", "features": [_stac_item("b", 5.0)], "links": []})
+
+
+@pytest.fixture
+def stac_server():
+    _StubStacHandler.requests_seen = []
+    _StubStacHandler.fail_next = True
+    server = HTTPServer(("127.0.0.1", 0), _StubStacHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_search_retries_and_follows_next_links(stac_server):
+    client = StacSearchClient(stac_server, backoff_factor=0)
+    items = client.search(StacSearchQuery([0, 0, 1, 1], "2020-06-01/2020-08-31", max_cloudcover=20))
+
+    assert [item.id for item in items] == ["a", "b"]
+    # The 503 is retried, and the merged next-page body keeps the original query
+    assert len(_StubStacHandler.requests_seen) == 3
+    page2_body = _StubStacHandler.requests_seen[-1]
+    assert page2_body["token"] == "page2"
+    assert page2_body["query"] == {"eo:cloud_cover": {"lte": 20}}
+
+
+def test_search_batch_keeps_order_and_returns_errors(stac_server):
+    client = StacSearchClient(stac_server, max_concurrency=4, backoff_factor=0)
+    queries = [
+        StacSearchQuery([0, 0, 1, 1], "2020-06-01/2020-08-31"),
+        StacSearchQuery([0, 0, 1, 1], ""),
+        StacSearchQuery([1, 1, 2, 2], "2021-06-01/2021-08-31"),
+    ]
+    results = client.search_batch(queries)
+
+    assert len(results) == 3
+    assert [item.id for item in results[0]] == ["a", "b"]
+    assert isinstance(results[1], Exception)
+    assert [item.id for item in results[2]] == ["a", "b"]
+
+
+def test_search_uses_cache(stac_server, tmp_path):
+    client = StacSearchClient(stac_server, backoff_factor=0, cache=StacSearchCache(tmp_path / "stac_cache.sqlite"))
+    query = StacSearchQuery([0, 0, 1, 1], "2020-06-01/2020-08-31", max_cloudcover=20)
+    assert [item.id for item in client.search(query)] == ["a", "b"]
+    num_requests = len(_StubStacHandler.requests_seen)
+
+    assert [item.id for item in client.search(query._replace(max_cloudcover=2))] == ["a"]
+    assert len(_StubStacHandler.requests_seen) == num_requests
+    assert client.cache.stats()["hits"] == 1
@@ -1,5 +1,13 @@
+import datetime
+
+import numpy as np
+import pystac
+import rasterio
+import rasterio.transform
+import rasterio.warp
 import xarray
 
+from sample.sentinel_downloader import Season, SentinelDownloader
 from sample.stackstac_downloader import StackStacDownloader
 
 
@@ -16,3 +24,88 @@ def test_stack_and_mosaic():
     assert isinstance(mosaic, xarray.core.dataarray.DataArray)
     assert mosaic.shape[0] == 3
     assert mosaic.dims == ("band", "y", "x")
+
+
+def _local_items(root, dates_and_values, size=64):
+    """
+    Creates STAC items with single-valued red, green and blue assets stored as local
+    GeoTIFFs in EPSG:32618, in the order given (i.e. by ascending cloud cover).
+    """
+    transform = rasterio.transform.from_origin(500000, 4000000, 10, 10)
+    items = []
+    for i, (date, value) in enumerate(dates_and_values):
+        item = pystac.Item(
+            f"item{i}",
+            geometry=None,
+            bbox=None,
+            datetime=datetime.datetime.fromisoformat(date),
+            properties={"eo:cloud_cover": i},
+        )
+        for band in ["red", "green", "blue"]:
+            asset_path = root / f"{i}_{band}.tif"
+            with rasterio.open(
+                asset_path,
+                "w",
+                driver="GTiff",
+                width=size,
+                height=size,
+                count=1,
+                dtype="uint16",
+                crs="EPSG:32618",
+                transform=transform,
+            ) as ds:
+                ds.write(np.full((1, size, size), value, dtype=np.uint16))
+            item.add_asset(
+                band,
+                pystac.Asset(
+                    str(asset_path),
+                    media_type=pystac.MediaType.GEOTIFF,
+                    extra_fields={
+                        "proj:epsg": 32618,
+                        "proj:transform": list(transform)[:6],
+                        "proj:shape": [size, size],
+                    },
+                ),
+            )
+        items.append(item)
+
+    bounds = rasterio.warp.transform_bounds(
+        "EPSG:32618",
+        "EPSG:4326",
+        *rasterio.transform.array_bounds(size, size, transform),
+    )
+    return pystac.ItemCollection(items), bounds
+
+
+def test_mosaic_groups_split_by_season(tmp_path):
+    items, bounds = _local_items(
+        tmp_path,
+        [
+            ("2021-07-01", 10),
+            ("2021-04-01", 20),
+            ("2022-01-15", 30),
+            ("2021-07-15", 40),
+            ("2021-10-01", 50),
+        ],
+    )
+    seasons = {(2021, Season.Summer), (2021, Season.Spring), (2021, Season.Winter)}
+    year_season = SentinelDownloader(stac_cache_path=None)._get_year_season
+
+    def _group_fn(item):
+        key = year_season(item.datetime)
+        return key if key in seasons else None
+
+    downloader = StackStacDownloader()
+    mosaics = downloader.stack_and_mosaic_groups(
+        None, bounds, _group_fn, items=items, epsg=32618, resolution=10, chunksize=32
+    )
+
+    # The January item belongs to the previous year's winter, and fall isn't requested
+    assert set(mosaics) == seasons
+    for mosaic in mosaics.values():
+        assert mosaic.dims == ("band", "y", "x")
+        assert mosaic.shape == mosaics[(2021, Season.Summer)].shape
+    # The lowest cloud cover item in each season is on top
+    assert np.nanmax(mosaics[(2021, Season.Summer)].values) == 10
+    assert np.nanmax(mosaics[(2021, Season.Spring)].values) == 20
+    assert np.nanmax(mosaics[(2021, Season.Winter)].values) == 30
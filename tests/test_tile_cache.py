@@ -0,0 +1,183 @@
+import re
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pystac
+import pytest
+import rasterio
+import rasterio.transform
+
+from sample.stackstac_downloader import StackStacDownloader
+from sample.tile_cache import TileCache, TileCacheProxy, stats_difference
+
+
+class _RangeFileHandler(BaseHTTPRequestHandler):
+    """
+    Serves files from `root`, supporting HEAD and single-range GET requests like S3.
+    """
+
+    root = None
+    requests_seen = []
+    # Bytes dropped from the end of ranged responses, as by a misbehaving server
+    truncate_bytes = 0
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.requests_seen.append(("HEAD", None))
+        self.send_response(200)
+        self.send_header("Content-Length", str((self.root / self.path.lstrip("/")).stat().st_size))
+        self.end_headers()
+
+    def do_GET(self):
+        data = (self.root / self.path.lstrip("/")).read_bytes()
+        size = len(data)
+        range_header = self.headers.get("Range")
+        self.requests_seen.append(("GET", range_header))
+        match = re.match(r"bytes=(\d+)-(\d+)$", range_header or "")
+        if match is None:
+            self.send_response(200)
+        else:
+            start, last = int(match.group(1)), min(int(match.group(2)), size - 1)
+            data = data[start : last + 1 - self.truncate_bytes]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{last}/{size}")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def cog_server(tmp_path):
+    served_path = tmp_path / "served"
+    served_path.mkdir()
+    values = np.random.default_rng(0).integers(1, 10000, (1, 1024, 1024), dtype=np.uint16)
+    with rasterio.open(
+        served_path / "B04.tif",
+        "w",
+        driver="COG",
+        width=1024,
+        height=1024,
+        count=1,
+        dtype="uint16",
+        crs="EPSG:32618",
+        transform=rasterio.transform.from_origin(500000, 4000000, 10, 10),
+        compress="deflate",
+    ) as ds:
+        ds.write(values)
+
+    _RangeFileHandler.root = served_path
+    _RangeFileHandler.requests_seen = []
+    _RangeFileHandler.truncate_bytes = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _RangeFileHandler)
+    # Don't wait for keep-alive connections on shutdown
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/B04.tif", values
+    server.shutdown()
+    server.server_close()
+
+
+def test_read_ranges(cog_server, tmp_path):
+    url, _ = cog_server
+    file_bytes = (_RangeFileHandler.root / "B04.tif").read_bytes()
+    tile_cache = TileCache(tmp_path / "cache", block_size=1000)
+
+    for start, stop in [(0, 10), (995, 2005), (1500, 1600), (len(file_bytes) - 5, len(file_bytes) + 100)]:
+        assert tile_cache.read(url, start, stop) == file_bytes[start:stop]
+    # Only the blocks that weren't already cached were fetched
+    assert tile_cache.stats()["hits"] == 2
+    assert tile_cache.stats()["bytes_fetched"] == 3000 + len(file_bytes) % 1000
+
+
+def test_truncated_ranges_are_not_cached(cog_server, tmp_path):
+    url, _ = cog_server
+    file_bytes = (_RangeFileHandler.root / "B04.tif").read_bytes()
+    tile_cache = TileCache(tmp_path / "cache", block_size=1000)
+
+    _RangeFileHandler.truncate_bytes = 10
+    with pytest.raises(RuntimeError, match="Expected 2000 bytes"):
+        tile_cache.read(url, 0, 2000)
+    assert tile_cache.stats()["bytes_fetched"] == 0
+
+    # The blocks are fetched again once the server sends them whole
+    _RangeFileHandler.truncate_bytes = 0
+    assert tile_cache.read(url, 0, 2000) == file_bytes[:2000]
+    assert tile_cache.stats()["hits"] == 0
+
+
+def test_stats_difference():
+    start_stats = {"hits": 2, "misses": 2, "hit_ratio": 0.5, "bytes_fetched": 2000, "bytes_saved": 2000}
+    stats = {"hits": 5, "misses": 3, "hit_ratio": 0.625, "bytes_fetched": 3000, "bytes_saved": 5000}
+    assert stats_difference(stats, start_stats) == {
+        "hits": 3,
+        "misses": 1,
+        "bytes_fetched": 1000,
+        "bytes_saved": 3000,
+        "hit_ratio": 0.75,
+    }
+
+
+def test_proxy_serves_cached_cog_blocks(cog_server, tmp_path):
+    url, values = cog_server
+
+    with TileCacheProxy(tmp_path / "cache", block_size=64 * 2**10) as proxy:
+        proxy_url = proxy.proxy_url(url)
+        # Disable GDAL's own in-memory cache, so every read goes through the proxy
+        gdal_env = rasterio.Env(
+            GDAL_DISABLE_READDIR_ON_OPEN="EMPTY_DIR",
+            CPL_VSIL_CURL_NON_CACHED=f"/vsicurl/{proxy_url.rsplit('/', 1)[0]}",
+        )
+        with gdal_env:
+            for _ in range(2):
+                with rasterio.open(proxy_url) as ds:
+                    np.testing.assert_array_equal(ds.read(1, window=((0, 300), (0, 300))), values[0, :300, :300])
+                n_requests = len(_RangeFileHandler.requests_seen)
+        stats = proxy.stats()
+
+    # The second read was served entirely from the cache
+    assert len(_RangeFileHandler.requests_seen) == n_requests
+    assert stats["hit_ratio"] == 0.5
+    assert stats["bytes_saved"] == stats["bytes_fetched"]
+
+
+def test_least_recently_used_blocks_are_evicted(cog_server, tmp_path):
+    url, _ = cog_server
+    tile_cache = TileCache(tmp_path / "cache", max_size_bytes=2000, block_size=1000)
+    tile_cache.read(url, 0, 2000)
+    tile_cache.read(url, 0, 10)
+    tile_cache.read(url, 2000, 3000)
+
+    # The second block was used least recently, so it was evicted
+    tile_cache.read(url, 0, 1000)
+    tile_cache.read(url, 2000, 3000)
+    assert tile_cache.stats()["hits"] == 3
+    tile_cache.read(url, 1000, 2000)
+    assert tile_cache.stats()["misses"] == 4
+
+
+def test_downloader_reads_assets_through_proxy(tmp_path):
+    item = pystac.Item("item", geometry=None, bbox=None, datetime=datetime(2020, 6, 1), properties={})
+    item.add_asset("red", pystac.Asset("https://example.com/B04.tif"))
+    item.add_asset("thumbnail", pystac.Asset("https://example.com/thumbnail.jpg"))
+
+    with StackStacDownloader(tile_cache_dir=tmp_path / "cache") as downloader:
+        proxied_item = downloader._proxy_asset_hrefs(pystac.ItemCollection([item]), ["red"]).items[0]
+        assert proxied_item.assets["red"].href.startswith("http://127.0.0.1:")
+        assert proxied_item.assets["red"].href.endswith("B04.tif")
+        assert proxied_item.assets["thumbnail"].href == "https://example.com/thumbnail.jpg"
+        assert item.assets["red"].href == "https://example.com/B04.tif"
+        assert downloader.tile_cache_stats()["hits"] == 0
+        proxy_process = downloader.tile_cache_proxy.process
+
+    # The proxy is stopped with the downloader
+    assert downloader.tile_cache_proxy is None and not proxy_process.is_alive()
+
+    # Without a tile cache folder, assets are read directly
+    direct_item = StackStacDownloader()._proxy_asset_hrefs(pystac.ItemCollection([item]), ["red"]).items[0]
+    assert direct_item.assets["red"].href == "https://example.com/B04.tif"
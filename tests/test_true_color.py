@@ -0,0 +1,46 @@
+import dask.array as da
+import numpy as np
+import xarray as xr
+
+from sample.true_color import StretchMode, stretch_to_uint8
+
+
+def _mosaic():
+    values = np.tile(np.linspace(0, 0.6, 100), (3, 100, 1))
+    values[:, :10] = np.nan
+    values[1] *= 0.4
+    return xr.DataArray(
+        da.from_array(values, chunks=(1, 50, 50)),
+        dims=("band", "y", "x"),
+        coords={"band": ["red", "green", "blue"]},
+        attrs={"crs": "epsg:32618"},
+    )
+
+
+def test_gain_stretch():
+    mosaic = _mosaic()
+    stretched = stretch_to_uint8(mosaic, gain=255 / 0.3)
+
+    assert stretched.dtype == np.uint8
+    assert stretched.dims == mosaic.dims
+    assert stretched.attrs == mosaic.attrs
+    assert stretched["band"].values.tolist() == ["red", "green", "blue"]
+    assert stretched.data.chunks == mosaic.data.chunks
+
+    values = stretched.values
+    # NaN and zero reflectance are nodata, and valid pixels start at 1
+    assert (values[:, :10] == 0).all()
+    assert (values[:, 10:, 0] == 0).all()
+    assert (values[:, 10:, 1:] >= 1).all()
+    # Reflectances of 0.3 and above saturate
+    assert (values[0, 10:, 50:] == 255).all()
+    assert values[1, 10:, 50:].max() < 255
+
+
+def test_percentile_stretch():
+    stretched = stretch_to_uint8(_mosaic(), mode=StretchMode.Percentile, percentiles=(0, 100), sample_step=1).values
+
+    # Each band is stretched over its own range
+    for band in range(3):
+        assert (stretched[band, 10:, 1] == 1).all()
+        assert (stretched[band, 10:, -1] == 255).all()
@@ -0,0 +1,35 @@
+import logging
+
+from sample import utils
+from sample.utils import get_simple_logger, replace_directory
+
+
+def test_simple_logger_adds_one_handler():
+    logger = get_simple_logger("test_simple_logger")
+    assert get_simple_logger("test_simple_logger") is logger
+    assert len(logger.handlers) == 1
+    assert isinstance(logger.handlers[0], logging.StreamHandler)
+
+
+def _write_directory(path, contents):
+    path.mkdir()
+    (path / "data.txt").write_text(contents)
+
+
+def test_replace_directory(tmp_path, monkeypatch):
+    _write_directory(tmp_path / "tmp_1", "first")
+    replace_directory(tmp_path / "tmp_1", tmp_path / "cache")
+    _write_directory(tmp_path / "tmp_2", "second")
+    replace_directory(tmp_path / "tmp_2", tmp_path / "cache")
+    assert (tmp_path / "cache" / "data.txt").read_text() == "second"
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["cache"]
+
+    # Another process moved the old directory aside and its own one into place first
+    def rename_aside(src, dst):
+        raise FileNotFoundError(src)
+
+    monkeypatch.setattr(utils.os, "rename", rename_aside)
+    _write_directory(tmp_path / "tmp_3", "third")
+    replace_directory(tmp_path / "tmp_3", tmp_path / "cache")
+    assert (tmp_path / "cache" / "data.txt").read_text() == "second"
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["cache"]